@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Compare parse times for a large orchestrator queues file using the
+pure-Python YAML loader and the config loader used by the app
+(backed by libyaml, if available).
+
+Usage:
+    PYTHONPATH=. python benchmarks/bench_yaml.py [n_queues] [n_repeats]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import yaml
+
+from ga4ghtest.util import ConfigLoader
+
+
+class PurePythonLoader(yaml.SafeLoader):
+    """
+    Pure-Python loader with the same resolvers and constructors as the
+    config loader.
+    """
+    yaml_implicit_resolvers = ConfigLoader.yaml_implicit_resolvers
+    yaml_constructors = ConfigLoader.yaml_constructors
+
+
+def make_queues(n_queues):
+    return {
+        'queue_{}'.format(i): {
+            'target_queue': None,
+            'trs_id': 'dockstore',
+            'version_id': 'develop',
+            'wes_default': 'local',
+            'wes_opts': ['local', 'remote'],
+            'workflow_attachments': [
+                'https://example.org/workflows/{}/tool_{}.cwl'.format(i, j)
+                for j in range(3)],
+            'workflow_id': 'github.com/example/workflow-{}'.format(i),
+            'workflow_type': 'CWL',
+            'workflow_url': 'https://example.org/workflows/{}/main.cwl'
+                            .format(i)}
+        for i in range(n_queues)
+    }
+
+
+def main(n_queues=10000, n_repeats=3):
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml',
+                                     delete=False) as f:
+        yaml.dump(make_queues(n_queues), f, default_flow_style=False)
+        path = f.name
+    print("Parsing {} queues ({:.1f} MB), best of {}"
+          .format(n_queues, os.path.getsize(path) / 1e6, n_repeats))
+    try:
+        for name, loader in [('pure-Python SafeLoader', PurePythonLoader),
+                             ('ConfigLoader ({})'.format(
+                                 ConfigLoader.__bases__[0].__name__),
+                              ConfigLoader)]:
+            def load():
+                with open(path, 'rb') as f:
+                    return yaml.load(f, Loader=loader)
+            best = min(timeit.repeat(load, number=1, repeat=n_repeats))
+            print("  {:<32} {:8.3f}s".format(name, best))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -8,25 +8,78 @@ descriptors, parameters, and inputs to include with request.
 import logging
 import os
 import urllib
+import urllib.parse
 import json
 import re
 import glob
+import hashlib
+import threading
+import time
 import subprocess32
+import yaml
 
 import schema_salad.ref_resolver
 
-from io import StringIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
 from toil.wdl import wdl_parser
 from wes_service.util import visit
 
-from ga4ghtest.util import open_file, get_yaml, get_json
+from ga4ghtest.util import open_file, get_yaml, get_json, thaw, LazyFile
 from ga4ghtest.core.config import queue_config
 from ga4ghtest.core.config import set_yaml
+from ga4ghtest.core.config import set_yaml_entries
 from ga4ghtest.services.trs import TRSService
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# maximum number of concurrent TRS requests per workflow
+fetch_workers = 8
+
+# packed CWL descriptors, keyed by content hash of the descriptor tree
+packed_cwl_cache_size = 256
+_packed_cwl = OrderedDict()
+_packed_cwl_lock = threading.Lock()
+# cwltool changes global logging and loader state, so packing runs one
+# workflow at a time
+_pack_lock = threading.Lock()
+
+# parsed WDL ASTs and inputs, keyed by content hash of the descriptor
+wdl_cache_size = 128
+_wdl_cache = OrderedDict()
+_wdl_cache_lock = threading.Lock()
+
+# prepared request artifacts, keyed by workflow, params and staged
+# attachments (with their stat results); files up to shared_buffer_size
+# bytes are kept in memory and shared, as long as all shared buffers
+# stay within shared_buffer_limit bytes; other files are streamed for
+# each request. Prepared workflows with remote files are rebuilt after
+# prepared_remote_ttl seconds.
+prepared_cache_size = 32
+prepared_remote_ttl = 60
+shared_buffer_size = 8 * 1024 * 1024
+shared_buffer_limit = 64 * 1024 * 1024
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+_shared_bytes = 0
+_shared_bytes_lock = threading.Lock()
+
+# maximum number of threads used to expand and check attachments
+stage_workers = 16
+
+# descriptor prefix size used to find the workflow type version
+version_sniff_size = 8 * 1024
+_cwl_version_re = re.compile(
+    r'(?:^|[{,])\s*["\']?cwlVersion["\']?\s*:\s*["\']?([\w.\-]+)',
+    re.MULTILINE
+)
+_wdl_version_re = re.compile(r'^version\s+(\S+)')
+
+# CWL fields that reference other descriptor files
+_cwl_ref_fields = ('run', '$import', '$include', '$mixin')
+
 
 def fetch_queue_workflow(queue_id):
     """
@@ -39,32 +92,31 @@ def fetch_queue_workflow(queue_id):
     Returns:
         dict: dict with updated configuration for the workflow queue
     """
-    wf_config = queue_config()[queue_id]
+    wf_config = thaw(queue_config()[queue_id])
     logger.info("Retrieving details for workflow '{}' (queue: '{}')"
                 .format(wf_config['workflow_id'], queue_id))
     trs_instance = TRSService(wf_config['trs_id'])
-    wf_descriptor = trs_instance.get_workflow_descriptor(
-        id=wf_config['workflow_id'],
-        version_id=wf_config['version_id'],
-        type=wf_config['workflow_type']
-    )
-    wf_files = trs_instance.get_workflow_files(
-        id=wf_config['workflow_id'],
-        version_id=wf_config['version_id'],
-        type=wf_config['workflow_type']
-    )
-    wf_config['workflow_url'] = wf_descriptor['url']
-    attachment_paths = [wf_file['path'] for wf_file in wf_files
-                        if wf_file['file_type'] == 'SECONDARY_DESCRIPTOR']
-    wf_attachments = []
-    for attachment in attachment_paths:
-        attachment_file = trs_instance.get_workflow_descriptor_relative(
-            id=wf_config['workflow_id'],
-            version_id=wf_config['version_id'],
-            type=wf_config['workflow_type'],
-            relative_path=attachment
+    wf_args = {'id': wf_config['workflow_id'],
+               'version_id': wf_config['version_id'],
+               'type': wf_config['workflow_type']}
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+        # the primary descriptor is fetched while the file list and
+        # secondary descriptors are resolved
+        wf_descriptor = executor.submit(
+            trs_instance.get_workflow_descriptor, **wf_args
+        )
+        wf_files = trs_instance.get_workflow_files(**wf_args)
+        attachment_paths = [wf_file['path'] for wf_file in wf_files
+                            if wf_file['file_type'] == 'SECONDARY_DESCRIPTOR']
+        attachment_files = executor.map(
+            lambda path: trs_instance.get_workflow_descriptor_relative(
+                relative_path=path, **wf_args
+            ),
+            attachment_paths
         )
-        wf_attachments.append(attachment_file['url'])
+        wf_attachments = [attachment_file['url']
+                          for attachment_file in attachment_files]
+        wf_config['workflow_url'] = wf_descriptor.result()['url']
     wf_config['workflow_attachments'] = wf_attachments
     logger.debug("Found the following data for workflow '{}':\n{}"
                  .format(wf_config['workflow_id'], wf_attachments))
@@ -72,6 +124,99 @@ def fetch_queue_workflow(queue_id):
     return wf_config
 
 
+def fetch_queue_workflows(queue_ids=None):
+    """
+    Collect details for the workflows associated with several queues
+    from their TRS repositories. Each distinct workflow (TRS, ID,
+    version and type) and secondary descriptor is only requested once,
+    and all queues are updated with a single config write.
+
+    Args:
+        queue_ids (:obj:`list` of :obj:`str`): queues to update (defaults
+            to all queues with a registered workflow ID)
+
+    Returns:
+        dict: dict with updated configuration for each resolved queue
+    """
+    queues = queue_config()
+    if queue_ids is None:
+        queue_ids = [queue_id for queue_id in queues
+                     if queues[queue_id]['trs_id']
+                     and queues[queue_id]['workflow_id']]
+    wf_configs = {queue_id: thaw(queues[queue_id]) for queue_id in queue_ids}
+    wf_keys = {queue_id: (wf_config['trs_id'],
+                          wf_config['workflow_id'],
+                          wf_config['version_id'],
+                          wf_config['workflow_type'])
+               for queue_id, wf_config in wf_configs.items()}
+    logger.info("Retrieving details for {} workflows ({} queues)"
+                .format(len(set(wf_keys.values())), len(wf_keys)))
+
+    trs_instances = {trs_id: TRSService(trs_id)
+                     for trs_id in set(key[0] for key in wf_keys.values())}
+
+    def _wf_args(key):
+        return {'id': key[1], 'version_id': key[2], 'type': key[3]}
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+        descriptors = {}
+        file_lists = {}
+        for key in set(wf_keys.values()):
+            trs_instance = trs_instances[key[0]]
+            descriptors[key] = executor.submit(
+                trs_instance.get_workflow_descriptor, **_wf_args(key)
+            )
+            file_lists[key] = executor.submit(
+                trs_instance.get_workflow_files, **_wf_args(key)
+            )
+
+        attachments = {}
+        relative_descriptors = {}
+        for key, wf_files in file_lists.items():
+            try:
+                attachment_paths = [
+                    wf_file['path'] for wf_file in wf_files.result()
+                    if wf_file['file_type'] == 'SECONDARY_DESCRIPTOR'
+                ]
+            except Exception as e:
+                logger.error("Unable to list files for workflow '{}': {}"
+                             .format(key[1], e))
+                continue
+            attachments[key] = attachment_paths
+            for path in attachment_paths:
+                if (key, path) not in relative_descriptors:
+                    relative_descriptors[(key, path)] = executor.submit(
+                        trs_instances[key[0]]
+                        .get_workflow_descriptor_relative,
+                        relative_path=path,
+                        **_wf_args(key)
+                    )
+
+        resolved = {}
+        for key, attachment_paths in attachments.items():
+            try:
+                resolved[key] = (
+                    descriptors[key].result()['url'],
+                    [relative_descriptors[(key, path)].result()['url']
+                     for path in attachment_paths]
+                )
+            except Exception as e:
+                logger.error("Unable to resolve workflow '{}': {}"
+                             .format(key[1], e))
+
+    updates = {}
+    for queue_id, wf_config in wf_configs.items():
+        if wf_keys[queue_id] not in resolved:
+            continue
+        wf_url, wf_attachments = resolved[wf_keys[queue_id]]
+        wf_config['workflow_url'] = wf_url
+        wf_config['workflow_attachments'] = list(wf_attachments)
+        updates[queue_id] = wf_config
+    if updates:
+        set_yaml_entries('queues', updates)
+    return updates
+
+
 def store_verification(queue_id, wes_id):
     """
     Record checker status for selected workflow and environment.
@@ -79,7 +224,7 @@ def store_verification(queue_id, wes_id):
     Args:
         queue_id (str): string identifying the workflow queue
     """
-    wf_config = queue_config()[queue_id]
+    wf_config = thaw(queue_config()[queue_id])
     wf_config.setdefault('wes_verified', []).append(wes_id)
     set_yaml('queues', queue_id, wf_config)
 
@@ -96,9 +241,45 @@ def store_verification(queue_id, wes_id):
 #     return _post_to_endpoint(self, endpoint, requests)
 
 
+def sniff_version(extension, content):
+    """
+    Find the workflow type version in the content (or the first
+    complete lines) of a descriptor, without parsing the whole file.
+
+    Args:
+        extension (str): string with extension of workflow file
+        content (bytes): descriptor content or a prefix of it
+
+    Returns:
+        str: string indicating workflow type version, or None if the
+            version can't be determined from the content given
+    """
+    text = content.decode('utf-8', errors='replace')
+    if extension == 'cwl':
+        match = _cwl_version_re.search(text)
+        return match.group(1) if match else None
+    # WDL: a version statement must come before any other statement
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _wdl_version_re.match(line)
+        return match.group(1) if match else 'draft-2'
+
+
+def _version_from_content(extension, content):
+    version = sniff_version(extension, content)
+    if version is not None:
+        return version
+    if extension == 'cwl':
+        return yaml.safe_load(content)['cwlVersion']
+    return 'draft-2'
+
+
 def get_version(extension, workflow_file):
     """
-    Determines the version of a .py, .wdl, or .cwl file.
+    Determines the version of a .py, .wdl, or .cwl file. The file is
+    streamed and only read up to the version statement, if possible.
 
     Args:
         extension (str): string with extension of workflow file
@@ -107,17 +288,31 @@ def get_version(extension, workflow_file):
     Returns:
         str: string indicating workflow type version
     """
-    if extension == 'cwl':
-        return get_yaml(workflow_file)['cwlVersion']
-    else:
-        # Must be a wdl file.
-        try:
-            with open_file(workflow_file, 'r') as f:
-                wf_lines = f.readlines()
-            return [l.decode().lstrip('version') for l in wf_lines
-                    if 'version' in l.decode().split(' ')][0]
-        except IndexError:
-            return 'draft-2'
+    content = b''
+    with LazyFile(workflow_file, chunk_size=version_sniff_size) as f:
+        for chunk in f:
+            content += chunk
+            # only check complete lines
+            version = sniff_version(extension,
+                                    content[:content.rfind(b'\n') + 1])
+            if version is not None:
+                return version
+    return _version_from_content(extension, content)
+
+
+def _get_wf_type(workflow_path):
+    """
+    Return the (lowercase) file extension of a supported workflow
+    descriptor.
+    """
+    supported_formats = ['py', 'wdl', 'cwl']
+    # Grab the file extension
+    file_type = workflow_path.lower().split('.')[-1]
+    if file_type not in supported_formats:
+        raise TypeError("Unsupported workflow type: "
+                        ".{}. Must be {}."
+                        .format(file_type, supported_formats))
+    return file_type
 
 
 def get_wf_info(workflow_path):
@@ -126,9 +321,8 @@ def get_wf_info(workflow_path):
 
     Assumes that the file path is to the file directly - i.e., ends
     with a valid file extension. Supports checking local files as well
-    as files at http:// and https:// locations. Files at these remote
-    locations are recreated locally to enable our approach to version
-    checking, then removed after version is extracted.
+    as files at http:// and https:// locations. Remote files are
+    streamed only until the version statement is found.
 
     Args:
         workflow_path (str): filepath or URL for main workflow
@@ -140,26 +334,94 @@ def get_wf_info(workflow_path):
             str: string indicating workflow type version
             str: string indicating workflow type (e.g., 'CWL', 'WDL')
     """
-    supported_formats = ['py', 'wdl', 'cwl']
-    # Grab the file extension
-    file_type = workflow_path.lower().split('.')[-1]
-    workflow_path = (workflow_path if ':' in workflow_path
-                     else 'file://' + workflow_path)
-
-    if file_type in supported_formats:
-        if workflow_path.startswith('file://'):
-            workflow_path = workflow_path[7:]
-        version = get_version(file_type, workflow_path)
-    else:
-        raise TypeError("Unsupported workflow type: "
-                        ".{}. Must be {}."
-                        .format(file_type, supported_formats))
+    file_type = _get_wf_type(workflow_path)
+    if workflow_path.startswith('file://'):
+        workflow_path = workflow_path[7:]
+    version = get_version(file_type, workflow_path)
     return version, file_type.upper()
 
 
+def _cwl_references(document):
+    """
+    Find paths to other files referenced by a CWL document.
+
+    Args:
+        document: parsed CWL document
+
+    Returns:
+        generator: referenced paths, relative to the document
+    """
+    nodes = [document]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in _cwl_ref_fields and isinstance(value, str):
+                    yield value.split('#')[0]
+                else:
+                    nodes.append(value)
+        elif isinstance(node, list):
+            nodes.extend(node)
+
+
+def get_cwl_tree_hash(workflow_url):
+    """
+    Compute a content hash for a CWL workflow descriptor and all
+    descriptors it references.
+
+    Args:
+        workflow_url (str): URL for main workflow descriptor file
+
+    Returns:
+        str: hex digest for the descriptor tree
+    """
+    tree_hash = hashlib.sha256()
+    visited = set()
+    pending = [workflow_url]
+    while pending:
+        url = pending.pop()
+        if not url or url in visited:
+            continue
+        visited.add(url)
+        with open_file(url, 'rb') as f:
+            content = f.read()
+        tree_hash.update(url.encode('utf-8') + b'\0'
+                         + hashlib.sha256(content).digest())
+        try:
+            document = yaml.safe_load(content)
+        except yaml.YAMLError:
+            continue
+        pending.extend(urllib.parse.urljoin(url, ref)
+                       for ref in _cwl_references(document))
+    return tree_hash.hexdigest()
+
+
+def _pack_cwl(workflow_url):
+    """
+    Pack a CWL workflow with cwltool, in process if cwltool is
+    installed as a library, else with the cwltool command.
+    """
+    try:
+        import cwltool.main
+    except ImportError:
+        return subprocess32.check_output(
+            ['cwltool', '--pack', workflow_url]
+        ).decode()
+    packed = StringIO()
+    exit_code = cwltool.main.main(argsl=['--pack', workflow_url],
+                                  stdout=packed,
+                                  logger_handler=logging.NullHandler())
+    if exit_code != 0:
+        raise subprocess32.CalledProcessError(
+            exit_code, ['cwltool', '--pack', workflow_url]
+        )
+    return packed.getvalue()
+
+
 def get_packed_cwl(workflow_url):
     """
-    Create 'packed' version of CWL workflow descriptor.
+    Create 'packed' version of CWL workflow descriptor. Packed
+    descriptors are cached by the content hash of the descriptor tree.
 
     Args:
         workflow_url (str): URL for main workflow descriptor file
@@ -168,8 +430,29 @@ def get_packed_cwl(workflow_url):
         str: string with main and all secondary workflow descriptors
             combined CWL workflow
     """
-    logger.debug("Packing descriptors for '{}'".format(workflow_url))
-    return subprocess32.check_output(['cwltool', '--pack', workflow_url])
+    tree_hash = get_cwl_tree_hash(workflow_url)
+    packed_cwl = _get_cached_pack(tree_hash)
+    if packed_cwl is not None:
+        return packed_cwl
+    with _pack_lock:
+        # another thread may have packed the same tree while we waited
+        packed_cwl = _get_cached_pack(tree_hash)
+        if packed_cwl is not None:
+            return packed_cwl
+        logger.debug("Packing descriptors for '{}'".format(workflow_url))
+        packed_cwl = _pack_cwl(workflow_url)
+        with _packed_cwl_lock:
+            _packed_cwl[tree_hash] = packed_cwl
+            while len(_packed_cwl) > packed_cwl_cache_size:
+                _packed_cwl.popitem(last=False)
+    return packed_cwl
+
+
+def _get_cached_pack(tree_hash):
+    with _packed_cwl_lock:
+        if tree_hash in _packed_cwl:
+            _packed_cwl.move_to_end(tree_hash)
+            return _packed_cwl[tree_hash]
 
 
 def get_flattened_descriptor(workflow_file):
@@ -186,6 +469,32 @@ def get_flattened_descriptor(workflow_file):
     return ''.join(wf_lines)
 
 
+def iter_asts(ast_root, name):
+    """
+    Iterate over AST nodes with the given name, in the same order as
+    a depth-first traversal, without recursion.
+
+    Args:
+        ast_root: the WDL AST; the whole thing generally, but
+            really any portion that you wish to search
+        name (str): the name of the subtree you're looking for,
+            like 'Task'
+
+    Returns:
+        generator: nodes representing the AST subtrees matching the
+        'name' given
+    """
+    nodes = [ast_root]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, wdl_parser.AstList):
+            nodes.extend(reversed(node))
+        elif isinstance(node, wdl_parser.Ast):
+            if node.name == name:
+                yield node
+            nodes.extend(reversed(list(node.attributes.values())))
+
+
 def find_asts(ast_root, name):
     """
     Finds an AST node with the given name and the entire subtree
@@ -201,16 +510,48 @@ def find_asts(ast_root, name):
         list: nodes representing the AST subtrees matching the
         'name' given
     """
-    nodes = []
-    if isinstance(ast_root, wdl_parser.AstList):
-        for node in ast_root:
-            nodes.extend(find_asts(node, name))
-    elif isinstance(ast_root, wdl_parser.Ast):
-        if ast_root.name == name:
-            nodes.append(ast_root)
-        for attr_name, attr in ast_root.attributes.items():
-            nodes.extend(find_asts(attr, name))
-    return nodes
+    return list(iter_asts(ast_root, name))
+
+
+def _wdl_hash(wdl):
+    if isinstance(wdl, str):
+        wdl = wdl.encode('utf-8')
+    return hashlib.sha256(wdl).hexdigest()
+
+
+def _cache_wdl(key, value):
+    with _wdl_cache_lock:
+        _wdl_cache[key] = value
+        while len(_wdl_cache) > wdl_cache_size:
+            _wdl_cache.popitem(last=False)
+
+
+def _get_cached_wdl(key):
+    with _wdl_cache_lock:
+        if key in _wdl_cache:
+            _wdl_cache.move_to_end(key)
+            return _wdl_cache[key]
+
+
+def parse_wdl(wdl):
+    """
+    Parse a WDL descriptor, reusing the AST from a previous parse of
+    the same content.
+
+    Args:
+        wdl (str): string (or bytes) containing the WDL descriptor
+
+    Returns:
+        the WDL AST
+    """
+    key = ('ast', _wdl_hash(wdl))
+    wdl_ast = _get_cached_wdl(key)
+    if wdl_ast is None:
+        if isinstance(wdl, bytes):
+            wdl = wdl.decode()
+        wdl_ast = wdl_parser.parse(wdl).ast()
+        _cache_wdl(key, wdl_ast)
+    return wdl_ast
 
 
 def get_wdl_inputs(wdl):
@@ -224,15 +565,20 @@ def get_wdl_inputs(wdl):
         dict: dict containing identified workflow inputs, classified
             and grouped by type (e.g., 'File')
     """
-    try:
-        wdl_ast = wdl_parser.parse(wdl).ast()
-    except AttributeError:
-        wdl_ast = wdl_parser.parse(wdl.decode()).ast()
-    workflow = find_asts(wdl_ast, 'Workflow')[0]
+    key = ('inputs', _wdl_hash(wdl))
+    wdl_inputs = _get_cached_wdl(key)
+    if wdl_inputs is None:
+        wdl_inputs = _find_wdl_inputs(parse_wdl(wdl))
+        _cache_wdl(key, wdl_inputs)
+    return {dec_type: list(dec_names)
+            for dec_type, dec_names in wdl_inputs.items()}
+
+
+def _find_wdl_inputs(wdl_ast):
+    workflow = next(iter_asts(wdl_ast, 'Workflow'))
     workflow_name = workflow.attr('name').source_string
-    decs = find_asts(workflow, 'Declaration')
     wdl_inputs = {}
-    for dec in decs:
+    for dec in iter_asts(workflow, 'Declaration'):
         if (isinstance(dec.attr('type'), wdl_parser.Ast) and
                 'name' in dec.attr('type').attributes):
             dec_type = dec.attr('type').attr('name').source_string
@@ -295,7 +641,8 @@ def modify_jsonyaml_paths(jsonyaml_file, path_keys=None):
 def get_wf_descriptor(workflow_file,
                       parts=None,
                       attach_descriptor=False,
-                      pack_descriptor=False):
+                      pack_descriptor=False,
+                      prepared=None):
     """
     Retrieve descriptor URL or contents for the workflow.
 
@@ -304,6 +651,8 @@ def get_wf_descriptor(workflow_file,
         parts (:obj:`list` of :obj:`tuple`): ...
         attach_descriptor (bool): ...
         pack_descriptor (bool): ...
+        prepared (:obj:`PreparedWorkflow`): shared artifacts for the
+            workflow, if any
     """
     if parts is None:
         parts = []
@@ -312,11 +661,12 @@ def get_wf_descriptor(workflow_file,
         workflow_file = workflow_file[7:]
 
     if attach_descriptor:
-        if pack_descriptor:
-            descriptor_f = StringIO(get_packed_cwl(workflow_file))
+        if prepared is not None:
+            descriptor_f = prepared.descriptor(packed=pack_descriptor)
+        elif pack_descriptor:
+            descriptor_f = BytesIO(get_packed_cwl(workflow_file).encode())
         else:
-            with open_file(workflow_file, 'rb') as f:
-                descriptor_f = StringIO(f.read().decode())
+            descriptor_f = LazyFile(workflow_file)
         descriptor_n = os.path.basename(workflow_file)
         parts.append(
             ("workflow_attachment", (descriptor_n, descriptor_f))
@@ -334,7 +684,8 @@ def get_wf_params(workflow_file,
                   workflow_type,
                   jsonyaml,
                   parts=None,
-                  fix_paths=False):
+                  fix_paths=False,
+                  prepared=None):
     """
     Retrieve and format workflow parameters for execution.
 
@@ -344,10 +695,23 @@ def get_wf_params(workflow_file,
         jsonyaml (str): ...
         parts (:obj:`list` of :obj:`tuple`): ...
         fix_paths (bool): ...
+        prepared (:obj:`PreparedWorkflow`): shared artifacts for the
+            workflow, if any
     """
     if parts is None:
         parts = []
 
+    if prepared is not None:
+        wf_params = prepared.params(workflow_type, fix_paths=fix_paths)
+    else:
+        wf_params = _load_wf_params(workflow_file, workflow_type, jsonyaml,
+                                    fix_paths=fix_paths)
+
+    parts.append(("workflow_params", wf_params))
+    return parts
+
+
+def _load_wf_params(workflow_file, workflow_type, jsonyaml, fix_paths=False):
     if jsonyaml.startswith("file://"):
         jsonyaml = jsonyaml[7:]
 
@@ -357,63 +721,330 @@ def get_wf_params(workflow_file,
             with open_file(workflow_file, 'r') as f:
                 workflow_descriptor = f.read()
             input_keys = get_wdl_inputs(workflow_descriptor)['File']
-        wf_params = modify_jsonyaml_paths(jsonyaml,
-                                          path_keys=input_keys)
-    else:
-        wf_params = json.dumps(get_json(jsonyaml))
-
-    parts.append(("workflow_params", wf_params))
-    return parts
+        return modify_jsonyaml_paths(jsonyaml, path_keys=input_keys)
+    return json.dumps(get_json(jsonyaml))
 
 
-def get_wf_attachments(workflow_file, attachments, parts=None):
+def get_wf_attachments(workflow_file, attachments, parts=None,
+                       prepared=None):
     """
     Retrieve and attach any additional files needed to run
     the workflow. Attachments should nominally be hosted in the
     same remote repository as the primary workflow descriptor
     and specified using the full URL. Local file attachments
-    are supported but discouraged.
+    are supported but discouraged. Files are attached as lazily
+    opened binary file objects, so they can be streamed when the
+    request is sent.
 
     Args:
         workflow_file (str): ...
         attachments (:obj:`list` of :obj:`str`): ...
         parts (:obj:`list` of :obj:`tuple`): ...
+        prepared (:obj:`PreparedWorkflow`): shared artifacts for the
+            workflow, if any
     """
     if parts is None:
         parts = []
 
-    base_path = os.path.dirname(workflow_file)
-    path_re = re.compile('.*{}'.format(base_path))
+    path_re = _attachment_path_re(workflow_file)
 
     for attachment in attachments:
         if attachment.startswith("file://"):
             attachment = attachment[7:]
 
-        with open_file(attachment, 'rb') as f:
-            attach_f = StringIO(f.read().decode())
+        if prepared is not None:
+            attach_f = prepared.attachment(attachment)
+        else:
+            attach_f = LazyFile(attachment)
 
-        try:
-            attach_path = re.sub(path_re.search(attachment).group() + '/',
-                                 '', attachment)
-        except AttributeError:
-            attach_path = os.path.basename(attachment)
+        attach_path = _attachment_path(path_re, attachment)
         parts.append(("workflow_attachment",
                      (attach_path, attach_f)))
     return parts
 
 
-def expand_globs(attachments):
-    expanded_list = []
-    for filepath in attachments:
-        if 'file://' in filepath:
-            for f in glob.glob(filepath[7:]):
-                expanded_list += ['file://' + os.path.abspath(f)]
-        elif ':' not in filepath:
-            for f in glob.glob(filepath):
-                expanded_list += ['file://' + os.path.abspath(f)]
+def _attachment_path_re(workflow_file):
+    base_path = os.path.dirname(workflow_file)
+    return re.compile('.*{}'.format(base_path))
+
+
+def _attachment_path(path_re, attachment):
+    """
+    Return the path of an attachment relative to the workflow
+    descriptor, or its filename if not under the descriptor's directory.
+    """
+    try:
+        return re.sub(path_re.search(attachment).group() + '/',
+                      '', attachment)
+    except AttributeError:
+        return os.path.basename(attachment)
+
+
+def _file_digest(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def stage_attachments(workflow_file, attachments):
+    """
+    Expand globs in attachment paths, and drop duplicate local files
+    (with the same attachment path and content). Files are checked in
+    parallel, and only files with the same attachment path and size
+    are hashed.
+
+    Args:
+        workflow_file (str): ...
+        attachments (:obj:`list` of :obj:`str`): ...
+
+    Returns:
+        list: sorted attachment paths or URLs
+    """
+    attachments = sorted(expand_globs(attachments))
+    local_paths = [attachment[7:] for attachment in attachments
+                   if attachment.startswith("file://")]
+    path_re = _attachment_path_re(workflow_file)
+
+    with ThreadPoolExecutor(max_workers=stage_workers) as executor:
+        sizes = executor.map(lambda path: os.stat(path).st_size,
+                             local_paths)
+        candidates = {}
+        for path, size in zip(local_paths, sizes):
+            candidates.setdefault((_attachment_path(path_re, path), size),
+                                  []).append(path)
+        hashed = [path for paths in candidates.values() if len(paths) > 1
+                  for path in paths]
+        digests = dict(zip(hashed, executor.map(_file_digest, hashed)))
+
+    duplicates = set()
+    for paths in candidates.values():
+        if len(paths) < 2:
+            continue
+        seen = set()
+        for path in paths:
+            if digests[path] in seen:
+                duplicates.add('file://' + path)
+            seen.add(digests[path])
+    if duplicates:
+        logger.debug("Skipping {} duplicate attachments"
+                     .format(len(duplicates)))
+    return [attachment for attachment in attachments
+            if attachment not in duplicates]
+
+
+class PreparedWorkflow(object):
+    """
+    Artifacts for workflow run requests (workflow info, descriptor,
+    parameters and attachments), each loaded at most once and shared by
+    all requests built for the same workflow.
+
+    Args:
+        workflow_file (str): ...
+        jsonyaml (str): ...
+    """
+    def __init__(self, workflow_file, jsonyaml):
+        self.workflow_file = workflow_file
+        self.jsonyaml = jsonyaml
+        self.created = time.monotonic()
+        self._artifacts = {}
+        self._lock = threading.RLock()
+        self._shared_bytes = 0
+        self._released = False
+        # files that were opened (and, if remote, downloaded) to be
+        # measured but not shared, kept for the next request to stream
+        self._opened = {}
+
+    def _get(self, key, load):
+        with self._lock:
+            if key not in self._artifacts:
+                self._artifacts[key] = load()
+            return self._artifacts[key]
+
+    @property
+    def path(self):
+        if self.workflow_file.startswith("file://"):
+            return self.workflow_file[7:]
+        return self.workflow_file
+
+    @property
+    def info(self):
+        return self._get('info', self._load_info)
+
+    def _load_info(self):
+        # reuse the descriptor content if it was already fetched, else
+        # only stream the descriptor up to its version statement
+        content = self._artifacts.get('descriptor')
+        if content is None:
+            return get_wf_info(self.workflow_file)
+        file_type = _get_wf_type(self.path)
+        return _version_from_content(file_type, content), file_type.upper()
+
+    def _read_shared(self, path):
+        with self._lock:
+            if self._released:
+                return None
+            content, f = _read_shared(path)
+            if content is not None:
+                self._shared_bytes += len(content)
+            else:
+                self._opened[path] = f
+            return content
+
+    def _stream(self, path):
+        with self._lock:
+            f = self._opened.pop(path, None)
+        return f if f is not None else LazyFile(path)
+
+    def release(self):
+        """
+        Return the workflow's shared buffers to the global budget, e.g.,
+        when it is dropped from the cache. Requests that still hold the
+        buffers keep them until they're done; files loaded afterwards
+        are streamed.
+        """
+        with self._lock:
+            _release_shared(self._shared_bytes)
+            self._shared_bytes = 0
+            self._released = True
+            for f in self._opened.values():
+                f.close()
+            self._opened.clear()
+
+    def _descriptor_content(self):
+        return self._get('descriptor', lambda: self._read_shared(self.path))
+
+    def descriptor(self, packed=False):
+        if packed:
+            content = self._get(
+                'packed', lambda: get_packed_cwl(self.path).encode()
+            )
         else:
-            expanded_list += [filepath]
-    return set(expanded_list)
+            content = self._descriptor_content()
+        return BytesIO(content) if content is not None \
+            else self._stream(self.path)
+
+    def params(self, workflow_type, fix_paths=False):
+        return self._get(('params', workflow_type, fix_paths),
+                         lambda: _load_wf_params(self.workflow_file,
+                                                 workflow_type,
+                                                 self.jsonyaml,
+                                                 fix_paths=fix_paths))
+
+    def attachment(self, path):
+        content = self._get(('attachment', path),
+                            lambda: self._read_shared(path))
+        return BytesIO(content) if content is not None \
+            else self._stream(path)
+
+
+def _reserve_shared(size):
+    global _shared_bytes
+    with _shared_bytes_lock:
+        if _shared_bytes + size > shared_buffer_limit:
+            return False
+        _shared_bytes += size
+        return True
+
+
+def _release_shared(size):
+    global _shared_bytes
+    with _shared_bytes_lock:
+        _shared_bytes = max(0, _shared_bytes - size)
+
+
+def _read_shared(path):
+    """
+    Read a file to share between requests. Files larger than
+    `shared_buffer_size`, or read while the shared buffers are full,
+    should be streamed instead; they are returned as the file object
+    used to measure them, so that a remote file without a known length
+    is only downloaded once.
+
+    Returns:
+        tuple: the file content and None, or None and a
+            :class:`LazyFile` to stream
+    """
+    f = LazyFile(path)
+    try:
+        size = len(f)
+        if size > shared_buffer_size or not _reserve_shared(size):
+            return None, f
+        try:
+            content = f.read()
+        except Exception:
+            _release_shared(size)
+            raise
+    except Exception:
+        f.close()
+        raise
+    f.close()
+    return content, None
+
+
+def _file_signature(path):
+    if path.startswith("file://"):
+        path = path[7:]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def prepare_workflow(workflow_file, jsonyaml, attachments=None):
+    """
+    Return the shared request artifacts for a workflow, parameters
+    file and attachments. Local files are checked for changes each
+    time the workflow is prepared; artifacts for workflows with remote
+    files are reloaded after `prepared_remote_ttl` seconds.
+
+    Args:
+        workflow_file (str): ...
+        jsonyaml (str): ...
+        attachments (:obj:`list` of :obj:`str`): staged attachment
+            paths or URLs (see :func:`stage_attachments`)
+
+    Returns:
+        :obj:`PreparedWorkflow`
+    """
+    signatures = ([_file_signature(workflow_file), _file_signature(jsonyaml)]
+                  + sorted(_file_signature(attachment)
+                           for attachment in attachments or []))
+    key = tuple(signatures)
+    remote = any(isinstance(signature, str) for signature in signatures)
+    with _prepared_lock:
+        prepared = _prepared.get(key)
+        if prepared is not None and not (
+                remote and time.monotonic() - prepared.created
+                > prepared_remote_ttl):
+            _prepared.move_to_end(key)
+            return prepared
+        if prepared is not None:
+            _prepared.pop(key).release()
+        prepared = PreparedWorkflow(workflow_file, jsonyaml)
+        _prepared[key] = prepared
+        while len(_prepared) > prepared_cache_size:
+            _prepared.popitem(last=False)[1].release()
+        return prepared
+
+
+def _expand_glob(filepath):
+    if 'file://' in filepath:
+        pattern = filepath[7:]
+    elif ':' not in filepath:
+        pattern = filepath
+    else:
+        return [filepath]
+    return ['file://' + os.path.abspath(f) for f in glob.glob(pattern)]
+
+
+def expand_globs(attachments):
+    with ThreadPoolExecutor(max_workers=stage_workers) as executor:
+        expanded_lists = executor.map(_expand_glob, attachments)
+        return set(filepath for expanded_list in expanded_lists
+                   for filepath in expanded_list)
 
 
 def build_wes_request(workflow_file,
@@ -426,7 +1057,9 @@ def build_wes_request(workflow_file,
     """
     Construct and format Workflow Execution Service POST request to
     create a new workflow run. Named parts (primitive types or files)
-    are submitted as 'multipart/form-data'.
+    are submitted as 'multipart/form-data'. Workflow artifacts are
+    loaded once per workflow (see :func:`prepare_workflow`) and shared
+    between requests built with different options.
 
     Args:
         workflow_file (str): path to CWL/WDL file; can be
@@ -444,10 +1077,12 @@ def build_wes_request(workflow_file,
             the WES server (Swagger API)
     """
     workflow_file = "file://" + workflow_file if ":" not in workflow_file else workflow_file
-    wf_version, wf_type = get_wf_info(workflow_file)
-
-    parts = [("workflow_type", wf_type),
-             ("workflow_type_version", wf_version)]
+    wf_type = _get_wf_type(workflow_file).upper()
+    # stage attachments first, so that artifacts are shared only while
+    # the expanded files are unchanged
+    if attachments:
+        attachments = stage_attachments(workflow_file, attachments)
+    prepared = prepare_workflow(workflow_file, jsonyaml, attachments)
 
     if pack_descriptor:
         if wf_type == 'WDL':
@@ -461,14 +1096,21 @@ def build_wes_request(workflow_file,
             attach_descriptor = True
             attach_imports = False
     parts = get_wf_descriptor(workflow_file=workflow_file,
-                              parts=parts,
+                              parts=[],
                               attach_descriptor=attach_descriptor,
-                              pack_descriptor=pack_descriptor)
+                              pack_descriptor=pack_descriptor,
+                              prepared=prepared)
+    # the version is sniffed after the descriptor is attached, so that
+    # an attached descriptor is only fetched once
+    wf_version = prepared.info[0]
+    parts = [("workflow_type", wf_type),
+             ("workflow_type_version", wf_version)] + parts
     parts = get_wf_params(workflow_file=workflow_file,
                           workflow_type=wf_type,
                           jsonyaml=jsonyaml,
                           parts=parts,
-                          fix_paths=resolve_params)
+                          fix_paths=resolve_params,
+                          prepared=prepared)
 
     if not attach_imports:
         ext_re = re.compile('{}$'.format(wf_type.lower()))
@@ -476,9 +1118,9 @@ def build_wes_request(workflow_file,
                        if not ext_re.search(attach)]
 
     if attachments:
-        attachments = expand_globs(attachments)
         parts = get_wf_attachments(workflow_file=workflow_file,
                                    attachments=attachments,
-                                   parts=parts)
+                                   parts=parts,
+                                   prepared=prepared)
 
     return parts
@@ -7,11 +7,21 @@ generally unchanged after adding. The former (queues) are stored in a
 separate file.
 
 This provides functions to save and get values into these three sections.
+
+Config files are parsed once and cached as read-only snapshots; the
+cache is refreshed whenever a file's modification time, size or inode
+changes. Environment variables (e.g., '${GCLOUD_TOKEN}') are kept
+unresolved in the parsed copy, and the snapshot is re-resolved whenever
+one of their values changes. Use :func:`ga4ghtest.util.thaw` to get a
+mutable copy of a snapshot.
 """
 import logging
 import os
+import threading
 
-from ga4ghtest.util import get_yaml, save_yaml, heredoc
+from ga4ghtest.util import get_yaml, save_yaml, heredoc, freeze, thaw
+from ga4ghtest.util import lock_file, env_var_names, env_var_values
+from ga4ghtest.util import resolve_env_vars
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -75,6 +85,53 @@ if not os.path.exists(queues_path):
     _default_queues()
 
 
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+
+def _load_config(path):
+    """
+    Return a read-only snapshot of a YAML config file, parsing the
+    file only if it changed since it was last loaded, and resolving
+    environment variables again only if their values changed.
+
+    Args:
+        path (str): local filepath of the YAML file
+
+    Returns:
+        :class:`FrozenDict`: parsed contents of the config file
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return get_yaml('file://' + path)
+    signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _config_cache_lock:
+        cached = _config_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        _, raw_config, names, values, snapshot = cached
+    else:
+        raw_config = get_yaml('file://' + path, resolve_env=False)
+        names, values, snapshot = env_var_names(raw_config), None, None
+
+    current_values = env_var_values(names)
+    if snapshot is not None and values == current_values:
+        return snapshot
+    snapshot = freeze(resolve_env_vars(raw_config))
+    with _config_cache_lock:
+        _config_cache[path] = (signature, raw_config, names,
+                               current_values, snapshot)
+    return snapshot
+
+
+def _invalidate_config(path):
+    """
+    Drop the cached snapshot for a config file.
+    """
+    with _config_cache_lock:
+        _config_cache.pop(path, None)
+
+
 def add_queue(queue_id,
               wf_type,
               trs_id='dockstore',
@@ -134,7 +191,7 @@ def queue_config():
     Returns:
         dict: dict with an entry for each workflow queue
     """
-    return get_yaml('file://' + queues_path)
+    return _load_config(queues_path)
 
 
 def trs_config():
@@ -144,7 +201,7 @@ def trs_config():
     Returns:
         dict: dict with an entry for each service
     """
-    return get_yaml('file://' + config_path)['toolregistries']
+    return _load_config(config_path)['toolregistries']
 
 
 def wes_config():
@@ -154,7 +211,7 @@ def wes_config():
     Returns:
         dict: dict with an entry for each service
     """
-    return get_yaml('file://' + config_path)['workflowservices']
+    return _load_config(config_path)['workflowservices']
 
 def drs_config():
     """
@@ -163,7 +220,7 @@ def drs_config():
     Returns:
         dict: dict with an entry for each service
     """
-    return get_yaml('file://' + config_path)['datarepositoryservice']
+    return _load_config(config_path)['datarepositoryservice']
 
 def add_toolregistry(service,
                      host,
@@ -221,7 +278,7 @@ def add_wes_opt(queue_ids, wes_id, make_default=False):
     if not isinstance(queue_ids, list):
         queue_ids = [queue_ids]
     for queue_id in queue_ids:
-        wf_config = queue_config()[queue_id]
+        wf_config = thaw(queue_config()[queue_id])
         wf_config['wes_opts'].append(wes_id)
         if make_default:
             wf_config['wes_default'] = wes_id
@@ -241,14 +298,34 @@ def set_yaml(section, service, var2add):
         var2add (dict): dict containing latest data for a service
             or queue (previous config will be overwritten)
     """
+    set_yaml_entries(section, {service: var2add})
+
+
+def set_yaml_entries(section, entries):
+    """
+    Update data for several services or queues in a section of local
+    YAML config files, with a single write. The file is locked for
+    the read-modify-write, so concurrent updates from other processes
+    aren't lost.
+
+    Args:
+        section (str): string indicating config type ('queues',
+            'toolregistries', 'workflowservices')
+        entries (dict): dict mapping each service or queue to update
+            to its latest data (previous config will be overwritten)
+    """
     if section == 'queues':
-        orchestrator_queues = get_yaml('file://' + queues_path)
-        orchestrator_queues[service] = var2add
-        save_yaml(queues_path, orchestrator_queues)
+        with lock_file(queues_path):
+            orchestrator_queues = get_yaml('file://' + queues_path)
+            orchestrator_queues.update(entries)
+            save_yaml(queues_path, orchestrator_queues)
+        _invalidate_config(queues_path)
     else:
-        orchestrator_config = get_yaml('file://' + config_path)
-        orchestrator_config.setdefault(section, {})[service] = var2add
-        save_yaml(config_path, orchestrator_config)
+        with lock_file(config_path):
+            orchestrator_config = get_yaml('file://' + config_path)
+            orchestrator_config.setdefault(section, {}).update(entries)
+            save_yaml(config_path, orchestrator_config)
+        _invalidate_config(config_path)
 
 
 def show():
@@ -2,12 +2,26 @@
 """
 Create and manage orchestrator queues for workflow jobs submitted to
 Workflow Execution Service (WES) endpoints.
+
+Submissions are kept in a queue store. The default store is the JSON
+file at `submission_queue`; pointing `submission_queue` at a file with
+a SQLite extension (e.g., '.db') switches to an indexed SQLite store.
 """
+import bisect
+import heapq
 import logging
+import mmap
 import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
 import datetime as dt
 
-from ga4ghtest.util import get_json, save_json
+from contextlib import contextmanager
+
+from ga4ghtest.util import get_json, save_json, lock_file
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +31,782 @@ submission_queue = os.path.join(os.path.dirname(__file__),
 if not os.path.exists(submission_queue):
     save_json(submission_queue, {})
 
+sqlite_extensions = ('.db', '.sqlite', '.sqlite3')
+
+# journals smaller than this are never compacted; beyond it, the journal
+# is folded into the queue file once it outgrows the file itself
+journal_min_bytes = 64 * 1024
+
+# set to False to always parse the full queue file on reads
+use_snapshots = True
+
+# set to False to list submissions by status from the snapshot (or
+# queue file) instead of the in-memory status index
+use_status_index = True
+
+
+class QueueStoreInterface:
+    def create(self, queue_id, submission_id, submission):
+        raise NotImplementedError
+
+    def list_ids(self, queue_id, status, id_range=None):
+        raise NotImplementedError
+
+    def get(self, queue_id, submission_id):
+        raise NotImplementedError
+
+    def update(self, queue_id, submission_id, param, value):
+        raise NotImplementedError
+
+    def update_many(self, updates):
+        raise NotImplementedError
+
+    def modify(self, queue_id, submission_id, func):
+        raise NotImplementedError
+
+    def compact(self):
+        raise NotImplementedError
+
+
+class JSONQueueStore(QueueStoreInterface):
+    """
+    Queue store backed by a single JSON file, with submissions nested
+    under their queue ID.
+
+    Batched updates are appended to a journal next to the JSON file
+    rather than rewriting it; reads replay the journal on top of the
+    file, and the journal is folded back into the file (compacted) once
+    it grows larger than the file. Single updates and new submissions
+    are written through to the file directly, which also compacts any
+    pending journal entries. Writes hold an advisory lock on the queue
+    file, so several worker processes can share one queue.
+
+    Each write-through rewrites the whole file and syncs it to disk, so
+    its cost grows with the queue. Status changes for many submissions
+    should go through :func:`update_submissions` (or
+    :func:`submission_batch`), which appends a single journal record.
+    Callers that create many submissions and can accept losing them on
+    a system crash can defer the syncs with
+    :func:`ga4ghtest.util.fsync_batch`; large queues should use the
+    SQLite store instead.
+
+    Reads go through a compact snapshot of the queue (see
+    :class:`QueueSnapshot`), so that status lookups and single bundle
+    reads don't parse the whole file. The snapshot is rebuilt whenever
+    the queue file or journal has changed since it was written.
+
+    Status lookups are answered from an in-memory :class:`StatusIndex`
+    shared by all stores for the same file. Writes through the store
+    update the index in place; changes made by other processes are
+    picked up by rebuilding it from the snapshot.
+
+    Args:
+        path (str): local filepath of the JSON file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.snapshot_path = path + '.snapshot'
+
+    def _load(self):
+        submissions = get_json(self.path)
+        for updates in self._journal_records()[0]:
+            _apply_updates(submissions, updates)
+        return submissions
+
+    def _journal_records(self):
+        """
+        Read the batches of updates recorded in the journal.
+
+        A record that was only partly written (e.g., by a process that
+        crashed while appending) ends the journal: it and anything after
+        it are ignored.
+
+        Returns:
+            tuple: list of update batches, and the length of the
+                journal up to the end of the last complete record
+        """
+        try:
+            with open(self.journal_path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            return [], 0
+        records = []
+        end = 0
+        while end < len(content):
+            line_end = content.find(b'\n', end)
+            if line_end < 0:
+                break
+            line = content[end:line_end]
+            if line.strip():
+                try:
+                    records.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    break
+            end = line_end + 1
+        if end < len(content):
+            logger.warning("Ignoring incomplete record at byte {} of queue "
+                           "journal '{}'".format(end, self.journal_path))
+        return records, end
+
+    def _save(self, submissions):
+        save_json(self.path, submissions)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        if use_snapshots:
+            self._write_snapshot(submissions, self._signature())
+
+    def _signature(self):
+        """
+        Return the state of the queue file and journal that a snapshot
+        must match to be current.
+        """
+        stat = os.stat(self.path)
+        try:
+            journal_size = os.path.getsize(self.journal_path)
+        except OSError:
+            journal_size = None
+        return [stat.st_ino, stat.st_mtime_ns, stat.st_size, journal_size]
+
+    def _write_snapshot(self, submissions, signature):
+        try:
+            write_snapshot(self.snapshot_path, submissions, signature)
+        except OSError as e:
+            logger.warning("Unable to write queue snapshot '{}': {}"
+                           .format(self.snapshot_path, e))
+
+    def _snapshot(self):
+        """
+        Return a current snapshot of the queue, rebuilding it from the
+        queue file (and journal) if it's missing or stale.
+        """
+        if not use_snapshots:
+            return None
+        signature = self._signature()
+        snapshot = load_snapshot(self.snapshot_path)
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+        # take the signature before reading, so that a concurrent write
+        # leaves the new snapshot stale rather than wrongly current
+        self._write_snapshot(self._load(), signature)
+        snapshot = load_snapshot(self.snapshot_path)
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+
+    def _status_index(self):
+        """
+        Return the status index for the queue, rebuilding it if the
+        queue was changed by another process (or another store).
+        """
+        index = get_status_index(self.path)
+        signature = self._signature()
+        with index.lock:
+            if index.signature == signature:
+                return index
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            signature = snapshot.signature
+            entries = ((queue_id, id, entry[0])
+                       for queue_id, bundles in snapshot.index.items()
+                       for id, entry in bundles.items())
+        else:
+            entries = ((queue_id, id, bundle['status'])
+                       for queue_id, bundles in self._load().items()
+                       for id, bundle in bundles.items())
+        index.rebuild(entries, signature)
+        return index
+
+    @contextmanager
+    def _index_updates(self):
+        """
+        Hold the queue lock for a write, and yield the status index to
+        update in place, if it was current before the write (or None).
+        """
+        with lock_file(self.path):
+            index = get_status_index(self.path)
+            signature = self._signature()
+            with index.lock:
+                current = index.signature == signature
+                generation = index.generation
+                index.signature = None
+            yield index if current else None
+            if current:
+                # a reader may have rebuilt the index from the queue as
+                # it was before this write; leave it to be rebuilt again
+                with index.lock:
+                    if index.generation == generation:
+                        index.signature = self._signature()
+
+    def create(self, queue_id, submission_id, submission):
+        with self._index_updates() as index:
+            submissions = self._load()
+            submissions.setdefault(queue_id, {})[submission_id] = submission
+            self._save(submissions)
+            if index is not None:
+                index.add(queue_id, submission_id, submission['status'])
+
+    def list_ids(self, queue_id, status, id_range=None):
+        if use_status_index:
+            return self._status_index().list_ids(queue_id, status, id_range)
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.list_ids(queue_id, status, id_range)
+        submissions = self._load()
+        lower, upper = id_range or (None, None)
+        try:
+            return [id for id, bundle in submissions[queue_id].items()
+                    if bundle['status'] in status
+                    and (lower is None or id >= lower)
+                    and (upper is None or id < upper)]
+        except KeyError:
+            return []
+
+    def get(self, queue_id, submission_id):
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.get(queue_id, submission_id)
+        return self._load()[queue_id][submission_id]
+
+    def update(self, queue_id, submission_id, param, value):
+        with self._index_updates() as index:
+            submissions = self._load()
+            submissions[queue_id][submission_id][param] = value
+            self._save(submissions)
+            if index is not None and param == 'status':
+                index.set_status(queue_id, submission_id, value)
+
+    def update_many(self, updates):
+        with self._index_updates() as index:
+            record = (json.dumps(updates, default=str) + '\n').encode('utf-8')
+            _, end = self._journal_records()
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT, 0o666)
+            try:
+                # drop any incomplete record, so the new one starts on a
+                # line of its own, and write the record in one call
+                os.ftruncate(fd, end)
+                os.lseek(fd, end, os.SEEK_SET)
+                written = 0
+                while written < len(record):
+                    written += os.write(fd, record[written:])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            journal_size = os.path.getsize(self.journal_path)
+            if journal_size > max(journal_min_bytes,
+                                   os.path.getsize(self.path)):
+                self.compact()
+            if index is not None:
+                for queue_id, submission_id, fields in updates:
+                    if 'status' in fields:
+                        index.set_status(queue_id, submission_id,
+                                         fields['status'])
+
+    def modify(self, queue_id, submission_id, func):
+        with lock_file(self.path):
+            fields = func(self.get(queue_id, submission_id))
+            if fields:
+                self.update_many([(queue_id, submission_id, fields)])
+            return fields
+
+    def compact(self):
+        with lock_file(self.path):
+            if os.path.exists(self.journal_path):
+                self._save(self._load())
+
+
+class StatusIndex(object):
+    """
+    In-memory index of submission IDs by queue and status.
+
+    Each (queue_id, status) pair maps to the IDs of its submissions,
+    kept in queue order, so that listing the submissions with some
+    statuses only touches those submissions (e.g., active runs are
+    listed without scanning completed ones). The index is updated in
+    place as submissions are added or change status.
+
+    Attributes:
+        signature (list): state of the queue file the index reflects,
+            or None if the index needs to be rebuilt
+        generation (int): number of times the index was rebuilt
+        lock (:class:`threading.RLock`): lock for reading or updating
+            the index
+    """
+    def __init__(self):
+        self.signature = None
+        self.generation = 0
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # position of each submission in its queue, and its status
+        self._entries = {}
+        # sorted lists of (position, submission_id) by queue and status
+        self._by_status = {}
+
+    def rebuild(self, entries, signature):
+        """
+        Replace the contents of the index.
+
+        Args:
+            entries: iterable of (queue_id, submission_id, status)
+                tuples, in queue order
+            signature (list): ...
+        """
+        with self.lock:
+            self._clear()
+            for queue_id, submission_id, status in entries:
+                self.add(queue_id, submission_id, status)
+            self.signature = signature
+            self.generation += 1
+
+    def add(self, queue_id, submission_id, status):
+        """
+        Add a submission at the end of its queue, or update the status
+        of a known submission.
+
+        Args:
+            queue_id (str): ...
+            submission_id (str): ...
+            status (str): ...
+        """
+        with self.lock:
+            entries = self._entries.setdefault(queue_id, {})
+            if submission_id in entries:
+                self.set_status(queue_id, submission_id, status)
+                return
+            entries[submission_id] = [len(entries), status]
+            self._by_status.setdefault((queue_id, status), []).append(
+                (len(entries) - 1, submission_id)
+            )
+
+    def set_status(self, queue_id, submission_id, status):
+        """
+        Move a submission to the list for its new status; unknown
+        submissions are ignored.
+
+        Args:
+            queue_id (str): ...
+            submission_id (str): ...
+            status (str): ...
+        """
+        with self.lock:
+            entry = self._entries.get(queue_id, {}).get(submission_id)
+            if entry is None or entry[1] == status:
+                return
+            position, old_status = entry
+            ids = self._by_status[(queue_id, old_status)]
+            del ids[bisect.bisect_left(ids, (position, submission_id))]
+            bisect.insort(self._by_status.setdefault((queue_id, status), []),
+                          (position, submission_id))
+            entry[1] = status
+
+    def list_ids(self, queue_id, status, id_range=None):
+        """
+        Return the IDs of submissions in a queue with any of the given
+        statuses, in queue order.
+
+        Args:
+            queue_id (str): ...
+            status (:obj:`list` of :obj:`str`): ...
+            id_range (tuple): optional (lower, upper) bounds for IDs
+
+        Returns:
+            :obj:`list` of :obj:`str`: list of submission IDs
+        """
+        lower, upper = id_range or (None, None)
+        with self.lock:
+            lists = [self._by_status[(queue_id, s)] for s in set(status)
+                     if (queue_id, s) in self._by_status]
+            ids = lists[0] if len(lists) == 1 else heapq.merge(*lists)
+            return [id for _, id in ids
+                    if (lower is None or id >= lower)
+                    and (upper is None or id < upper)]
+
+
+_status_indexes = {}
+_status_indexes_lock = threading.Lock()
+
+
+def get_status_index(path):
+    """
+    Return the shared status index for a queue file.
+
+    Args:
+        path (str): local filepath of the queue
+
+    Returns:
+        :class:`StatusIndex`: index for the queue
+    """
+    with _status_indexes_lock:
+        path = os.path.abspath(path)
+        if path not in _status_indexes:
+            _status_indexes[path] = StatusIndex()
+        return _status_indexes[path]
+
+
+class QueueSnapshot(object):
+    """
+    Read-only, memory-mapped view of a queue snapshot file.
+
+    A snapshot file starts with a one-line JSON header holding the
+    signature of the queue it was built from and an index mapping each
+    queue ID to a list of [submission_id, status, offset, length]
+    entries; the rest of the file holds the serialized bundles, one
+    per line. Listing IDs only reads the index, and a bundle is parsed
+    from its own slice of the file when requested.
+
+    Args:
+        path (str): local filepath of the snapshot file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self._mm.find(b'\n') + 1
+        header = json.loads(self._mm[:header_end].decode('utf-8'))
+        self._body = header_end
+        self.signature = header['signature']
+        self.index = {
+            queue_id: {entry[0]: tuple(entry[1:]) for entry in entries}
+            for queue_id, entries in header['index'].items()
+        }
+
+    def list_ids(self, queue_id, status, id_range=None):
+        lower, upper = id_range or (None, None)
+        return [id for id, (id_status, _, _)
+                in self.index.get(queue_id, {}).items()
+                if id_status in status
+                and (lower is None or id >= lower)
+                and (upper is None or id < upper)]
+
+    def get(self, queue_id, submission_id):
+        _, offset, length = self.index[queue_id][submission_id]
+        start = self._body + offset
+        return json.loads(self._mm[start:start + length].decode('utf-8'))
+
+    def close(self):
+        self._mm.close()
+
+
+def write_snapshot(path, submissions, signature):
+    """
+    Write a compact snapshot of a submission queue, replacing any
+    previous snapshot atomically.
+
+    Args:
+        path (str): local filepath of the snapshot file
+        submissions (dict): dict of submissions, keyed by queue ID
+            and submission ID
+        signature (list): state of the queue file the snapshot was
+            built from
+    """
+    index = {}
+    body = []
+    offset = 0
+    for queue_id, bundles in submissions.items():
+        entries = index.setdefault(queue_id, [])
+        for submission_id, bundle in bundles.items():
+            line = json.dumps(bundle, default=str).encode('utf-8')
+            entries.append([submission_id, bundle.get('status'),
+                            offset, len(line)])
+            body.append(line)
+            offset += len(line) + 1
+    header = json.dumps({'signature': signature, 'index': index})
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.encode('utf-8') + b'\n')
+            for line in body:
+                f.write(line + b'\n')
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def load_snapshot(path):
+    """
+    Return the memory-mapped snapshot at a path, reusing the mapping
+    while the snapshot file is unchanged.
+
+    Args:
+        path (str): local filepath of the snapshot file
+
+    Returns:
+        :class:`QueueSnapshot`, or None if no readable snapshot exists
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _snapshots_lock:
+        cached = _snapshots.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            snapshot = QueueSnapshot(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug("Ignoring unreadable queue snapshot '{}': {}"
+                         .format(path, e))
+            return None
+        # earlier mappings are released once no reader holds them
+        _snapshots[path] = (key, snapshot)
+        return snapshot
+
+
+class SQLiteQueueStore(QueueStoreInterface):
+    """
+    Queue store backed by a SQLite database in WAL mode. Submissions are
+    stored one row each, with an index on (queue_id, status) so that
+    status lookups and single-row updates don't touch the rest of the
+    queue.
+
+    Args:
+        path (str): local filepath of the SQLite database
+    """
+    schema = [
+        'CREATE TABLE IF NOT EXISTS submissions ('
+        ' queue_id TEXT NOT NULL,'
+        ' submission_id TEXT NOT NULL,'
+        ' status TEXT NOT NULL,'
+        ' bundle TEXT NOT NULL,'
+        ' PRIMARY KEY (queue_id, submission_id))',
+        'CREATE INDEX IF NOT EXISTS submissions_by_status'
+        ' ON submissions (queue_id, status)'
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            for statement in self.schema:
+                conn.execute(statement)
+
+    def _connect(self):
+        """
+        Return the calling thread's connection to the database;
+        connections can't be shared between threads.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create(self, queue_id, submission_id, submission):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO submissions'
+                ' (queue_id, submission_id, status, bundle)'
+                ' VALUES (?, ?, ?, ?)',
+                (queue_id, submission_id, submission['status'],
+                 json.dumps(submission, default=str))
+            )
+
+    def list_ids(self, queue_id, status, id_range=None):
+        status = list(status)
+        query = ('SELECT submission_id FROM submissions'
+                 ' WHERE queue_id = ? AND status IN ({})'
+                 .format(', '.join('?' * len(status))))
+        args = [queue_id] + status
+        lower, upper = id_range or (None, None)
+        if lower is not None:
+            query += ' AND submission_id >= ?'
+            args.append(lower)
+        if upper is not None:
+            query += ' AND submission_id < ?'
+            args.append(upper)
+        rows = self._connect().execute(query + ' ORDER BY rowid', args)
+        return [row[0] for row in rows]
+
+    def get(self, queue_id, submission_id):
+        row = self._connect().execute(
+            'SELECT bundle FROM submissions'
+            ' WHERE queue_id = ? AND submission_id = ?',
+            (queue_id, submission_id)
+        ).fetchone()
+        if row is None:
+            raise KeyError(submission_id)
+        return json.loads(row[0])
+
+    def update(self, queue_id, submission_id, param, value):
+        self.get(queue_id, submission_id)
+        self.update_many([(queue_id, submission_id, {param: value})])
+
+    def update_many(self, updates):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for queue_id, submission_id, fields in updates:
+                try:
+                    bundle = self.get(queue_id, submission_id)
+                except KeyError:
+                    _warn_unknown_submission(queue_id, submission_id)
+                    continue
+                bundle.update(fields)
+                conn.execute(
+                    'UPDATE submissions SET status = ?, bundle = ?'
+                    ' WHERE queue_id = ? AND submission_id = ?',
+                    (bundle['status'], json.dumps(bundle, default=str),
+                     queue_id, submission_id)
+                )
+
+    def modify(self, queue_id, submission_id, func):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            bundle = self.get(queue_id, submission_id)
+            fields = func(bundle)
+            if fields:
+                bundle.update(fields)
+                conn.execute(
+                    'UPDATE submissions SET status = ?, bundle = ?'
+                    ' WHERE queue_id = ? AND submission_id = ?',
+                    (bundle['status'], json.dumps(bundle, default=str),
+                     queue_id, submission_id)
+                )
+            return fields
+
+    def compact(self):
+        self._connect().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def _apply_updates(submissions, updates):
+    """
+    Apply a batch of field updates to a dict of queued submissions.
+
+    Args:
+        submissions (dict): dict of submissions, keyed by queue ID
+            and submission ID
+        updates (:obj:`list` of :obj:`tuple`): list of
+            (queue_id, submission_id, fields) entries, where `fields`
+            is a dict of values to set on the submission
+    """
+    for queue_id, submission_id, fields in updates:
+        try:
+            submissions[queue_id][submission_id].update(fields)
+        except KeyError:
+            _warn_unknown_submission(queue_id, submission_id)
+
+
+def _warn_unknown_submission(queue_id, submission_id):
+    logger.warning("Skipping update for unknown submission '{}' "
+                   "in queue '{}'".format(submission_id, queue_id))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def load_queue_store(path=None):
+    """
+    Return the queue store for the selected submission queue file.
+
+    Args:
+        path (str): local filepath of the queue; defaults to the
+            current `submission_queue`
+
+    Returns:
+        :class:`QueueStoreInterface`: store for the submission queue
+    """
+    if path is None:
+        path = submission_queue
+    if not path.endswith(sqlite_extensions):
+        return JSONQueueStore(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SQLiteQueueStore(path)
+        return _stores[path]
+
+
+_crockford = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+def _encode_base32(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(_crockford[index])
+    return ''.join(reversed(chars))
+
+
+class SubmissionIdGenerator(object):
+    """
+    Generate unique, lexicographically sortable submission IDs.
+
+    IDs follow the ULID layout: 10 characters of millisecond timestamp
+    followed by 16 characters of randomness (Crockford base32). Within
+    a process, IDs generated in the same millisecond increment the
+    random part as a sequence, so IDs are strictly increasing; across
+    processes, the random part keeps concurrent IDs from colliding.
+    """
+    rand_bits = 80
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._last_ms = -1
+        self._last_rand = 0
+
+    def __call__(self):
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            if now_ms <= self._last_ms:
+                now_ms = self._last_ms
+                rand = self._last_rand + 1
+                if rand >> self.rand_bits:
+                    now_ms += 1
+                    rand = int.from_bytes(os.urandom(10), 'big')
+            else:
+                rand = int.from_bytes(os.urandom(10), 'big')
+            self._last_ms, self._last_rand = now_ms, rand
+        return _encode_base32(now_ms, 10) + _encode_base32(rand, 16)
+
+
+new_submission_id = SubmissionIdGenerator()
+if hasattr(os, 'register_at_fork'):
+    # forked workers must not continue the parent's sequence
+    os.register_at_fork(after_in_child=new_submission_id._reset)
+
+
+def submission_id_floor(timestamp):
+    """
+    Return the lowest submission ID that could be generated at or
+    after the given time, for range scans by creation time.
+
+    Args:
+        timestamp (datetime): :class:`datetime` object
+
+    Returns:
+        str: string with the lower bound for submission IDs
+    """
+    return _encode_base32(int(timestamp.timestamp() * 1000), 10)
+
+
+def submission_time(submission_id):
+    """
+    Return the creation time encoded in a submission ID.
+
+    Args:
+        submission_id (str): ...
+
+    Returns:
+        datetime: :class:`datetime` object
+    """
+    now_ms = 0
+    for char in submission_id[:10]:
+        now_ms = now_ms * 32 + _crockford.index(char)
+    return dt.datetime.fromtimestamp(now_ms / 1000.0)
+
 
 def create_queue():
     pass
@@ -36,14 +826,12 @@ def create_submission(queue_id, submission_data, wes_id=None):
     Returns:
         ...
     """
-    submissions = get_json(submission_queue)
-    submission_id = dt.datetime.now().strftime('%d%m%d%H%M%S%f')
+    submission_id = new_submission_id()
 
     submission = {'status': 'RECEIVED',
                   'data': submission_data,
                   'wes_id': wes_id}
-    submissions.setdefault(queue_id, {})[submission_id] = submission
-    save_json(submission_queue, submissions)
+    load_queue_store().create(queue_id, submission_id, submission)
     logger.info(" Queueing job for '{}' endpoint:"
                 "\n - submission ID: {}".format(wes_id, submission_id))
     return submission_id
@@ -51,7 +839,9 @@ def create_submission(queue_id, submission_data, wes_id=None):
 
 def get_submissions(queue_id,
                     status=['RECEIVED', 'SUBMITTED', 'VALIDATED', 'COMPLETE'],
-                    exclude_status=[]):
+                    exclude_status=[],
+                    created_after=None,
+                    created_before=None):
     """
     Return all ids with the requested status.
 
@@ -59,18 +849,23 @@ def get_submissions(queue_id,
         queue_id (str): string identifying the workflow queue
         status (:obj:`list` of :obj:`str`): ...
         exclude_status (:obj:`list` of :obj:`str`): ...
+        created_after (datetime): only return submissions created
+            at or after this time
+        created_before (datetime): only return submissions created
+            before this time
 
     Returns:
         ...
     """
-    submissions = get_json(submission_queue)
+    if isinstance(status, str):
+        status = [status]
     if len(exclude_status):
         status = [s for s in status if s not in exclude_status]
-    try:
-        return [id for id, bundle in submissions[queue_id].items()
-                if bundle['status'] in status]
-    except KeyError:
-        return []
+    id_range = None
+    if created_after is not None or created_before is not None:
+        id_range = (created_after and submission_id_floor(created_after),
+                    created_before and submission_id_floor(created_before))
+    return load_queue_store().list_ids(queue_id, status, id_range)
 
 
 def get_submission_bundle(queue_id, submission_id):
@@ -84,7 +879,7 @@ def get_submission_bundle(queue_id, submission_id):
     Returns:
         ...
     """
-    return get_json(submission_queue)[queue_id][submission_id]
+    return load_queue_store().get(queue_id, submission_id)
 
 
 def update_submission(queue_id, submission_id, param, value):
@@ -100,6 +895,83 @@ def update_submission(queue_id, submission_id, param, value):
     Returns:
         ...
     """
-    submissions = get_json(submission_queue)
-    submissions[queue_id][submission_id][param] = value
-    save_json(submission_queue, submissions)
+    load_queue_store().update(queue_id, submission_id, param, value)
+
+
+def update_submissions(updates):
+    """
+    Update fields for many submissions in a single atomic commit.
+
+    Args:
+        updates (:obj:`list` of :obj:`tuple`): list of
+            (queue_id, submission_id, fields) entries, where `fields`
+            is a dict mapping params to their new values
+    """
+    updates = [(queue_id, submission_id, dict(fields))
+               for queue_id, submission_id, fields in updates]
+    if len(updates):
+        load_queue_store().update_many(updates)
+
+
+def modify_submission(queue_id, submission_id, func):
+    """
+    Read a submission and update it in one step, holding the queue lock
+    so no other write can land in between.
+
+    Args:
+        queue_id (str): ...
+        submission_id (str): ...
+        func (function): called with the submission's info; returns a
+            dict of fields to update, or None to leave it unchanged
+
+    Returns:
+        dict: the fields that were updated, or None
+    """
+    return load_queue_store().modify(queue_id, submission_id, func)
+
+
+class SubmissionBatch(object):
+    """
+    Collect submission updates to be committed together with
+    :func:`update_submissions`.
+    """
+    def __init__(self):
+        self.updates = {}
+
+    def update(self, queue_id, submission_id, param, value):
+        """
+        Stage a new value for a submission param.
+
+        Args:
+            queue_id (str): ...
+            submission_id (str): ...
+            param (str): ...
+            value: ...
+        """
+        self.updates.setdefault((queue_id, submission_id), {})[param] = value
+
+    def commit(self):
+        update_submissions([(queue_id, submission_id, fields)
+                            for (queue_id, submission_id), fields
+                            in self.updates.items()])
+        self.updates = {}
+
+
+@contextmanager
+def submission_batch():
+    """
+    Stage submission updates and commit them in one write on exit.
+
+    Yields:
+        :class:`SubmissionBatch`: batch collecting the updates
+    """
+    batch = SubmissionBatch()
+    yield batch
+    batch.commit()
+
+
+def compact_queue():
+    """
+    Fold any journaled updates into the submission queue file.
+    """
+    load_queue_store().compact()
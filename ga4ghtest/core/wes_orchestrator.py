@@ -11,8 +11,14 @@ import sys
 import time
 import os
 import json
+import threading
+import heapq
+import random
 import datetime as dt
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError, Timeout
+
 from ga4ghtest.core.config import queue_config, wes_config
 from ga4ghtest.util import ctime2datetime, convert_timedelta
 from ga4ghtest.services.wes import WESService
@@ -20,13 +26,306 @@ from ga4ghtest.converters.trs2wes import store_verification
 from ga4ghtest.converters.trs2wes import build_wes_request
 from ga4ghtest.converters.trs2wes import fetch_queue_workflow
 from ga4ghtest.core.queue import get_submission_bundle
+from ga4ghtest.core.queue import modify_submission
 from ga4ghtest.core.queue import get_submissions
 from ga4ghtest.core.queue import create_submission
 from ga4ghtest.core.queue import update_submission
+from ga4ghtest.core.queue import update_submissions
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# default number of threads used to poll WES endpoints during a sweep
+# and to submit runs from a queue, and the default number of concurrent
+# requests sent to any one endpoint (override per endpoint with
+# 'max_concurrency' in the WES config; 'max_requests_per_second' caps
+# the request rate, which is otherwise unlimited)
+monitor_workers = 32
+submit_workers = 16
+endpoint_concurrency = 8
+
+# number of attempts for a run submission that fails with a connection
+# error or a 5xx response, and the base delay (in seconds) for backoff
+submit_attempts = 4
+retry_delay = 1.0
+
+
+class EndpointSlot(object):
+    """
+    Context manager holding one of an endpoint's concurrent request
+    slots, optionally spacing requests to stay under a rate limit.
+
+    Args:
+        limit (int): maximum number of concurrent requests
+        rate (float): maximum number of requests per second
+    """
+    def __init__(self, limit, rate=None):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next_start = 0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+
+class EndpointLimiter(object):
+    """
+    Bound the number of concurrent requests (and, if configured, the
+    request rate) sent to each workflow execution service endpoint.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def slot(self, wes_id):
+        """
+        Return the request slot for an endpoint.
+
+        Args:
+            wes_id (str): string identifying the workflow execution
+                service endpoint
+
+        Returns:
+            :class:`EndpointSlot`: context manager to hold while
+                sending a request to the endpoint
+        """
+        with self._lock:
+            if wes_id not in self._slots:
+                service_config = wes_config().get(wes_id) or {}
+                self._slots[wes_id] = EndpointSlot(
+                    limit=service_config.get('max_concurrency',
+                                             endpoint_concurrency),
+                    rate=service_config.get('max_requests_per_second')
+                )
+            return self._slots[wes_id]
+
+
+endpoint_limiter = EndpointLimiter()
+
+
+class StatusFollowup(object):
+    """
+    Fetch the first status of newly submitted runs in the background.
+
+    Each scheduled run is polled after a short delay; while the WES
+    endpoint can't report a known state for the run (or the request
+    fails), the run is polled again with exponential backoff. Once a
+    state is known, it is recorded in the submission's run log, unless
+    the run log was already updated (e.g., by :func:`monitor_queue`).
+
+    Args:
+        initial_delay (float): seconds to wait before the first poll
+        max_delay (float): upper limit in seconds for the backoff delay
+        max_attempts (int): number of polls before giving up on a run
+            (it is then left for :func:`monitor_queue` to pick up)
+        max_workers (int): number of threads used to poll endpoints
+    """
+    def __init__(self,
+                 initial_delay=0.5,
+                 max_delay=60.0,
+                 max_attempts=12,
+                 max_workers=8):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        self._schedule = []
+        self._active = 0
+        self._count = 0
+        self._thread = None
+        self._executor = None
+        self._wes_instances = {}
+
+    def schedule(self, queue_id, submission_id, wes_id, run_id):
+        """
+        Schedule the first status check for a workflow run.
+
+        Args:
+            queue_id (str): string identifying the workflow queue
+            submission_id (str): ...
+            wes_id (str): string identifying the workflow execution
+                service endpoint
+            run_id (str): ID of the run on the WES endpoint
+        """
+        run = {'queue_id': queue_id,
+               'submission_id': submission_id,
+               'wes_id': wes_id,
+               'run_id': run_id,
+               'attempt': 0,
+               'delay': self.initial_delay}
+        with self._cond:
+            self._push(run)
+            if self._thread is None or not self._thread.is_alive():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+                self._thread = threading.Thread(target=self._dispatch,
+                                                name='status-followup',
+                                                daemon=True)
+                self._thread.start()
+
+    def join(self, timeout=None):
+        """
+        Wait until all scheduled runs have been followed up.
+
+        Args:
+            timeout (float): maximum number of seconds to wait
+
+        Returns:
+            bool: True if no follow-ups are left, else False
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._schedule and not self._active,
+                timeout=timeout
+            )
+
+    def _push(self, run):
+        self._count += 1
+        heapq.heappush(self._schedule,
+                       (time.monotonic() + run['delay'], self._count, run))
+        self._cond.notify_all()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._schedule:
+                        self._cond.wait()
+                        continue
+                    due, _, run = self._schedule[0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._schedule)
+                        self._active += 1
+                        break
+                    self._cond.wait(wait)
+            try:
+                self._executor.submit(self._follow_up, run)
+            except RuntimeError:
+                # interpreter is shutting down; remaining runs are left
+                # for the next monitor_queue sweep
+                with self._cond:
+                    self._active -= 1
+                    self._schedule = []
+                    self._cond.notify_all()
+                return
+
+    def _get_wes_instance(self, wes_id):
+        with self._cond:
+            if wes_id not in self._wes_instances:
+                self._wes_instances[wes_id] = WESService(wes_id)
+            return self._wes_instances[wes_id]
+
+    def _follow_up(self, run):
+        try:
+            state = None
+            try:
+                with endpoint_limiter.slot(run['wes_id']):
+                    run_status = self._get_wes_instance(
+                        run['wes_id']).get_run_status(run['run_id'])
+                state = run_status['state']
+            except Exception:
+                logger.debug("Status check failed for run '{}' on WES '{}'"
+                             .format(run['run_id'], run['wes_id']),
+                             exc_info=True)
+            run['attempt'] += 1
+            if state in (None, 'UNKNOWN'):
+                if run['attempt'] < self.max_attempts:
+                    run['delay'] = min(run['delay'] * 2, self.max_delay)
+                    run['delay'] *= random.uniform(0.8, 1.2)
+                    with self._cond:
+                        self._push(run)
+                return
+            self._record(run, state)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _record(self, run, state):
+        def set_state(submission):
+            run_log = submission.get('run_log')
+            if run_log is None or run_log.get('status') != 'UNKNOWN':
+                return None
+            run_log['status'] = state
+            return {'run_log': run_log}
+
+        try:
+            if not modify_submission(run['queue_id'], run['submission_id'],
+                                     set_state):
+                return
+        except KeyError:
+            return
+        logger.info("Run '{}' on WES '{}' is {}"
+                    .format(run['run_id'], run['wes_id'], state))
+
+
+status_followup = StatusFollowup()
+
+
+def _is_retryable(error):
+    """
+    Check whether a failed request is worth retrying (connection
+    errors, timeouts, and 5xx responses).
+    """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None),
+                              'status_code', None)
+    return status_code is not None and status_code >= 500
+
+
+def _rewind_parts(parts):
+    """
+    Reset any file objects in request parts, so the request can be
+    sent again.
+    """
+    for _, value in parts or []:
+        if isinstance(value, tuple) and hasattr(value[1], 'seek'):
+            value[1].seek(0)
+
+
+def _submit_run(wes_instance, request, parts=None):
+    """
+    Send a run request to a WES endpoint, retrying with jittered
+    backoff on connection errors and 5xx responses.
+
+    Args:
+        wes_instance (:obj:`WESService`): ...
+        request (dict): ...
+        parts (list): ...
+
+    Returns:
+        dict: run log returned by the WES endpoint
+    """
+    for attempt in range(1, submit_attempts + 1):
+        try:
+            with endpoint_limiter.slot(wes_instance.id):
+                return wes_instance.run_workflow(request, parts=parts)
+        except Exception as e:
+            if attempt == submit_attempts or not _is_retryable(e):
+                raise
+            delay = random.uniform(0, retry_delay * 2 ** attempt)
+            logger.warning("Run request to WES '{}' failed ({}); retrying "
+                           "in {:.1f}s".format(wes_instance.id, e, delay))
+            time.sleep(delay)
+            _rewind_parts(parts)
+
 
 def run_job(queue_id,
             wes_id,
@@ -37,6 +336,10 @@ def run_job(queue_id,
     """
     Put a workflow in the queue and immmediately run it.
 
+    The call returns as soon as the WES endpoint has accepted the run;
+    the run log status is 'UNKNOWN' until the first status check,
+    which is scheduled in the background with `status_followup`.
+
     :param str queue_id: String identifying the workflow queue.
     :param str wes_id:
     :param str wf_jsonyaml:
@@ -49,8 +352,8 @@ def run_job(queue_id,
         wf_config = fetch_queue_workflow(queue_id)
     wf_attachments = wf_config['workflow_attachments']
     if add_attachments is not None:
-        wf_attachments += add_attachments
-        wf_attachments = list(set(wf_attachments))
+        wf_attachments = list(set(list(wf_attachments or [])
+                                  + add_attachments))
 
     if not submission:
         submission_id = create_submission(queue_id=queue_id,
@@ -75,7 +378,7 @@ def run_job(queue_id,
                     json.dumps(service_config['workflow_engine_parameters'])))
     parts = parts if len(parts) else None
 
-    run_log = wes_instance.run_workflow(request, parts=parts)
+    run_log = _submit_run(wes_instance, request, parts=parts)
     if run_log['run_id'] == 'failed':
         logger.info("Job submission failed for WES '{}'"
                     .format(wes_id))
@@ -85,14 +388,16 @@ def run_job(queue_id,
         logger.info("Job received by WES '{}', run ID: {}"
                     .format(wes_id, run_log['run_id']))
         run_log['start_time'] = dt.datetime.now().ctime()
-        time.sleep(10)
-        run_status = wes_instance.get_run_status(run_log['run_id'])['state']
+        run_status = 'UNKNOWN'
         sub_status = 'SUBMITTED'
     run_log['status'] = run_status
 
     if not submission:
-        update_submission(queue_id, submission_id, 'run_log', run_log)
-        update_submission(queue_id, submission_id, 'status', sub_status)
+        update_submissions([(queue_id, submission_id,
+                             {'run_log': run_log, 'status': sub_status})])
+        if run_status == 'UNKNOWN':
+            status_followup.schedule(queue_id, submission_id,
+                                     wes_id, run_log['run_id'])
     return run_log
 
 
@@ -123,44 +428,114 @@ def run_submission(queue_id,
                       wes_id=wes_id,
                       wf_jsonyaml=wf_jsonyaml,
                       submission=True,
-                       dopts=opts)
+                      opts=opts)
 
-    update_submission(queue_id, submission_id, 'run_log', run_log)
-    update_submission(queue_id, submission_id, 'status', 'SUBMITTED')
+    update_submissions([(queue_id, submission_id,
+                         {'run_log': run_log, 'status': 'SUBMITTED'})])
+    if run_log['status'] == 'UNKNOWN':
+        status_followup.schedule(queue_id, submission_id,
+                                 wes_id, run_log['run_id'])
     return run_log
 
 
-def run_queue(queue_id, wes_id=None, opts=None):
+def run_queue(queue_id, wes_id=None, opts=None, max_workers=None):
     """
     Run all submissions in a queue in a single environment.
 
+    Submissions are prepared and sent concurrently; requests to each
+    WES endpoint are bounded by the endpoint's configured concurrency
+    and rate limits.
+
     :param str queue_id: String identifying the workflow queue.
     :param str wes_id:
     :param dict opts:
+    :param int max_workers: Maximum number of submissions in progress.
     """
-    queue_log = {}
-    for submission_id in get_submissions(queue_id, status='RECEIVED'):
+    def _run(submission_id):
         submission = get_submission_bundle(queue_id, submission_id)
+        sub_wes_id = wes_id
         if submission['wes_id'] is not None:
-            wes_id = submission['wes_id']
+            sub_wes_id = submission['wes_id']
         run_log = run_submission(queue_id=queue_id,
-                                submission_id=submission_id,
-                                wes_id=wes_id,
-                                opts=opts)
-        run_log['wes_id'] = wes_id
-        queue_log[submission_id] = run_log
+                                 submission_id=submission_id,
+                                 wes_id=sub_wes_id,
+                                 opts=opts)
+        run_log['wes_id'] = sub_wes_id
+        return run_log
+
+    submission_ids = get_submissions(queue_id, status='RECEIVED')
+    if not len(submission_ids):
+        return {}
+    start_time = time.monotonic()
+    max_workers = min(max_workers or submit_workers, len(submission_ids))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(submission_id, executor.submit(_run, submission_id))
+                   for submission_id in submission_ids]
 
+    queue_log = {}
+    for submission_id, future in futures:
+        try:
+            queue_log[submission_id] = future.result()
+        except Exception:
+            logger.exception("Failed to run submission '{}' in queue '{}'"
+                             .format(submission_id, queue_id))
+    elapsed = time.monotonic() - start_time
+    logger.info("Submitted {} of {} runs for queue '{}' in {:.1f}s "
+                "({:.2f} submissions/s)"
+                .format(len(queue_log), len(submission_ids), queue_id,
+                        elapsed, len(queue_log) / max(elapsed, 1e-6)))
     return queue_log
 
 
-def monitor_queue(queue_id):
+def _poll_run_statuses(runs, max_workers=None):
+    """
+    Fetch the current status of many workflow runs concurrently.
+
+    Args:
+        runs (dict): dict mapping submission IDs to (wes_id, run_id)
+            tuples
+        max_workers (int): maximum number of threads used to poll
+            endpoints (defaults to `monitor_workers`)
+
+    Returns:
+        dict: dict mapping submission IDs to the run status returned by
+            the WES endpoint, or None if the status couldn't be fetched
+    """
+    if not len(runs):
+        return {}
+    wes_instances = {wes_id: WESService(wes_id)
+                     for wes_id in set(wes_id for wes_id, _ in runs.values())}
+
+    def _poll(wes_id, run_id):
+        with endpoint_limiter.slot(wes_id):
+            try:
+                return wes_instances[wes_id].get_run_status(run_id)
+            except Exception:
+                logger.exception("Failed to get status for run '{}' on "
+                                 "WES '{}'".format(run_id, wes_id))
+
+    max_workers = min(max_workers or monitor_workers, len(runs))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {sub_id: executor.submit(_poll, wes_id, run_id)
+                   for sub_id, (wes_id, run_id) in runs.items()}
+    return {sub_id: future.result() for sub_id, future in futures.items()}
+
+
+def monitor_queue(queue_id, max_workers=None):
     """
     Update the status of all submissions for a queue.
 
+    Runs are polled concurrently, with a bounded number of requests
+    in flight for each WES endpoint; updates are saved to the queue in
+    one batch at the end of the sweep.
+
         queue_id (str): string identifying the workflow queue.
+        max_workers (int): maximum number of threads used to poll
+            WES endpoints.
     """
     current = dt.datetime.now()
     queue_log = {}
+    active_runs = {}
     for sub_id in get_submissions(queue_id=queue_id):
         submission = get_submission_bundle(queue_id, sub_id)
         if submission['status'] == 'RECEIVED':
@@ -171,12 +546,17 @@ def monitor_queue(queue_id):
             queue_log[sub_id] = {'status': 'FAILED'}
             continue
         run_log['wes_id'] = submission['wes_id']
+        queue_log[sub_id] = run_log
         if run_log['status'] in ['COMPLETE', 'CANCELED', 'EXECUTOR_ERROR']:
-            queue_log[sub_id] = run_log
             continue
-        wes_instance = WESService(submission['wes_id'])
-        run_status = wes_instance.get_run_status(run_log['run_id'])
+        active_runs[sub_id] = (submission['wes_id'], run_log['run_id'])
 
+    run_statuses = _poll_run_statuses(active_runs, max_workers=max_workers)
+    updates = []
+    for sub_id, run_status in run_statuses.items():
+        if run_status is None:
+            continue
+        run_log = queue_log[sub_id]
         if run_status['state'] in ['QUEUED', 'INITIALIZING', 'RUNNING']:
             etime = convert_timedelta(
                 current - ctime2datetime(run_log['start_time'])
@@ -188,8 +568,7 @@ def monitor_queue(queue_id):
 
         run_log['status'] = run_status['state']
         run_log['elapsed_time'] = etime
-
-        update_submission(queue_id, sub_id, 'run_log', run_log)
+        sub_fields = {'run_log': run_log}
 
         if run_log['status'] == 'COMPLETE':
             wf_config = queue_config()[queue_id]
@@ -198,10 +577,10 @@ def monitor_queue(queue_id):
                 # store_verification(wf_config['target_queue'],
                 #                    submission['wes_id'])
                 sub_status = 'VALIDATED'
-            update_submission(queue_id, sub_id, 'status', sub_status)
-
-        queue_log[sub_id] = run_log
+            sub_fields['status'] = sub_status
+        updates.append((queue_id, sub_id, sub_fields))
 
+    update_submissions(updates)
     return queue_log
 
 
@@ -20,7 +20,7 @@ from ga4ghtest.services.trs import TRSService
 from ga4ghtest.services.wes import WESService
 from ga4ghtest.core.queue import create_submission
 from ga4ghtest.core.wes_orchestrator import run_submission, monitor_queue
-from ga4ghtest.util import get_json, save_json
+from ga4ghtest.util import get_json, save_json, thaw, fsync_batch
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -130,27 +130,30 @@ def check_workflow(queue_id, wes_id, opts=None, force=False):
         type=wf_config['workflow_type']
     )
     checker_job = checker_tests[0]
-    checker_config = queue_config()[checker_queue_id]
+    checker_config = thaw(queue_config()[checker_queue_id])
     checker_config['test'] = checker_job['url']
     set_yaml('queues', checker_queue_id, checker_config)
-    for opt in opts:
-        if 'run_id' in opt:
-            opt.pop('run_id')
-        submission_id = create_submission(queue_id=checker_queue_id,
-                                          submission_data=checker_job['url'],
-                                          wes_id=wes_id)
-        logger.info("Created submission '{}' for queue '{}'; running in '{}'"
-                    "with options: {}"
-                    .format(submission_id, checker_queue_id, wes_id, opt))
-        testbed_status.setdefault(checker_queue_id, {}).setdefault(wes_id, {})[submission_id] = opt
-        save_json(testbed_log, testbed_status)
-        logger.info("Requesting new workflow run for '{}' in '{}'"
-                    .format(checker_queue_id, wes_id))
-        run_log = run_submission(queue_id=checker_queue_id,
-                                 submission_id=submission_id,
-                                 opts=opt)
-        testbed_status[checker_queue_id][wes_id][submission_id]['run_id'] = run_log['run_id']
-        save_json(testbed_log, testbed_status)
+    # the testbed log is saved twice per run; flush it to disk once,
+    # while queue writes are still synced as they happen
+    with fsync_batch(testbed_log):
+        for opt in opts:
+            if 'run_id' in opt:
+                opt.pop('run_id')
+            submission_id = create_submission(queue_id=checker_queue_id,
+                                              submission_data=checker_job['url'],
+                                              wes_id=wes_id)
+            logger.info("Created submission '{}' for queue '{}'; running in '{}'"
+                        "with options: {}"
+                        .format(submission_id, checker_queue_id, wes_id, opt))
+            testbed_status.setdefault(checker_queue_id, {}).setdefault(wes_id, {})[submission_id] = opt
+            save_json(testbed_log, testbed_status)
+            logger.info("Requesting new workflow run for '{}' in '{}'"
+                        .format(checker_queue_id, wes_id))
+            run_log = run_submission(queue_id=checker_queue_id,
+                                     submission_id=submission_id,
+                                     opts=opt)
+            testbed_status[checker_queue_id][wes_id][submission_id]['run_id'] = run_log['run_id']
+            save_json(testbed_log, testbed_status)
 
     return testbed_status
 
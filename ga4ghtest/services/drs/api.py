@@ -8,6 +8,7 @@ import logging
 from bravado.requests_client import RequestsClient
 
 from ga4ghtest.core.config import drs_config
+from ga4ghtest.services.sessions import get_session
 from .client import DRSClient
 
 logger = logging.getLogger(__name__)
@@ -28,6 +29,10 @@ def _init_http_client(service_id=None, opts=None):
         opts = _get_drs_opts(service_id)
 
     http_client = RequestsClient()
+    http_client.session = get_session(
+        '{}://{}'.format(opts.get('proto', 'https'), opts['host']),
+        opts, allow_http2=False
+    )
 
     http_client.set_api_key(host=opts['host'],
                             api_key=opts['auth'],
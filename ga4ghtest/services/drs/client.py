@@ -1,6 +1,7 @@
 import logging
 import json
-import requests
+
+from ga4ghtest.services.sessions import get_session
 
 from ga4gh.drs.cli.methods.get import get
 
@@ -21,6 +22,7 @@ class DRSClient(object):
         self.host = service['host']  # domain name of the website (i.e. 'ga4gh.com')
         self.path = 'ga4gh/drs/v1'
         self.base = '%s://%s/%s' % (self.proto, self.host, self.path)
+        self.session = get_session(self.base, service)  # pooled, keep-alive
 
         self.log_file = None
         self.expand = False
@@ -35,10 +37,10 @@ class DRSClient(object):
 
         :return:
         """
-        result = requests.get('{base}/bundles/{bundle_id}'
-                                  ''.format(base=self.base,
-                                            bundle_id=bundle_id),
-                                  headers=self.auth)
+        result = self.session.get('{base}/bundles/{bundle_id}'
+                                       ''.format(base=self.base,
+                                                 bundle_id=bundle_id),
+                                       headers=self.auth)
         return api_reponse(result)
 
     def get_object(self, object_id):
@@ -47,10 +49,10 @@ class DRSClient(object):
 
         :return:
         """
-        postresult = requests.get('{base}/objects/{object_id}'.format(
-                                  base=self.base,
-                                  object_id=object_id),
-                                  headers=self.auth)
+        postresult = self.session.get('{base}/objects/{object_id}'.format(
+                                       base=self.base,
+                                       object_id=object_id),
+                                       headers=self.auth)
         return api_reponse(postresult)
 
     def getAccessURL(self, object_id, access_id):
@@ -59,11 +61,11 @@ class DRSClient(object):
 
         :return:
         """
-        postresult = requests.get('{base}/objects/{object_id}/access/{access_id}'.format(
-                                  base=self.base,
-                                  object_id=object_id,
-                                  access_id=access_id),
-                                  headers=self.auth)
+        postresult = self.session.get('{base}/objects/{object_id}/access/{access_id}'.format(
+                                       base=self.base,
+                                       object_id=object_id,
+                                       access_id=access_id),
+                                       headers=self.auth)
         return api_reponse(postresult)
 
     def downloadFile(self, object_id, destPath, expand = False):
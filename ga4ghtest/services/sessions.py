@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Shared HTTP sessions for service API clients. Sessions are kept per
+service host (scheme and network location), so that requests to the
+same host reuse pooled, keep-alive connections instead of opening a
+new connection (and TLS handshake) for every call.
+
+Pool sizes can be set for a service with 'pool_connections' and
+'pool_maxsize' in its config entry; 'http2: true' uses an HTTP/2 client
+for the host, if the optional `httpx` (with `h2`) package is installed.
+
+401 responses on any shared session are passed to the handlers
+registered with :func:`on_auth_failure`, so cached access tokens are
+refreshed after the server rejects them.
+"""
+import logging
+import threading
+import urllib.parse as urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# defaults for the number of pooled hosts per session and the number of
+# connections kept open per host
+pool_connections = 10
+pool_maxsize = 32
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# functions called with each 401 response (e.g., to refresh tokens)
+_auth_failure_handlers = []
+
+
+def on_auth_failure(handler):
+    """
+    Register a function to call with any 401 (Unauthorized) response
+    received over a shared session, e.g., to drop a cached access token.
+
+    Args:
+        handler (function): function that takes the response
+    """
+    _auth_failure_handlers.append(handler)
+
+
+def _check_auth(response, *args, **kwargs):
+    if response.status_code == 401:
+        for handler in list(_auth_failure_handlers):
+            try:
+                handler(response)
+            except Exception:
+                logger.warning("Auth failure handler failed",
+                               exc_info=True)
+
+
+def _session_key(url, http2=False):
+    parts = urlparse.urlsplit(url)
+    return (parts.scheme, parts.netloc, http2)
+
+
+def _init_http2_client(opts):
+    """
+    Create an HTTP/2 client, or return None if not supported.
+    """
+    try:
+        import httpx
+        return httpx.Client(
+            http2=True,
+            event_hooks={'response': [_check_auth]},
+            limits=httpx.Limits(
+                max_connections=opts.get('pool_maxsize', pool_maxsize),
+                max_keepalive_connections=opts.get('pool_maxsize',
+                                                   pool_maxsize)
+            )
+        )
+    except ImportError:
+        logger.warning("HTTP/2 requires the 'httpx[http2]' package; "
+                       "falling back to HTTP/1.1")
+
+
+def _init_session(scheme, opts, http2=False):
+    """
+    Create a pooled, keep-alive HTTP session.
+    """
+    if http2:
+        client = _init_http2_client(opts)
+        if client is not None:
+            return client
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=opts.get('pool_connections', pool_connections),
+        pool_maxsize=opts.get('pool_maxsize', pool_maxsize)
+    )
+    session.mount('{}://'.format(scheme), adapter)
+    session.hooks['response'].append(_check_auth)
+    return session
+
+
+def get_session(url, opts=None, allow_http2=True):
+    """
+    Return the shared HTTP session for the host of a URL.
+
+    Args:
+        url (str): URL (or base URL) for a service endpoint
+        opts (dict): service config entry with optional pool settings;
+            only used when the host's session is first created
+        allow_http2 (bool): set to False if the caller needs a
+            :class:`requests.Session` (e.g., for bravado clients)
+
+    Returns:
+        session with a `requests`-style `get()` and `post()` interface
+    """
+    opts = opts or {}
+    key = _session_key(url, http2=allow_http2 and bool(opts.get('http2')))
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _init_session(key[0], opts, http2=key[2])
+            _sessions[key] = session
+        return session
+
+
+def close_sessions():
+    """
+    Close all shared sessions and their pooled connections.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+On-disk cache for Tool Registry Service (TRS) responses. Response
+bodies are stored once per content hash in a blob store; an index maps
+request URLs to blobs along with validators ('ETag', 'Last-Modified')
+and the time each entry was last checked.
+
+Responses are reused until they are older than a TTL and then
+revalidated with a conditional request: `mutable_ttl` seconds for
+mutable versions (e.g., 'develop' or 'master') and `pinned_ttl` seconds
+for everything else, since registries cannot tell branch names from
+tags. Entries are keyed on the URL and the request headers, so responses
+fetched with one credential are never served for another.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# default cache location; set to None to disable caching
+cache_dir = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'ga4ghtest', 'trs'
+)
+
+# version names that can point to different content over time
+mutable_versions = ('develop', 'master', 'main', 'latest')
+mutable_ttl = 300
+pinned_ttl = 24 * 60 * 60
+
+# minimum seconds between index writes; `TRSCache.flush` forces a write
+index_flush_interval = 5
+
+# limits for the number of cached responses and total blob size
+max_entries = 10000
+max_bytes = 512 * 1024 * 1024
+
+
+class CachedResponse(object):
+    """
+    Minimal response object for a cached TRS response body.
+
+    Args:
+        content (bytes): ...
+        status_code (int): ...
+    """
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class TRSCache(object):
+    """
+    Content-addressed TRS response cache with LRU eviction.
+
+    Args:
+        path (str): cache directory
+        max_entries (int): ...
+        max_bytes (int): ...
+    """
+    def __init__(self, path, max_entries=max_entries, max_bytes=max_bytes):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None
+        self._refs = Counter()
+        self._total = 0
+        self._dirty = False
+        self._saved_at = 0
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path) as f:
+                    self._index = OrderedDict(json.load(f))
+            except (OSError, ValueError):
+                self._index = OrderedDict()
+            for entry in self._index.values():
+                self._add_ref(entry)
+        return self._index
+
+    def _add_ref(self, entry):
+        self._refs[entry['digest']] += 1
+        self._total += entry['size']
+
+    def _remove_ref(self, entry):
+        self._total -= entry['size']
+        self._refs[entry['digest']] -= 1
+        if self._refs[entry['digest']] <= 0:
+            del self._refs[entry['digest']]
+            try:
+                os.remove(self._blob_path(entry['digest']))
+            except OSError:
+                pass
+
+    def _save_index(self):
+        self._write(self.index_path,
+                    json.dumps(list(self._index.items())).encode('utf-8'))
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def _maybe_save_index(self, force=False):
+        if not (self._dirty or force):
+            return
+        if not force and (time.time() - self._saved_at
+                          < index_flush_interval):
+            return
+        try:
+            self._save_index()
+        except OSError as e:
+            logger.warning("Unable to save TRS cache index: {}".format(e))
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, entry):
+        try:
+            with open(self._blob_path(entry['digest']), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _evict(self):
+        index = self._index
+        while index and (len(index) > self.max_entries
+                         or self._total > self.max_bytes):
+            _, entry = index.popitem(last=False)
+            self._remove_ref(entry)
+
+    def get(self, session, url, headers=None, mutable=False):
+        """
+        Return the response for a TRS request, from the cache if
+        possible.
+
+        Args:
+            session: HTTP session used for requests to the registry
+            url (str): request URL
+            headers (dict): request headers (e.g., auth)
+            mutable (bool): whether the response can change over time
+
+        Returns:
+            response with `status_code`, `content` and `text`
+        """
+        key = _cache_key(url, headers)
+        with self._lock:
+            entry = self._load_index().get(key)
+            if entry is not None:
+                entry = dict(entry)
+        content = self._read_blob(entry) if entry is not None else None
+
+        ttl = mutable_ttl if mutable else pinned_ttl
+        if content is not None and time.time() - entry['checked'] < ttl:
+            with self._lock:
+                if key in self._index:
+                    self._index.move_to_end(key)
+            return CachedResponse(content)
+
+        request_headers = dict(headers or {})
+        if content is not None:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, headers=request_headers)
+
+        if response.status_code == 304 and content is not None:
+            entry['checked'] = time.time()
+            self._update(key, entry)
+            return CachedResponse(content)
+        if response.status_code != 200:
+            return response
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        try:
+            if not os.path.exists(blob_path):
+                self._write(blob_path, content)
+        except OSError as e:
+            logger.warning("Unable to cache TRS response: {}".format(e))
+            return response
+        self._update(key, {
+            'digest': digest,
+            'size': len(content),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked': time.time()
+        })
+        return response
+
+    def _update(self, key, entry):
+        with self._lock:
+            index = self._load_index()
+            old_entry = index.get(key)
+            index[key] = entry
+            index.move_to_end(key)
+            self._add_ref(entry)
+            if old_entry is not None:
+                self._remove_ref(old_entry)
+            self._evict()
+            self._dirty = True
+            self._maybe_save_index()
+
+    def flush(self):
+        """
+        Write pending index updates to disk.
+        """
+        with self._lock:
+            if self._index is not None:
+                self._maybe_save_index(force=self._dirty)
+
+    def clear(self):
+        """
+        Remove all cached responses.
+        """
+        with self._lock:
+            self._load_index()
+            for entry in self._index.values():
+                try:
+                    os.remove(self._blob_path(entry['digest']))
+                except OSError:
+                    pass
+            self._index.clear()
+            self._refs.clear()
+            self._total = 0
+            self._save_index()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_trs_cache(path=None):
+    """
+    Return the shared TRS response cache for a directory.
+
+    Args:
+        path (str): cache directory (defaults to `cache_dir`)
+
+    Returns:
+        :class:`TRSCache`, or None if caching is disabled
+    """
+    path = path or cache_dir
+    if path is None:
+        return None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = TRSCache(path)
+            atexit.register(_caches[path].flush)
+        return _caches[path]
+
+
+def _cache_key(url, headers=None):
+    if not headers:
+        return url
+    digest = hashlib.sha256(
+        json.dumps(sorted(headers.items())).encode('utf-8')
+    ).hexdigest()
+    return '{}#{}'.format(url, digest[:16])
+
+
+def is_mutable_version(tool_version):
+    """
+    Check whether a tool version name refers to changing content.
+
+    Args:
+        tool_version (str): ...
+    """
+    return tool_version is None or tool_version in mutable_versions
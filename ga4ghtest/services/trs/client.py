@@ -1,6 +1,9 @@
 import logging
 import json
-import requests
+
+from ga4ghtest.services.sessions import get_session
+from ga4ghtest.services.trs.cache import get_trs_cache
+from ga4ghtest.services.trs.cache import is_mutable_version
 
 
 def api_reponse(postresult):
@@ -19,6 +22,22 @@ class TRSClient(object):
         self.host = service['host']  # domain name of the website (i.e. 'ga4gh.com')
         self.version = 'ga4gh/trs/v2'
         self.base = '%s://%s/%s' % (self.proto, self.host, self.version)
+        self.session = get_session(self.base, service)  # pooled, keep-alive
+        self.cache = (get_trs_cache(service.get('cache_dir'))
+                      if service.get('cache', True) else None)
+
+    def _get(self, url, tool_version=None):
+        """
+        Send a GET request, using cached responses where possible.
+
+        :param url: request URL
+        :param tool_version: tool version the response is for, if any
+        :return:
+        """
+        if self.cache is None:
+            return self.session.get(url, headers=self.auth)
+        return self.cache.get(self.session, url, headers=self.auth,
+                              mutable=is_mutable_version(tool_version))
 
     def get_tools(self):
         """
@@ -26,8 +45,7 @@ class TRSClient(object):
 
         :return:
         """
-        postresult = requests.get('{base}/tools'.format(base=self.base),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools'.format(base=self.base))
         return api_reponse(postresult)
 
     def get_tool_types(self):
@@ -36,8 +54,7 @@ class TRSClient(object):
 
         :return:
         """
-        postresult = requests.get('{base}/toolClasses'.format(base=self.base),
-                                  headers=self.auth)
+        postresult = self._get('{base}/toolClasses'.format(base=self.base))
         return api_reponse(postresult)
 
     def get_tool(self, tool_id):
@@ -47,8 +64,7 @@ class TRSClient(object):
         :param id: A unique identifier of the tool, scoped to this registry, for example 123456.
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}'.format(base=self.base, tool_id=tool_id),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}'.format(base=self.base, tool_id=tool_id))
         return api_reponse(postresult)
 
     def get_tool_versions(self, tool_id):
@@ -58,8 +74,7 @@ class TRSClient(object):
         :param id: A unique identifier of the tool, scoped to this registry, for example 123456.
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions'.format(base=self.base, tool_id=tool_id),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions'.format(base=self.base, tool_id=tool_id))
         return api_reponse(postresult)
 
     def get_tool_version(self, tool_id, tool_version):
@@ -72,9 +87,9 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{version_id}'
-                                  ''.format(base=self.base, tool_id=tool_id, version_id=tool_version),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{version_id}'
+                                ''.format(base=self.base, tool_id=tool_id, version_id=tool_version),
+                                tool_version=tool_version)
         return api_reponse(postresult)
 
     def get_tool_descriptor(self, tool_id, tool_version, descriptor_type):
@@ -87,12 +102,12 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{tool_version}/{tool_type}/descriptor'
-                                  ''.format(base=self.base,
-                                            tool_id=tool_id,
-                                            tool_version=tool_version,
-                                            tool_type=descriptor_type),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{tool_version}/{tool_type}/descriptor'
+                                ''.format(base=self.base,
+                                          tool_id=tool_id,
+                                          tool_version=tool_version,
+                                          tool_type=descriptor_type),
+                                tool_version=tool_version)
         return api_reponse(postresult)
 
     def get_relative_tool_descriptor(self, tool_id, tool_version, descriptor_type, rel_path):
@@ -105,13 +120,13 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/descriptor/{rel_path}'
-                                  ''.format(base=self.base,
-                                            tool_id=tool_id,
-                                            tool_version=tool_version,
-                                            desc_type=descriptor_type,
-                                            rel_path=rel_path),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/descriptor/{rel_path}'
+                                ''.format(base=self.base,
+                                          tool_id=tool_id,
+                                          tool_version=tool_version,
+                                          desc_type=descriptor_type,
+                                          rel_path=rel_path),
+                                tool_version=tool_version)
         return api_reponse(postresult)
 
     def get_tool_tests(self, tool_id, tool_version, descriptor_type, rel_path):
@@ -124,13 +139,13 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/tests'
-                                  ''.format(base=self.base,
-                                            tool_id=tool_id,
-                                            tool_version=tool_version,
-                                            desc_type=descriptor_type,
-                                            rel_path=rel_path),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/tests'
+                                ''.format(base=self.base,
+                                          tool_id=tool_id,
+                                          tool_version=tool_version,
+                                          desc_type=descriptor_type,
+                                          rel_path=rel_path),
+                                tool_version=tool_version)
         return api_reponse(postresult)
 
     def get_tools_with_relative_path(self, tool_id, tool_version, descriptor_type):
@@ -143,12 +158,12 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/files'
-                                  ''.format(base=self.base,
-                                            tool_id=tool_id,
-                                            tool_version=tool_version,
-                                            desc_type=descriptor_type),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{tool_version}/{desc_type}/files'
+                                ''.format(base=self.base,
+                                          tool_id=tool_id,
+                                          tool_version=tool_version,
+                                          desc_type=descriptor_type),
+                                tool_version=tool_version)
         return api_reponse(postresult)
 
     def get_tool_container_specs(self, tool_id, tool_version):
@@ -161,9 +176,9 @@ class TRSClient(object):
                            (For example, 1.0.0 instead of develop)
         :return:
         """
-        postresult = requests.get('{base}/tools/{tool_id}/versions/{tool_version}/containerfile'
-                                  ''.format(base=self.base,
-                                            tool_id=tool_id,
-                                            tool_version=tool_version),
-                                  headers=self.auth)
+        postresult = self._get('{base}/tools/{tool_id}/versions/{tool_version}/containerfile'
+                                ''.format(base=self.base,
+                                          tool_id=tool_id,
+                                          tool_version=tool_version),
+                                tool_version=tool_version)
         return api_reponse(postresult)
@@ -1,17 +1,43 @@
 #!/usr/bin/env python
 """
 """
+import copy
+import hashlib
+import json
 import logging
 import os
+import tempfile
+import threading
+
+import requests
 
 from bravado.requests_client import RequestsClient
 from bravado.swagger_model import Loader
 from bravado.client import SwaggerClient
 
 from ga4ghtest.core.config import wes_config
+from ga4ghtest.converters.trs2wes import build_wes_request
+from ga4ghtest.services.sessions import get_session
+from ga4ghtest.util import MultipartStream
 
 logger = logging.getLogger(__name__)
 
+# per-user directory for parsed spec files; set to None to only cache
+# parsed specs in memory
+spec_cache_dir = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'ga4ghtest', 'wes'
+)
+
+# parsed specs, keyed by spec content hash
+_wes_specs = {}
+_wes_specs_lock = threading.Lock()
+
+# clients built from stored service configs, keyed by service ID and
+# client library
+_wes_clients = {}
+_wes_clients_lock = threading.Lock()
+
 
 def _get_wes_opts(service_id):
     """
@@ -35,6 +61,10 @@ def _init_http_client(service_id=None, opts=None):
         opts = _get_wes_opts(service_id)
 
     http_client = RequestsClient()
+    http_client.session = get_session(
+        '{}://{}'.format(opts.get('proto', 'https'), opts['host']),
+        opts, allow_http2=False
+    )
     http_client.set_api_key(host=opts['host'],
                             api_key=opts['auth'],
                             # param_name=auth_header[opts['auth_type']],
@@ -67,6 +97,12 @@ class WESAdapter(WESInterface):
     Adapter class for the WES client functionality from the
     workflow-service library.
 
+    Requests are sent over the shared session for the service host,
+    with the endpoint and auth headers configured in the client. Error
+    responses raise :class:`requests.HTTPError` with the response
+    attached, so callers can check the status code (e.g., to retry 5xx
+    responses).
+
     Args:
         wes_client: ...
     """
@@ -75,53 +111,239 @@ class WESAdapter(WESInterface):
     def __init__(self, wes_client):
         self._wes_client = wes_client
 
+    def _request(self, method, path, headers=None, **kwargs):
+        url = '{}://{}/ga4gh/wes/v1/{}'.format(self._wes_client.proto,
+                                               self._wes_client.host,
+                                               path)
+        request_headers = dict(self._wes_client.auth or {})
+        request_headers.update(headers or {})
+        res = get_session(url).request(method, url,
+                                       headers=request_headers, **kwargs)
+        return _wes_response(res)
+
     def GetServiceInfo(self):
-        return self._wes_client.get_service_info()
+        return self._request('GET', 'service-info')
 
     def ListRuns(self):
-        return self._wes_client.list_runs()
+        return self._request('GET', 'runs')
 
     def RunWorkflow(self, request, parts=None):
-        return self._wes_client.run(wf=request['workflow_url'],
-                                    jsonyaml=request['workflow_params'],
-                                    attachments=request['attachment'],
-                                    parts=parts)
+        if parts is None:
+            # like the workflow-service client, local workflows are
+            # attached and referenced by filename
+            workflow_url = request['workflow_url']
+            parts = build_wes_request(
+                workflow_url,
+                request['workflow_params'],
+                request['attachment'] or [],
+                attach_descriptor=(':' not in workflow_url
+                                   or workflow_url.startswith('file://'))
+            )
+        return self._stream_run(parts)
+
+    def _stream_run(self, parts):
+        """
+        Send a run request with a streamed multipart body, so that file
+        parts are read in chunks instead of loaded into memory.
+        """
+        body = MultipartStream(list(parts))
+        try:
+            return self._request('POST', 'runs', data=body,
+                                 headers={'Content-Type': body.content_type})
+        finally:
+            body.close()
 
     def CancelRun(self, run_id):
-        return self._wes_client.cancel(run_id=run_id)
+        return self._request('POST', 'runs/{}/cancel'.format(run_id))
 
     def GetRunStatus(self, run_id):
-        return self._wes_client.get_run_status(run_id=run_id)
+        return self._request('GET', 'runs/{}/status'.format(run_id))
 
     def GetRunLog(self, run_id):
-        return self._wes_client.get_run_log(run_id=run_id)
+        return self._request('GET', 'runs/{}'.format(run_id))
 
 
-def load_wes_client(service_id, http_client=None, client_library=None):
+def _wes_response(res):
     """
-    Return an API client for the selected workflow execution service.
+    Return the parsed body of a WES response.
+
+    Args:
+        res (:obj:`requests.Response`): ...
+
+    Raises:
+        :class:`requests.HTTPError`: for error responses, with the
+            response attached
+    """
+    if res.status_code != 200:
+        try:
+            error = str(json.loads(res.text))
+        except ValueError:
+            error = res.text
+        logger.error(error)
+        raise requests.HTTPError(error, response=res)
+    return json.loads(res.text)
+
+
+def _spec_cache_path(spec_path, digest, create=False):
+    """
+    Return the path for the parsed copy of a spec file in the per-user
+    cache directory, or None if the directory isn't private to the
+    current user (files from other users are never loaded).
+    """
+    if spec_cache_dir is None:
+        return None
+    try:
+        if create:
+            os.makedirs(spec_cache_dir, mode=0o700, exist_ok=True)
+        stat = os.stat(spec_cache_dir)
+    except OSError:
+        return None
+    if hasattr(os, 'getuid') and (stat.st_uid != os.getuid()
+                                  or stat.st_mode & 0o077):
+        logger.warning("Not using spec cache '{}': directory must be "
+                       "owned by the current user with mode 0700"
+                       .format(spec_cache_dir))
+        return None
+    filename = '{}.{}.json'.format(os.path.basename(spec_path), digest[:16])
+    return os.path.join(spec_cache_dir, filename)
+
+
+def _load_wes_spec(spec_path, http_client=None):
+    """
+    Load a Swagger spec, reusing a previously parsed and validated copy
+    with the same content hash, if available.
+
+    Args:
+        spec_path (str): path to Swagger spec file
+        http_client: ...
+
+    Returns:
+        tuple: spec dict, spec content hash, and whether the spec was
+            loaded from a validated copy
+    """
+    with open(spec_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    with _wes_specs_lock:
+        cached = _wes_specs.get(digest)
+    if cached is not None:
+        return copy.deepcopy(cached), digest, True
+
+    cache_path = _spec_cache_path(spec_path, digest)
+    if cache_path is not None:
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+        if isinstance(cached, dict) and cached.get('digest') == digest:
+            spec_dict = cached['spec']
+            with _wes_specs_lock:
+                _wes_specs[digest] = spec_dict
+            return copy.deepcopy(spec_dict), digest, True
+
+    loader = Loader(http_client, request_headers=None)
+    return loader.load_yaml(content.decode('utf-8')), digest, False
+
+
+def _save_wes_spec(spec_path, digest, spec_dict):
+    """
+    Store the parsed copy of a validated Swagger spec, so that later
+    clients (in any process) can skip parsing and validation.
+    """
+    with _wes_specs_lock:
+        _wes_specs[digest] = spec_dict
+    cache_path = _spec_cache_path(spec_path, digest, create=True)
+    if cache_path is None:
+        return None
+    try:
+        content = json.dumps({'digest': digest, 'spec': spec_dict})
+    except (TypeError, ValueError) as e:
+        logger.debug("Unable to cache parsed spec: {}".format(e))
+        return None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=spec_cache_dir)
+    except OSError as e:
+        logger.debug("Unable to cache parsed spec: {}".format(e))
+        return None
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+        return cache_path
+    except OSError as e:
+        logger.debug("Unable to cache parsed spec at '{}': {}"
+                     .format(cache_path, e))
+        os.remove(tmp_path)
+
+
+def _build_wes_client(opts, http_client=None, client_library=None):
+    """
+    Build an API client for a workflow execution service.
+
+    Args:
+        opts (dict): ...
+        http_client: ...
+        client_library (str): ...
     """
     if http_client is None:
-        http_client = _init_http_client(service_id=service_id)
+        http_client = _init_http_client(opts=opts)
 
     if client_library is not None:
         from wes_client.util import WESClient
-        wes_client = WESClient(service=_get_wes_opts(service_id))
+        wes_client = WESClient(service=opts)
         return WESAdapter(wes_client)
 
     spec_path = os.path.join(os.path.dirname(os.path.dirname(__file__)),
                              'workflow_execution_service.swagger.yaml')
     spec_path = os.path.abspath(spec_path)
 
-    opts = _get_wes_opts(service_id)
     api_url = '{}://{}'.format(opts['proto'], opts['host'])
 
-    loader = Loader(http_client, request_headers=None)
-    spec_dict = loader.load_spec('file:///{}'.format(spec_path),
-                                 base_url=api_url)
-    spec_client = SwaggerClient.from_spec(spec_dict,
-                                          origin_url=api_url,
-                                          http_client=http_client,
-                                          config={'use_models': False})
+    spec_dict, digest, validated = _load_wes_spec(spec_path, http_client)
+    if not validated:
+        parsed_spec = copy.deepcopy(spec_dict)
+    spec_client = SwaggerClient.from_spec(
+        spec_dict,
+        origin_url=api_url,
+        http_client=http_client,
+        config={'use_models': False,
+                'validate_swagger_spec': not validated}
+    )
+    if not validated:
+        _save_wes_spec(spec_path, digest, parsed_spec)
 
     return spec_client.WorkflowExecutionService
+
+
+def load_wes_client(service_id, http_client=None, client_library=None):
+    """
+    Return an API client for the selected workflow execution service.
+
+    Clients built from the stored service config are cached per service
+    and client library, and rebuilt when the service's config entry
+    changes. Passing an `http_client` always builds a new client.
+    """
+    opts = _get_wes_opts(service_id)
+    if http_client is not None:
+        return _build_wes_client(opts, http_client, client_library)
+
+    key = (service_id, client_library)
+    with _wes_clients_lock:
+        cached = _wes_clients.get(key)
+    if cached is not None and cached[0] == opts:
+        return cached[1]
+
+    client = _build_wes_client(opts, client_library=client_library)
+    with _wes_clients_lock:
+        _wes_clients[key] = (opts, client)
+    return client
+
+
+def clear_wes_clients():
+    """
+    Drop all cached WES API clients.
+    """
+    with _wes_clients_lock:
+        _wes_clients.clear()
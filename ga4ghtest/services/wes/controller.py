@@ -4,8 +4,8 @@ Wrapper class around Workflow Execution Service (WES) API client to
 provide consistent Pythonic interface.
 """
 import logging
-import requests
 
+from ga4ghtest.services.sessions import get_session
 from ga4ghtest.services.wes.api import load_wes_client
 from ga4ghtest.util import response_handler
 from ga4ghtest.core.config import wes_config
@@ -110,8 +110,8 @@ class WESService(object):
             ...
         """
         stderr_url = self.get_run(id)['run_log']['stderr']
-        auth = wes_config()[self.id]['auth']
-        res = requests.get(stderr_url, headers=auth)
+        opts = wes_config()[self.id]
+        res = get_session(stderr_url, opts).get(stderr_url, headers=opts['auth'])
         return res.text
 
     def get_run_stdout(self, id):
@@ -125,6 +125,6 @@ class WESService(object):
             ...
         """
         stdout_url = self.get_run(id)['run_log']['stdout']
-        auth = wes_config()[self.id]['auth']
-        res = requests.get(stdout_url, headers=auth)
+        opts = wes_config()[self.id]
+        res = get_session(stdout_url, opts).get(stdout_url, headers=opts['auth'])
         return res.text
@@ -4,37 +4,572 @@ Convenience methods related to handling and manipulating files,
 strings, and dates. Methods are used throughout other modules to
 streamline common operations.
 """
+import io
 import logging
+import mmap
 import os
 import re
 import json
 import yaml
+import time
+import tempfile
+import threading
+import uuid
 import subprocess32
 
 import datetime as dt
 
 from contextlib import contextmanager
-from urllib.request import urlopen
+
+from ga4ghtest.services.sessions import get_session, on_auth_failure
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# use the libyaml-backed parser and emitter when PyYAML was built with them
+_SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+_env_var_pattern = re.compile(r"\$\{([^}:\s]+):?([^}]+)?\}", re.VERBOSE)
+
+
+def _read_local(path, byte_range=None):
+    """
+    Open a local file for buffered binary reads; byte ranges are read
+    from a memory map of the file.
+    """
+    f = open(path, 'rb')
+    if byte_range is None:
+        return f
+    start, end = byte_range
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return io.BytesIO()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return io.BytesIO(mm[start:None if end is None else end + 1])
+
+
+def _read_http(url, byte_range=None):
+    """
+    Stream an HTTP(S) URL over a pooled, keep-alive session.
+    """
+    headers = {'Accept-Encoding': 'identity'}
+    if byte_range is not None:
+        start, end = byte_range
+        headers['Range'] = 'bytes={}-{}'.format(
+            start, '' if end is None else end
+        )
+    res = get_session(url).get(url, headers=headers, stream=True)
+    res.raise_for_status()
+    return res.raw
+
+
+def _read_fsspec(url, byte_range=None):
+    """
+    Open a cloud storage URL (e.g., 'gs://' or 's3://') with `fsspec`,
+    if installed.
+    """
+    try:
+        import fsspec
+    except ImportError:
+        raise ValueError("Reading '{}' requires the 'fsspec' package "
+                         "(with 'gcsfs' or 's3fs')".format(url))
+    f = fsspec.open(url, 'rb').open()
+    if byte_range is not None:
+        f.seek(byte_range[0])
+    return f
+
+
+def _read_drs(url, byte_range=None):
+    """
+    Resolve a 'drs://<host>/<object_id>' URI to an access URL with the
+    GA4GH DRS API and open it.
+    """
+    _, _, location = url.partition('://')
+    host, _, object_id = location.partition('/')
+    res = get_session('https://' + host).get(
+        'https://{}/ga4gh/drs/v1/objects/{}'.format(host, object_id)
+    )
+    res.raise_for_status()
+    for access_method in res.json().get('access_methods', []):
+        access_url = access_method.get('access_url', {}).get('url')
+        if access_url:
+            return open_reader(access_url, byte_range)
+    raise ValueError("No access URL found for '{}'".format(url))
+
+
+# readers for each URL scheme; use `register_file_reader` to add more
+file_readers = {
+    'file': _read_local,
+    'http': _read_http,
+    'https': _read_http,
+    'gs': _read_fsspec,
+    's3': _read_fsspec,
+    'drs': _read_drs
+}
+
+
+def register_file_reader(scheme, reader):
+    """
+    Register a reader for a URL scheme.
+
+    Args:
+        scheme (str): URL scheme (e.g., 'ftp')
+        reader (function): function that takes a URL and an optional
+            (start, end) byte range, and returns a binary file object
+    """
+    file_readers[scheme] = reader
+
+
+def open_reader(path, byte_range=None):
+    """
+    Open a local file or URL for binary reads, using the reader
+    registered for its scheme.
+
+    Args:
+        path (str): local filepath or URL
+        byte_range (tuple): optional (start, end) bytes to read (end is
+            inclusive, or None to read to the end of the file)
+
+    Returns:
+        binary file object
+    """
+    scheme, sep, location = path.partition('://')
+    if not sep:
+        return _read_local(path, byte_range)
+    if scheme == 'file':
+        return _read_local(location, byte_range)
+    try:
+        reader = file_readers[scheme]
+    except KeyError:
+        raise ValueError("Unsupported URL scheme: '{}'".format(scheme))
+    return reader(path, byte_range)
+
 
 @contextmanager
-def open_file(path, mode):
+def open_file(path, mode, byte_range=None):
     if mode.startswith('w'):
         if path.startswith('http'):
             raise ValueError
         else:
             f = open(path, mode)
     else:
-        if not re.search('://', path):
-            path = 'file://' + path
-        f = urlopen(path)
+        f = open_reader(path, byte_range)
     yield f
     f.close()
 
 
+def _reader_length(f):
+    """
+    Return the number of bytes left to read from a file object returned
+    by a reader, from its 'Content-Length' header (for HTTP responses)
+    or by seeking to its end, or None if the length isn't known.
+    """
+    headers = getattr(f, 'headers', None)
+    if headers is not None and headers.get('Content-Length') is not None:
+        return int(headers['Content-Length'])
+    try:
+        if f.seekable():
+            start = f.tell()
+            end = f.seek(0, io.SEEK_END)
+            f.seek(start)
+            return end - start
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+class LazyFile(object):
+    """
+    Read-only binary file object for a local path or URL that is only
+    opened when first read, so that many files can be listed as request
+    parts and streamed one at a time. Remote files without a known
+    length are spooled to a temporary file as they are read.
+
+    Args:
+        path (str): local filepath or URL
+        chunk_size (int): size of chunks when iterating over the file
+    """
+    spool_size = 8 * 1024 * 1024
+
+    def __init__(self, path, chunk_size=64 * 1024):
+        if path.startswith('file://'):
+            path = path[7:]
+        self.path = path
+        self.name = os.path.basename(path)
+        self.chunk_size = chunk_size
+        self._f = None
+        self._len = None
+        self._pos = 0
+
+    def _open(self):
+        if self._f is not None:
+            return self._f
+        self._pos = 0
+        if not re.search('://', self.path):
+            self._f = open(self.path, 'rb')
+            self._len = os.fstat(self._f.fileno()).st_size
+            return self._f
+        res = open_reader(self.path)
+        length = _reader_length(res)
+        if length is not None:
+            self._f = res
+            self._len = length
+        else:
+            self._f = tempfile.SpooledTemporaryFile(self.spool_size)
+            for chunk in iter(lambda: res.read(self.chunk_size), b''):
+                self._f.write(chunk)
+            res.close()
+            self._len = self._f.tell()
+            self._f.seek(0)
+        return self._f
+
+    def read(self, size=-1):
+        data = self._open().read(None if size is None or size < 0
+                                  else size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if self._f is None and (offset, whence) == (0, 0):
+            self._pos = 0
+            return self._pos
+        f = self._open()
+        if f.seekable():
+            self._pos = f.seek(offset, whence)
+        elif (offset, whence) == (0, 0):
+            # remote streams are rewound by opening them again
+            self.close()
+            self._open()
+        else:
+            raise io.UnsupportedOperation('seek')
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        if self._len is None and not re.search('://', self.path):
+            # local sizes don't need an open file descriptor
+            self._len = os.stat(self.path).st_size
+        if self._len is None:
+            self._open()
+        return self._len
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MultipartStream(object):
+    """
+    Streamed 'multipart/form-data' request body. File parts are read in
+    chunks as the body is sent, so request size doesn't depend on file
+    sizes; the total length is computed up front, so the body is sent
+    with a 'Content-Length' header rather than chunked.
+
+    :class:`LazyFile` parts are opened only while they are sent and
+    closed once read to the end (or by :meth:`close`), so the number
+    of attachments isn't limited by open file descriptors. Other file
+    objects are left open for the caller to close.
+
+    Args:
+        fields (:obj:`list` of :obj:`tuple`): (name, value) parts, where
+            value is a string, or a (filename, file object or bytes[,
+            content type]) tuple for file parts
+        chunk_size (int): size of chunks read from file parts
+    """
+    def __init__(self, fields, chunk_size=64 * 1024):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self._segments = []
+        for name, value in fields:
+            if isinstance(value, tuple):
+                filename, f = value[:2]
+                content_type = value[2] if len(value) > 2 \
+                    else 'application/octet-stream'
+                if isinstance(f, (bytes, str)):
+                    f = io.BytesIO(f.encode() if isinstance(f, str) else f)
+                self._add(name, f, filename, content_type)
+            else:
+                if not isinstance(value, bytes):
+                    value = str(value).encode('utf-8')
+                self._add(name, value)
+        self._segments.append(
+            '--{}--\r\n'.format(self.boundary).encode('utf-8')
+        )
+        self._len = sum(len(segment) if isinstance(segment, bytes)
+                        else _file_length(segment)
+                        for segment in self._segments)
+        self._index = 0
+        self._offset = 0
+
+    def _add(self, name, value, filename=None, content_type=None):
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(
+            self.boundary, _quote_header(name)
+        )
+        if filename is not None:
+            header += '; filename="{}"\r\nContent-Type: {}'.format(
+                _quote_header(filename), content_type
+            )
+        self._segments.extend([(header + '\r\n\r\n').encode('utf-8'),
+                               value, b'\r\n'])
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self._len
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.chunk_size), b''))
+        while self._index < len(self._segments):
+            segment = self._segments[self._index]
+            if isinstance(segment, bytes):
+                data = segment[self._offset:self._offset + size]
+                self._offset += len(data)
+            else:
+                data = segment.read(size)
+            if data:
+                return data
+            if isinstance(segment, LazyFile):
+                segment.close()
+            self._index += 1
+            self._offset = 0
+        return b''
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+    def close(self):
+        """
+        Close any :class:`LazyFile` parts that are still open.
+        """
+        for segment in self._segments:
+            if isinstance(segment, LazyFile):
+                segment.close()
+
+
+def _quote_header(value):
+    return str(value).replace('"', '%22').replace('\r', '%0D') \
+        .replace('\n', '%0A')
+
+
+def _file_length(f):
+    """
+    Return the number of bytes left to read from a file object.
+    """
+    if hasattr(f, '__len__'):
+        return len(f) - (f.tell() if hasattr(f, 'tell') else 0)
+    length = _reader_length(f)
+    if length is None:
+        raise ValueError("Unable to determine the length of '{}'"
+                         .format(getattr(f, 'name', f)))
+    return length
+
+
+class AccessTokenProvider(object):
+    """
+    Cache an access token printed by a credential helper command (e.g.,
+    `gcloud config config-helper`), shared across threads.
+
+    The command runs only when no valid token is cached; after that,
+    the token is refreshed in the background shortly before it expires,
+    so callers don't wait on the command. Background refreshes stop
+    once the token hasn't been used since the last refresh, so idle
+    processes don't keep running the command; the next :meth:`get`
+    then refreshes it on demand. The token is valid until the
+    expiry reported by the command, if `parse` returns one, or else for
+    `lifetime` seconds; helpers may hand out a cached token that is
+    close to expiry, so the default lifetime is short. Call
+    :meth:`invalidate` when a request is rejected with the token, and
+    :meth:`close` to cancel the pending background refresh.
+
+    Args:
+        command (:obj:`list` of :obj:`str`): command that prints a new
+            access token
+        lifetime (float): seconds for which a new token is assumed to
+            be valid, if the command doesn't report its expiry
+        refresh_margin (float): seconds before expiry at which to fetch
+            a replacement token in the background
+        parse (function): function that takes the command output and
+            returns the token and its expiry (a UTC :class:`datetime`,
+            or None)
+        force_command (:obj:`list` of :obj:`str`): command that prints
+            a newly issued token, used after :meth:`invalidate`
+        min_refresh_interval (float): minimum seconds between forced
+            refreshes, so a burst of rejected requests only forces one
+    """
+    def __init__(self, command, lifetime=180, refresh_margin=60,
+                 parse=None, force_command=None, min_refresh_interval=10):
+        self.command = command
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.parse = parse
+        self.force_command = force_command
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+        self._forced_at = None
+        self._force = False
+        self._timer = None
+        self._used = False
+        self._idle = False
+
+    def get(self):
+        """
+        Return a valid access token, running the command if needed.
+
+        Returns:
+            str: string with the access token
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._token is None or now >= self._expires_at:
+                self._refresh()
+            elif self._idle:
+                # background refreshes stopped while the token was idle
+                self._idle = False
+                self._schedule_refresh(
+                    max(self._expires_at - self.refresh_margin - now, 0.01)
+                )
+            self._used = True
+            return self._token
+
+    def close(self):
+        """
+        Cancel the pending background refresh; refreshes resume if the
+        token is used again.
+        """
+        with self._lock:
+            self._schedule_refresh(None)
+            self._idle = True
+
+    def invalidate(self):
+        """
+        Drop the cached token (e.g., after a 401 response), so that the
+        next call fetches a new one.
+        """
+        with self._lock:
+            if self._forced_at is not None and (
+                    time.monotonic() - self._forced_at
+                    < self.min_refresh_interval):
+                return
+            self._expires_at = 0
+            self._force = self.force_command is not None
+
+    def _refresh(self):
+        command = self.force_command if self._force else self.command
+        try:
+            output = subprocess32.check_output(command).decode()
+        except OSError:
+            self._token = '!! {} not installed !!'.format(command[0])
+            expiry = None
+        else:
+            if self.parse is not None:
+                self._token, expiry = self.parse(output)
+            else:
+                self._token, expiry = output.rstrip(), None
+        now = time.monotonic()
+        if self._force:
+            self._forced_at = now
+        self._force = False
+        self._used = False
+        self._idle = False
+        if expiry is not None:
+            lifetime = (expiry - dt.datetime.utcnow()).total_seconds()
+        else:
+            lifetime = self.lifetime
+        self._expires_at = now + lifetime
+        self._schedule_refresh(lifetime - self.refresh_margin)
+
+    def _schedule_refresh(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        if delay is not None and delay > 0:
+            self._timer = threading.Timer(delay, self._background_refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            if threading.current_thread() is not self._timer:
+                # cancelled after it fired
+                return
+            self._timer = None
+            if not self._used:
+                self._idle = True
+                return
+            try:
+                self._refresh()
+            except Exception:
+                logger.warning("Failed to refresh access token with '{}'; "
+                               "retrying in {}s"
+                               .format(' '.join(self.command),
+                                       self.refresh_margin / 2),
+                               exc_info=True)
+                self._schedule_refresh(self.refresh_margin / 2)
+
+
+def _parse_gcloud_credential(output):
+    """
+    Return the access token and its expiry from the JSON output of
+    `gcloud config config-helper`.
+    """
+    credential = json.loads(output)['credential']
+    expiry = credential.get('token_expiry')
+    if expiry is not None:
+        expiry = dt.datetime.strptime(expiry, '%Y-%m-%dT%H:%M:%SZ')
+    return credential['access_token'], expiry
+
+
+gcloud_token = AccessTokenProvider(
+    ['gcloud', 'config', 'config-helper', '--format=json'],
+    parse=_parse_gcloud_credential,
+    force_command=['gcloud', 'config', 'config-helper', '--format=json',
+                   '--force-auth-refresh']
+)
+
+
+def _invalidate_tokens(response):
+    gcloud_token.invalidate()
+
+
+on_auth_failure(_invalidate_tokens)
+
+
+def _env_var_value(env_var, default=None):
+    """
+    Return the current value for an environment variable placeholder.
+    """
+    if env_var == 'GCLOUD_TOKEN':
+        return gcloud_token.get()
+    else:
+        return os.environ.get(env_var, default)
+
+
 def _replace_env_var(match):
     """
     For a matched environment variable, return the appropriate value
@@ -49,15 +584,7 @@ def _replace_env_var(match):
         str: string with the value of the matched environment variable
     """
     env_var, default = match.groups()
-    if env_var == 'GCLOUD_TOKEN':
-        try:
-            return subprocess32.check_output(
-                ['gcloud', 'auth', 'print-access-token']
-            ).rstrip()
-        except OSError:
-            return '!! gcloud not installed !!'
-    else:
-        return os.environ.get(env_var, default)
+    return _env_var_value(env_var, default)
 
 
 def _env_var_constructor(loader, node):
@@ -74,21 +601,188 @@ def _env_var_constructor(loader, node):
         str: string with matched environment variable replaced with
             the corresponding value of the environment variable.
     """
-    var = re.compile(r"\$\{([^}:\s]+):?([^}]+)?\}", re.VERBOSE)
     value = loader.construct_scalar(node)
-    return var.sub(_replace_env_var, value)
+    return _env_var_pattern.sub(_replace_env_var, value)
+
+
+class EnvTemplate(str):
+    """
+    Config string with unresolved environment variables (e.g.,
+    '${ENV_VAR}'), as parsed by :class:`RawConfigLoader`. Use
+    :func:`resolve_env_vars` to replace them with their current values.
+    """
+
+
+def _env_template_constructor(loader, node):
+    return EnvTemplate(loader.construct_scalar(node))
+
+
+def env_var_names(data):
+    """
+    Return the environment variables referenced in parsed config data.
+
+    Args:
+        data: data parsed with :class:`RawConfigLoader`
+
+    Returns:
+        :obj:`list` of :obj:`str`: sorted list of variable names
+    """
+    names = set()
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, EnvTemplate):
+            names.update(match.group(1)
+                         for match in _env_var_pattern.finditer(item))
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return sorted(names)
+
+
+def env_var_values(names):
+    """
+    Return the current values of environment variables, e.g., to check
+    whether config data resolved earlier is still current.
+
+    Args:
+        names (:obj:`list` of :obj:`str`): variable names
+
+    Returns:
+        tuple: values of the variables (None for unset variables)
+    """
+    return tuple(_env_var_value(name) for name in names)
+
+
+def resolve_env_vars(data):
+    """
+    Return a copy of parsed config data with environment variables
+    replaced by their current values.
+
+    Args:
+        data: data parsed with :class:`RawConfigLoader`
+
+    Returns:
+        copy of the data with plain dicts, lists and strings
+    """
+    if isinstance(data, EnvTemplate):
+        return _env_var_pattern.sub(_replace_env_var, data)
+    elif isinstance(data, dict):
+        return {k: resolve_env_vars(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [resolve_env_vars(v) for v in data]
+    return data
+
+
+class FrozenDict(dict):
+    """
+    Read-only :class:`dict`, used for shared config snapshots. Use
+    :func:`thaw` to get a mutable copy.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("'{}' object is read-only"
+                        .format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """
+    Read-only :class:`list`, used for shared config snapshots. Use
+    :func:`thaw` to get a mutable copy.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("'{}' object is read-only"
+                        .format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = remove = pop = clear = _readonly
+    sort = reverse = _readonly
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def freeze(data):
+    """
+    Return a read-only copy of nested dicts and lists.
+
+    Args:
+        data: parsed data (e.g., from a YAML or JSON file)
+
+    Returns:
+        copy of the data with dicts and lists replaced by
+            :class:`FrozenDict` and :class:`FrozenList`
+    """
+    if isinstance(data, dict):
+        return FrozenDict((k, freeze(v)) for k, v in data.items())
+    elif isinstance(data, list):
+        return FrozenList(freeze(v) for v in data)
+    return data
+
+
+def thaw(data):
+    """
+    Return a mutable copy of nested dicts and lists (e.g., of a
+    snapshot returned by :func:`freeze`).
+
+    Args:
+        data: parsed data, possibly read-only
+
+    Returns:
+        copy of the data with plain dicts and lists
+    """
+    if isinstance(data, dict):
+        return {k: thaw(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [thaw(v) for v in data]
+    return data
+
+
+class ConfigLoader(_SafeLoader):
+    """
+    Safe YAML loader for config files, which replaces environment
+    variables (e.g., '${ENV_VAR}') with their values during parsing.
+    """
+
+
+class RawConfigLoader(_SafeLoader):
+    """
+    Safe YAML loader for config files, which keeps environment
+    variables (e.g., '${ENV_VAR}') unresolved as :class:`EnvTemplate`
+    strings.
+    """
+
+
+class ConfigDumper(_SafeDumper):
+    """
+    Safe YAML dumper for config files, which also writes read-only
+    config snapshots as plain mappings and sequences.
+    """
 
 
 def setup_yaml_parser():
     """
-    Add environment variable parsing logic to YAML module config.
+    Add environment variable parsing logic to the config YAML loader,
+    and snapshot types to the config YAML dumper.
 
     This and dependent functions were adopted from
     https://github.com/zhouxiaoxiang/oriole/blob/master/oriole/yml.py
     """
     var = re.compile(r".*\$\{.*\}.*", re.VERBOSE)
-    yaml.add_constructor('!env_var', _env_var_constructor)
-    yaml.add_implicit_resolver('!env_var', var)
+    ConfigLoader.add_constructor('!env_var', _env_var_constructor)
+    ConfigLoader.add_implicit_resolver('!env_var', var, None)
+    RawConfigLoader.add_constructor('!env_var', _env_template_constructor)
+    RawConfigLoader.add_implicit_resolver('!env_var', var, None)
+    ConfigDumper.add_representer(
+        FrozenDict, yaml.representer.SafeRepresenter.represent_dict)
+    ConfigDumper.add_representer(
+        FrozenList, yaml.representer.SafeRepresenter.represent_list)
 
 
 setup_yaml_parser()
@@ -112,33 +806,213 @@ def heredoc(s, inputs_dict):
     return s[1:] if s.startswith('\n') else s
 
 
-def get_yaml(filepath):
+_locks = threading.local()
+_batches = threading.local()
+
+
+@contextmanager
+def lock_file(filepath):
+    """
+    Hold an exclusive advisory lock for a file, across threads and
+    processes, e.g., around a read-modify-write of the file.
+
+    The lock is taken on a '.lock' file next to the target, since the
+    target itself is replaced (not rewritten) on each save. Locks are
+    reentrant within a thread; on platforms without `fcntl`, only
+    threads of the current process are excluded. Remote paths (URLs)
+    are not locked.
+
+    Args:
+        filepath (str): local filepath of the file to lock
+    """
+    if filepath.startswith('file://'):
+        filepath = filepath[7:]
+    if re.search('://', filepath):
+        yield
+        return
+    held = getattr(_locks, 'held', None)
+    if held is None:
+        held = _locks.held = {}
+    lock_path = os.path.abspath(filepath) + '.lock'
+    if lock_path in held:
+        held[lock_path][1] += 1
+        try:
+            yield
+        finally:
+            held[lock_path][1] -= 1
+        return
+
+    f = open(lock_path, 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            _thread_lock(lock_path).acquire()
+        held[lock_path] = [f, 1]
+        try:
+            yield
+        finally:
+            del held[lock_path]
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                _thread_lock(lock_path).release()
+    finally:
+        f.close()
+
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+def _thread_lock(lock_path):
+    with _thread_locks_lock:
+        return _thread_locks.setdefault(lock_path, threading.Lock())
+
+
+def _fsync_path(path):
+    """
+    Flush a file or directory to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        # some platforms and filesystems can't sync directories
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def fsync_batch(*filepaths):
+    """
+    Defer the fsync for files saved with :func:`save_json` or
+    :func:`save_yaml` in the current thread until the end of the
+    block, so that a file saved several times is flushed to disk once.
+
+    Files are still replaced atomically inside the block; only their
+    durability against a system crash is postponed. Nested blocks are
+    merged into the outermost one.
+
+    Args:
+        *filepaths (str): local filepaths of the files to batch; other
+            files saved in the block are synced as usual (by default,
+            all files are batched)
+    """
+    outer = getattr(_batches, 'paths', None)
+    if outer is not None:
+        yield
+        return
+    _batches.paths = paths = set()
+    _batches.only = (set(_abspath(filepath) for filepath in filepaths)
+                     if filepaths else None)
+    try:
+        yield
+    finally:
+        _batches.paths = _batches.only = None
+        for path in sorted(paths):
+            try:
+                _fsync_path(path)
+                _fsync_path(os.path.dirname(path))
+            except OSError as e:
+                logger.warning("Unable to sync '{}': {}".format(path, e))
+
+
+def _abspath(filepath):
+    if filepath.startswith('file://'):
+        filepath = filepath[7:]
+    return os.path.abspath(filepath)
+
+
+def _write_atomic(filepath, write, mode='w'):
+    """
+    Write a file by writing a temporary file in the same directory and
+    renaming it over the target, so that readers never see a partially
+    written file.
+
+    Args:
+        filepath (str): local filepath of the file
+        write (function): function that writes the content to an open
+            file object
+        mode (str): mode for opening the temporary file
+    """
+    if filepath.startswith('http'):
+        raise ValueError
+    if filepath.startswith('file://'):
+        filepath = filepath[7:]
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    try:
+        file_mode = os.stat(filepath).st_mode & 0o777
+    except OSError:
+        file_mode = None
+    batch = getattr(_batches, 'paths', None)
+    only = getattr(_batches, 'only', None)
+    if only is not None and _abspath(filepath) not in only:
+        batch = None
+    # create the temporary file with the default mode for new files, so
+    # the process umask applies without changing it for other threads
+    while True:
+        tmp_path = os.path.join(dirname, '.{}.{}'.format(
+            os.path.basename(filepath), uuid.uuid4().hex[:8]
+        ))
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        with os.fdopen(fd, mode) as f:
+            if file_mode is not None:
+                os.chmod(tmp_path, file_mode)
+            write(f)
+            f.flush()
+            if batch is None:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if batch is None:
+        _fsync_path(dirname)
+    else:
+        batch.add(_abspath(filepath))
+
+
+def get_yaml(filepath, resolve_env=True):
     """
     Read YAML data from a file into a dict.
 
     Args:
         filepath (str): local filepath of the YAML file
+        resolve_env (bool): set to False to keep environment variables
+            unresolved (see :class:`RawConfigLoader`)
 
     Returns:
         dict: dict with loaded/parsed data from the YAML file
     """
+    loader = ConfigLoader if resolve_env else RawConfigLoader
     try:
         with open_file(filepath, 'r') as f:
-            return yaml.load(f)
+            return yaml.load(f, Loader=loader)
     except IOError:
         logger.exception("No file found.  Please create: %s." % filepath)
 
 
 def save_yaml(filepath, app_config):
     """
-    Write YAML data from a dict to a file.
+    Write YAML data from a dict to a file, replacing the file
+    atomically.
 
     Args:
         filepath (str): local filepath of the YAML file
         app_config (dict): dict containing the data to write
     """
-    with open_file(filepath, 'w') as f:
-        yaml.dump(app_config, f, default_flow_style=False)
+    with lock_file(filepath):
+        _write_atomic(filepath, lambda f: yaml.dump(
+            app_config, f, Dumper=ConfigDumper, default_flow_style=False
+        ))
 
 
 def get_json(filepath):
@@ -160,14 +1034,17 @@ def get_json(filepath):
 
 def save_json(filepath, app_config):
     """
-    Write JSON data from a dict to a file.
+    Write JSON data from a dict to a file, replacing the file
+    atomically.
 
     Args:
         filepath (str): local filepath of the JSON file
         app_config (dict): dict containing the data to write
     """
-    with open_file(filepath, 'w') as f:
-        json.dump(app_config, f, indent=4, default=str)
+    with lock_file(filepath):
+        _write_atomic(filepath, lambda f: json.dump(
+            app_config, f, indent=4, default=str
+        ))
 
 
 def response_handler(response):
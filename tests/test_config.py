@@ -53,6 +53,47 @@ def test_queue_config(mock_orchestratorqueues, mock_queue_config, monkeypatch):
     assert(test_config == mock_queue_config)
 
 
+def test_queue_config_cached(mock_orchestratorqueues, monkeypatch):
+    # GIVEN an orchestrator config file exists and has been loaded
+    monkeypatch.setattr('ga4ghtest.core.config.queues_path',
+                        str(mock_orchestratorqueues))
+    test_config = queue_config()
+
+    # WHEN the configuration data is loaded again, without changes
+    # THEN the same read-only snapshot is returned
+    assert queue_config() is test_config
+    with pytest.raises(TypeError):
+        test_config['mock_queue_1']['wes_opts'].append('mock_wes')
+
+    # WHEN the file changes
+    mock_orchestratorqueues.write(yaml.dump({'mock_queue': {}}))
+
+    # THEN the new contents are loaded
+    assert queue_config() == {'mock_queue': {}}
+
+
+def test_wes_config_env_var_refresh(mock_orchestratorconfig, monkeypatch):
+    # GIVEN a config entry with an access token from a credential helper
+    monkeypatch.setattr('ga4ghtest.core.config.config_path',
+                        str(mock_orchestratorconfig))
+    mock_config = {'workflowservices': {'mock_wes': {
+        'auth': {'Authorization': 'Bearer ${GCLOUD_TOKEN}'}
+    }}}
+    mock_orchestratorconfig.write(yaml.dump(mock_config))
+    mock_tokens = ['tok1']
+    mock_provider = mock.Mock(get=lambda: mock_tokens[-1])
+    monkeypatch.setattr('ga4ghtest.util.gcloud_token', mock_provider)
+    test_config = wes_config()
+    assert wes_config() is test_config
+
+    # WHEN the token is refreshed, without changes to the file
+    mock_tokens.append('tok2')
+
+    # THEN the new token is returned
+    assert wes_config()['mock_wes']['auth'] == \
+        {'Authorization': 'Bearer tok2'}
+
+
 def test_trs_config(mock_orchestratorconfig, mock_trs_config, monkeypatch):
     # GIVEN an orchestrator config file exists
     monkeypatch.setattr('ga4ghtest.core.config.config_path',
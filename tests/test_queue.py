@@ -1,13 +1,26 @@
 import logging
 import mock
+import multiprocessing
 import pytest
 import json
+import threading
 import datetime as dt
 
 from ga4ghtest.core.queue import create_submission
 from ga4ghtest.core.queue import get_submissions
 from ga4ghtest.core.queue import get_submission_bundle
 from ga4ghtest.core.queue import update_submission
+from ga4ghtest.core.queue import update_submissions
+from ga4ghtest.core.queue import submission_batch
+from ga4ghtest.core.queue import compact_queue
+from ga4ghtest.core.queue import load_queue_store
+from ga4ghtest.core.queue import new_submission_id
+from ga4ghtest.core.queue import submission_time
+from ga4ghtest.core.queue import JSONQueueStore
+from ga4ghtest.core.queue import SQLiteQueueStore
+from ga4ghtest.core.queue import load_snapshot
+from ga4ghtest.core.queue import get_status_index
+from ga4ghtest.core.queue import StatusIndex
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -30,6 +43,42 @@ def test_create_submission(mock_submissionqueue, monkeypatch):
     assert test_queue['mock_queue_1'][test_sub_id] == mock_submission
 
 
+def test_new_submission_id():
+    test_ids = [new_submission_id() for _ in range(1000)]
+
+    assert len(set(test_ids)) == len(test_ids)
+    assert test_ids == sorted(test_ids)
+    assert all(len(test_id) == 26 for test_id in test_ids)
+
+
+def test_submission_time():
+    start_time = dt.datetime.now() - dt.timedelta(seconds=1)
+
+    test_time = submission_time(new_submission_id())
+
+    assert start_time <= test_time <= dt.datetime.now()
+
+
+def test_get_submissions_created_after(mock_submissionqueue, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        str(mock_submissionqueue))
+    old_sub_id = create_submission(queue_id='mock_queue_1',
+                                   submission_data={})
+    new_sub_time = submission_time(old_sub_id) + dt.timedelta(seconds=1)
+    monkeypatch.setattr('time.time',
+                        lambda: new_sub_time.timestamp() + 0.0005)
+    new_sub_id = create_submission(queue_id='mock_queue_1',
+                                   submission_data={})
+
+    test_submissions = get_submissions('mock_queue_1',
+                                       created_after=new_sub_time)
+    assert test_submissions == [new_sub_id]
+
+    test_submissions = get_submissions('mock_queue_1',
+                                       created_before=new_sub_time)
+    assert test_submissions == [old_sub_id]
+
+
 def test_get_submissions(mock_submissionqueue, mock_submission, monkeypatch):
     monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
                         str(mock_submissionqueue))
@@ -83,4 +132,314 @@ def test_update_submission(mock_submissionqueue,
     mock_submission['mock_sub']['status'] = 'COMPLETE'
     mock_bundle = json.loads(json.dumps(mock_submission['mock_sub'],
                                         default=str))
-    assert test_queue['mock_queue_1']['mock_sub'] == mock_bundle
\ No newline at end of file
+    assert test_queue['mock_queue_1']['mock_sub'] == mock_bundle
+
+
+def test_update_submissions(mock_submissionqueue,
+                            mock_submission,
+                            monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        str(mock_submissionqueue))
+
+    mock_queue = {'mock_queue_1': mock_submission}
+    mock_submissionqueue.write(json.dumps(mock_queue, indent=4,
+                               default=str))
+
+    update_submissions([('mock_queue_1', 'mock_sub',
+                         {'status': 'COMPLETE', 'wes_id': 'mock_wes_2'})])
+
+    # updates are journaled and visible before the queue is compacted
+    test_bundle = get_submission_bundle('mock_queue_1', 'mock_sub')
+    assert test_bundle['status'] == 'COMPLETE'
+    assert test_bundle['wes_id'] == 'mock_wes_2'
+    assert get_submissions('mock_queue_1', status=['COMPLETE']) == ['mock_sub']
+
+    compact_queue()
+
+    with open(str(mock_submissionqueue), 'r') as f:
+        test_queue = json.load(f)
+
+    assert test_queue['mock_queue_1']['mock_sub']['status'] == 'COMPLETE'
+    assert not mock_submissionqueue.new(basename='submission_queue.json.journal').exists()
+
+
+def test_json_queue_store_partial_journal(mock_submissionqueue):
+    test_store = JSONQueueStore(str(mock_submissionqueue))
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+    test_store.update_many([('mock_queue_1', 'mock_sub_1',
+                             {'status': 'SUBMITTED'})])
+    with open(test_store.journal_path, 'a') as f:
+        f.write('[["mock_queue_1", "mock_sub_1", {"status": "COMP')
+
+    assert test_store.get('mock_queue_1', 'mock_sub_1') == \
+        {'status': 'SUBMITTED'}
+
+    test_store.update_many([('mock_queue_1', 'mock_sub_1',
+                             {'status': 'COMPLETE'})])
+    assert test_store.list_ids('mock_queue_1', ['COMPLETE']) == \
+        ['mock_sub_1']
+    with open(test_store.journal_path, 'r') as f:
+        assert [json.loads(line) for line in f] == [
+            [['mock_queue_1', 'mock_sub_1', {'status': 'SUBMITTED'}]],
+            [['mock_queue_1', 'mock_sub_1', {'status': 'COMPLETE'}]]
+        ]
+
+
+@pytest.mark.parametrize('queue_file', ['submission_queue.json',
+                                        'submission_queue.db'])
+def test_queue_store_update_many_unknown(tmpdir, queue_file):
+    queue_path = str(tmpdir.join(queue_file))
+    if queue_file.endswith('.json'):
+        tmpdir.join(queue_file).write('{}')
+    test_store = load_queue_store(queue_path)
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+
+    test_store.update_many([
+        ('mock_queue_1', 'mock_sub_2', {'status': 'COMPLETE'}),
+        ('mock_queue_1', 'mock_sub_1', {'status': 'COMPLETE'})
+    ])
+
+    assert test_store.get('mock_queue_1', 'mock_sub_1') == \
+        {'status': 'COMPLETE'}
+    with pytest.raises(KeyError):
+        test_store.update('mock_queue_1', 'mock_sub_2', 'status', 'COMPLETE')
+
+
+@pytest.mark.parametrize('queue_file', ['submission_queue.json',
+                                        'submission_queue.db'])
+def test_queue_store_modify(tmpdir, queue_file):
+    queue_path = str(tmpdir.join(queue_file))
+    if queue_file.endswith('.json'):
+        tmpdir.join(queue_file).write('{}')
+    test_store = load_queue_store(queue_path)
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+
+    def complete(bundle):
+        if bundle['status'] != 'RECEIVED':
+            return None
+        return {'status': 'COMPLETE'}
+
+    assert test_store.modify('mock_queue_1', 'mock_sub_1', complete) == \
+        {'status': 'COMPLETE'}
+    assert test_store.modify('mock_queue_1', 'mock_sub_1', complete) is None
+    assert test_store.get('mock_queue_1', 'mock_sub_1') == \
+        {'status': 'COMPLETE'}
+    with pytest.raises(KeyError):
+        test_store.modify('mock_queue_1', 'mock_sub_2', complete)
+
+
+def test_submission_batch(mock_submissionqueue,
+                          mock_submission,
+                          monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        str(mock_submissionqueue))
+
+    mock_updates = []
+    monkeypatch.setattr('ga4ghtest.core.queue.update_submissions',
+                        lambda updates: mock_updates.extend(updates))
+
+    with submission_batch() as batch:
+        batch.update('mock_queue_1', 'mock_sub', 'run_log', {})
+        batch.update('mock_queue_1', 'mock_sub', 'status', 'SUBMITTED')
+        assert mock_updates == []
+
+    assert mock_updates == [('mock_queue_1', 'mock_sub',
+                             {'run_log': {}, 'status': 'SUBMITTED'})]
+
+
+def test_load_queue_store_json(mock_submissionqueue, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        str(mock_submissionqueue))
+
+    test_store = load_queue_store()
+
+    assert isinstance(test_store, JSONQueueStore)
+    assert test_store.path == str(mock_submissionqueue)
+
+
+def test_json_queue_store_snapshot(mock_submissionqueue):
+    test_store = JSONQueueStore(str(mock_submissionqueue))
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+    test_store.create('mock_queue_1', 'mock_sub_2', {'status': 'COMPLETE'})
+
+    test_snapshot = load_snapshot(test_store.snapshot_path)
+    assert test_snapshot.signature == test_store._signature()
+    assert test_store.list_ids('mock_queue_1', ['RECEIVED']) == ['mock_sub_1']
+    assert test_store.get('mock_queue_1', 'mock_sub_2') == \
+        {'status': 'COMPLETE'}
+
+    test_store.update_many([('mock_queue_1', 'mock_sub_1',
+                             {'status': 'COMPLETE'})])
+    assert test_store.list_ids('mock_queue_1', ['COMPLETE']) == \
+        ['mock_sub_1', 'mock_sub_2']
+
+    mock_submissionqueue.write(json.dumps(
+        {'mock_queue_2': {'mock_sub_3': {'status': 'RECEIVED'}}}
+    ))
+    assert test_store.list_ids('mock_queue_1', ['COMPLETE']) == []
+    assert test_store.get('mock_queue_2', 'mock_sub_3') == \
+        {'status': 'RECEIVED'}
+    with pytest.raises(KeyError):
+        test_store.get('mock_queue_2', 'mock_sub_1')
+
+
+def test_status_index():
+    test_index = StatusIndex()
+    test_index.rebuild([('mock_queue_1', 'mock_sub_1', 'RECEIVED'),
+                        ('mock_queue_1', 'mock_sub_2', 'RECEIVED'),
+                        ('mock_queue_1', 'mock_sub_3', 'COMPLETE')],
+                       signature=[])
+
+    test_index.set_status('mock_queue_1', 'mock_sub_1', 'COMPLETE')
+    test_index.add('mock_queue_1', 'mock_sub_4', 'RECEIVED')
+    test_index.set_status('mock_queue_1', 'mock_sub_5', 'COMPLETE')
+
+    assert test_index.list_ids('mock_queue_1', ['COMPLETE']) == \
+        ['mock_sub_1', 'mock_sub_3']
+    assert test_index.list_ids('mock_queue_1', ['RECEIVED', 'COMPLETE']) == \
+        ['mock_sub_1', 'mock_sub_2', 'mock_sub_3', 'mock_sub_4']
+    assert test_index.list_ids('mock_queue_1', ['RECEIVED'],
+                               id_range=('mock_sub_3', None)) == \
+        ['mock_sub_4']
+    assert test_index.list_ids('mock_queue_2', ['RECEIVED']) == []
+
+
+def test_json_queue_store_status_index(mock_submissionqueue):
+    test_store = JSONQueueStore(str(mock_submissionqueue))
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+    assert test_store.list_ids('mock_queue_1', ['RECEIVED']) == ['mock_sub_1']
+
+    test_index = get_status_index(str(mock_submissionqueue))
+    with mock.patch.object(test_index, 'rebuild') as mock_rebuild:
+        test_store.create('mock_queue_1', 'mock_sub_2',
+                          {'status': 'RECEIVED'})
+        test_store.update('mock_queue_1', 'mock_sub_1', 'status', 'COMPLETE')
+        test_store.update_many([('mock_queue_1', 'mock_sub_2',
+                                 {'status': 'COMPLETE'})])
+        test_ids = test_store.list_ids('mock_queue_1', ['COMPLETE'])
+    assert not mock_rebuild.called
+    assert test_ids == ['mock_sub_1', 'mock_sub_2']
+
+    mock_submissionqueue.write(json.dumps(
+        {'mock_queue_1': {'mock_sub_3': {'status': 'RECEIVED'}}}
+    ))
+    assert test_store.list_ids('mock_queue_1', ['RECEIVED']) == ['mock_sub_3']
+
+
+def test_json_queue_store_status_index_concurrent_rebuild(
+        mock_submissionqueue):
+    test_store = JSONQueueStore(str(mock_submissionqueue))
+    test_store.create('mock_queue_1', 'mock_sub_1', {'status': 'RECEIVED'})
+    assert test_store.list_ids('mock_queue_1', ['RECEIVED']) == ['mock_sub_1']
+    test_index = get_status_index(str(mock_submissionqueue))
+    snapshot_read = threading.Event()
+    status_set = threading.Event()
+    rebuilt = threading.Event()
+
+    def read_status():
+        # a reader rebuilding the index from the queue as it was before
+        # the write, after the writer updated the index in place
+        JSONQueueStore(str(mock_submissionqueue)).list_ids('mock_queue_1',
+                                                           ['RECEIVED'])
+    reader = threading.Thread(target=read_status)
+    load = test_store._load
+    set_status = test_index.set_status
+    rebuild = test_index.rebuild
+
+    def mock_load_snapshot(path):
+        snapshot = load_snapshot(path)
+        if threading.current_thread() is reader:
+            snapshot_read.set()
+            status_set.wait(5)
+        return snapshot
+
+    def mock_load():
+        reader.start()
+        snapshot_read.wait(5)
+        return load()
+
+    def mock_set_status(*args):
+        set_status(*args)
+        status_set.set()
+        rebuilt.wait(5)
+
+    def mock_rebuild(*args):
+        rebuild(*args)
+        rebuilt.set()
+
+    with mock.patch('ga4ghtest.core.queue.load_snapshot',
+                    mock_load_snapshot), \
+            mock.patch.object(test_store, '_load', mock_load), \
+            mock.patch.object(test_index, 'set_status', mock_set_status), \
+            mock.patch.object(test_index, 'rebuild', mock_rebuild):
+        test_store.update('mock_queue_1', 'mock_sub_1', 'status', 'COMPLETE')
+        reader.join()
+
+    assert rebuilt.is_set()
+    assert test_store.list_ids('mock_queue_1', ['COMPLETE']) == ['mock_sub_1']
+    assert test_store.list_ids('mock_queue_1', ['RECEIVED']) == []
+
+
+def _create_submissions(path, worker_id, count):
+    test_store = JSONQueueStore(path)
+    for i in range(count):
+        test_store.create('mock_queue_1', '{}_{}'.format(worker_id, i),
+                          {'status': 'RECEIVED'})
+
+
+def test_json_queue_store_concurrent_writes(mock_submissionqueue):
+    workers = [multiprocessing.Process(target=_create_submissions,
+                                       args=(str(mock_submissionqueue),
+                                             worker_id, 10))
+               for worker_id in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with open(str(mock_submissionqueue), 'r') as f:
+        test_queue = json.load(f)
+    assert len(test_queue['mock_queue_1']) == 40
+
+
+def test_load_queue_store_sqlite(tmpdir, monkeypatch):
+    mock_queue_db = str(tmpdir.join('submission_queue.db'))
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        mock_queue_db)
+
+    test_store = load_queue_store()
+
+    assert isinstance(test_store, SQLiteQueueStore)
+    assert load_queue_store() is test_store
+
+
+def test_sqlite_queue_store(tmpdir, monkeypatch):
+    mock_queue_db = str(tmpdir.join('submission_queue.db'))
+    monkeypatch.setattr('ga4ghtest.core.queue.submission_queue',
+                        mock_queue_db)
+
+    test_sub_id = create_submission(queue_id='mock_queue_1',
+                                    submission_data={})
+    create_submission(queue_id='mock_queue_2', submission_data={})
+
+    assert get_submissions('mock_queue_1') == [test_sub_id]
+    assert get_submissions('mock_queue_1', status=['COMPLETE']) == []
+
+    update_submission('mock_queue_1', test_sub_id, 'status', 'COMPLETE')
+
+    test_bundle = get_submission_bundle('mock_queue_1', test_sub_id)
+    mock_bundle = {'data': {}, 'status': 'COMPLETE', 'wes_id': None}
+    assert test_bundle == mock_bundle
+    assert get_submissions('mock_queue_1', status=['COMPLETE']) == [test_sub_id]
+    assert get_submissions('mock_queue_1', status='RECEIVED') == []
+
+    update_submissions([('mock_queue_1', test_sub_id, {'status': 'RECEIVED'})])
+
+    assert get_submissions('mock_queue_1', status='RECEIVED') == [test_sub_id]
+
+
+def test_sqlite_queue_store_missing_bundle(tmpdir):
+    test_store = SQLiteQueueStore(str(tmpdir.join('submission_queue.db')))
+
+    with pytest.raises(KeyError):
+        test_store.get('mock_queue_1', 'mock_sub')
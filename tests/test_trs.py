@@ -8,6 +8,8 @@ from bravado.testing.response_mocks import BravadoResponseMock
 from ga4ghtest.services.trs.api import _get_trs_opts
 from ga4ghtest.services.trs.api import _init_http_client
 from ga4ghtest.services.trs.api import load_trs_client
+from ga4ghtest.services.trs.cache import TRSCache
+from ga4ghtest.services.trs.client import TRSClient
 from ga4ghtest.services.trs.controller import TRSService
 
 
@@ -28,6 +30,148 @@ def test__init_http_client(mock_trs_config):
     assert test_http_client.authenticator.api_key == mock_opts['auth']
 
 
+def test__init_http_client_shared_session(mock_trs_config):
+    mock_opts = mock_trs_config['mock_trs']
+    test_http_client = _init_http_client(opts=mock_opts)
+    test_trs_client = TRSClient(service=mock_opts)
+
+    assert test_http_client.session is test_trs_client.session
+    assert (test_trs_client.session.get_adapter('https://0.0.0.0:8080')
+            ._pool_maxsize == 32)
+
+
+def test_trs_client_pool_size(mock_trs_config):
+    mock_opts = dict(mock_trs_config['mock_trs'],
+                     host='pooled.example.org', pool_maxsize=4,
+                     cache=False)
+    test_trs_client = TRSClient(service=mock_opts)
+    mock_response = mock.Mock(status_code=200, text='[]')
+
+    with mock.patch.object(test_trs_client.session, 'get',
+                           return_value=mock_response) as mock_get:
+        assert test_trs_client.get_tools() == []
+    mock_get.assert_called_once_with(
+        'https://pooled.example.org/ga4gh/trs/v2/tools',
+        headers=mock_opts['auth']
+    )
+    assert (test_trs_client.session.get_adapter('https://pooled.example.org')
+            ._pool_maxsize == 4)
+
+
+def test_trs_client_cached_pinned_version(mock_trs_config, tmpdir):
+    mock_opts = dict(mock_trs_config['mock_trs'], cache_dir=str(tmpdir))
+    test_trs_client = TRSClient(service=mock_opts)
+    mock_response = mock.Mock(status_code=200, content=b'{"url": "x"}',
+                              text='{"url": "x"}', headers={})
+
+    with mock.patch.object(test_trs_client.session, 'get',
+                           return_value=mock_response) as mock_get:
+        for _ in range(2):
+            test_descriptor = test_trs_client.get_tool_descriptor(
+                'mock_tool', '1.0.0', 'CWL'
+            )
+    assert test_descriptor == {'url': 'x'}
+    assert mock_get.call_count == 1
+
+    # a new cache instance reads the stored index and blob from disk
+    test_trs_client.cache = TRSCache(str(tmpdir))
+    with mock.patch.object(test_trs_client.session, 'get') as mock_get:
+        test_descriptor = test_trs_client.get_tool_descriptor(
+            'mock_tool', '1.0.0', 'CWL'
+        )
+    assert test_descriptor == {'url': 'x'}
+    mock_get.assert_not_called()
+
+
+def test_trs_client_cached_mutable_version(mock_trs_config, tmpdir,
+                                           monkeypatch):
+    monkeypatch.setattr('ga4ghtest.services.trs.cache.mutable_ttl', 0)
+    mock_opts = dict(mock_trs_config['mock_trs'], cache_dir=str(tmpdir))
+    test_trs_client = TRSClient(service=mock_opts)
+    mock_response = mock.Mock(status_code=200, content=b'{"url": "x"}',
+                              text='{"url": "x"}', headers={'ETag': '"v1"'})
+    mock_not_modified = mock.Mock(status_code=304, headers={})
+
+    with mock.patch.object(test_trs_client.session, 'get',
+                           side_effect=[mock_response, mock_not_modified]) \
+            as mock_get:
+        for _ in range(2):
+            test_descriptor = test_trs_client.get_tool_descriptor(
+                'mock_tool', 'develop', 'CWL'
+            )
+    assert test_descriptor == {'url': 'x'}
+    assert mock_get.call_count == 2
+    assert mock_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+
+
+def test_trs_cache_eviction(tmpdir):
+    test_cache = TRSCache(str(tmpdir), max_entries=1)
+    mock_session = mock.Mock()
+    mock_session.get.side_effect = [
+        mock.Mock(status_code=200, content=content, headers={})
+        for content in [b'a', b'b', b'a']
+    ]
+    for url in ['mock://a', 'mock://b', 'mock://a']:
+        test_cache.get(mock_session, url)
+
+    assert mock_session.get.call_count == 3
+    assert list(test_cache._index) == ['mock://a']
+
+
+def test_trs_cache_pinned_ttl(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.services.trs.cache.pinned_ttl', 0)
+    test_cache = TRSCache(str(tmpdir))
+    mock_session = mock.Mock()
+    mock_session.get.side_effect = [
+        mock.Mock(status_code=200, content=b'a', headers={'ETag': '"v1"'}),
+        mock.Mock(status_code=304, headers={})
+    ]
+    for _ in range(2):
+        test_response = test_cache.get(mock_session, 'mock://a')
+
+    assert test_response.content == b'a'
+    assert mock_session.get.call_count == 2
+    assert mock_session.get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+
+
+def test_trs_cache_auth_key(tmpdir):
+    test_cache = TRSCache(str(tmpdir))
+    mock_session = mock.Mock()
+    mock_session.get.side_effect = [
+        mock.Mock(status_code=200, content=content, headers={})
+        for content in [b'a', b'b']
+    ]
+    for token in ['a', 'b', 'a']:
+        test_response = test_cache.get(
+            mock_session, 'mock://a', headers={'Authorization': token}
+        )
+
+    assert mock_session.get.call_count == 2
+    assert test_response.content == b'a'
+
+
+def test_trs_cache_index_flush(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.services.trs.cache.index_flush_interval',
+                        3600)
+    test_cache = TRSCache(str(tmpdir))
+    mock_session = mock.Mock()
+    mock_session.get.side_effect = [
+        mock.Mock(status_code=200, content=content, headers={})
+        for content in [b'a', b'b']
+    ]
+    with mock.patch.object(test_cache, '_write',
+                           wraps=test_cache._write) as mock_write:
+        for url in ['mock://a', 'mock://b']:
+            test_cache.get(mock_session, url)
+        index_writes = [c for c in mock_write.call_args_list
+                        if c[0][0] == test_cache.index_path]
+        assert len(index_writes) == 1
+
+        test_cache.flush()
+    assert list(TRSCache(str(tmpdir))._load_index()) == ['mock://a',
+                                                         'mock://b']
+
+
 # def test_load_trs_client_from_spec(mock_trs_config, monkeypatch):
 #     monkeypatch.setattr('ga4ghtest.services.trs.api._get_trs_opts',
 #                         lambda x: mock_trs_config['mock_trs'])
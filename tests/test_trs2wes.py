@@ -1,21 +1,35 @@
+import io
 import logging
 import os
 import pytest
 import mock
 import yaml
 import json
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from toil.wdl import wdl_parser
 
 from ga4ghtest.converters.trs2wes import fetch_queue_workflow
+from ga4ghtest.converters.trs2wes import fetch_queue_workflows
 from ga4ghtest.converters.trs2wes import store_verification
 from ga4ghtest.converters.trs2wes import get_version
+from ga4ghtest.converters.trs2wes import sniff_version
 from ga4ghtest.converters.trs2wes import get_wf_info
 from ga4ghtest.converters.trs2wes import get_wdl_inputs
+from ga4ghtest.converters.trs2wes import find_asts
 from ga4ghtest.converters.trs2wes import modify_jsonyaml_paths
 from ga4ghtest.converters.trs2wes import get_wf_descriptor
+from ga4ghtest.converters.trs2wes import get_packed_cwl
 from ga4ghtest.converters.trs2wes import get_wf_params
 from ga4ghtest.converters.trs2wes import get_wf_attachments
 from ga4ghtest.converters.trs2wes import expand_globs
+from ga4ghtest.converters.trs2wes import stage_attachments
 from ga4ghtest.converters.trs2wes import build_wes_request
+from ga4ghtest.converters.trs2wes import prepare_workflow
+from ga4ghtest import util
+from ga4ghtest.util import LazyFile
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -56,6 +70,79 @@ def test_fetch_queue_workflow(mock_orchestratorqueues,
     assert(test_config['mock_queue_1'] == mock_config)
 
 
+def test_fetch_queue_workflow_attachment_order(mock_orchestratorqueues,
+                                               mock_queue_config,
+                                               mock_trs,
+                                               monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.config.queues_path',
+                        str(mock_orchestratorqueues))
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.queue_config',
+                        lambda: mock_queue_config)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.TRSService',
+                        lambda trs_id: mock_trs)
+
+    def mock_get_relative(relative_path, **kwargs):
+        # later paths return first
+        time.sleep(0.01 * (5 - int(relative_path.split('_')[-1])))
+        return {'url': 'mock_url_{}'.format(relative_path)}
+
+    mock_paths = ['mock_path_{}'.format(i) for i in range(5)]
+    mock_trs.get_workflow_descriptor.return_value = {'url': 'mock_wf_url'}
+    mock_trs.get_workflow_files.return_value = (
+        [{'file_type': 'PRIMARY_DESCRIPTOR', 'path': 'main.cwl'}]
+        + [{'file_type': 'SECONDARY_DESCRIPTOR', 'path': path}
+           for path in mock_paths]
+    )
+    mock_trs.get_workflow_descriptor_relative.side_effect = mock_get_relative
+
+    test_config = fetch_queue_workflow('mock_queue_1')
+
+    assert test_config['workflow_url'] == 'mock_wf_url'
+    assert test_config['workflow_attachments'] == [
+        'mock_url_{}'.format(path) for path in mock_paths
+    ]
+
+
+def test_fetch_queue_workflows(mock_orchestratorqueues,
+                               mock_queue_config,
+                               mock_trs,
+                               monkeypatch):
+    mock_queue_config['mock_queue_3'] = dict(mock_queue_config['mock_queue_1'])
+    monkeypatch.setattr('ga4ghtest.core.config.queues_path',
+                        str(mock_orchestratorqueues))
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.queue_config',
+                        lambda: mock_queue_config)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.TRSService',
+                        lambda trs_id: mock_trs)
+    mock_save_yaml = mock.Mock()
+    monkeypatch.setattr('ga4ghtest.core.config.save_yaml', mock_save_yaml)
+
+    mock_trs.get_workflow_descriptor.side_effect = \
+        lambda id, version_id, type: {'url': '{}_{}_url'.format(id, version_id)}
+    mock_trs.get_workflow_files.return_value = [
+        {'file_type': 'SECONDARY_DESCRIPTOR', 'path': 'mock_path'}
+    ]
+    mock_trs.get_workflow_descriptor_relative.side_effect = \
+        lambda id, version_id, type, relative_path: {
+            'url': '{}_{}_{}'.format(id, version_id, relative_path)
+        }
+
+    test_updates = fetch_queue_workflows()
+
+    assert sorted(test_updates) == ['mock_queue_1', 'mock_queue_1_checker',
+                                    'mock_queue_2', 'mock_queue_3']
+    assert test_updates['mock_queue_3']['workflow_url'] == 'mock_wf_develop_url'
+    assert test_updates['mock_queue_3']['workflow_attachments'] == \
+        ['mock_wf_develop_mock_path']
+    assert test_updates['mock_queue_2']['workflow_url'] == 'mock_wf_prod_url'
+    # mock_queue_1 and mock_queue_3 share the same workflow
+    assert mock_trs.get_workflow_descriptor.call_count == 3
+    assert mock_trs.get_workflow_descriptor_relative.call_count == 3
+    assert mock_save_yaml.call_count == 1
+    assert mock_save_yaml.call_args[0][1]['mock_queue_1'] == \
+        test_updates['mock_queue_1']
+
+
 def test_store_verification(mock_orchestratorqueues,
                             mock_queue_config,
                             monkeypatch):
@@ -101,6 +188,29 @@ def test_get_version_wdl(wdl_descriptor):
     assert test_version == 'draft-2'
 
 
+def test_get_version_streamed_prefix(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.version_sniff_size', 16)
+    mock_cwl = tmpdir.join('mock.cwl')
+    # content after the version statement is never read or parsed
+    mock_cwl.write('#!/usr/bin/env cwl-runner\n'
+                   'cwlVersion: v1.0\n'
+                   'class: Workflow\n' + ': invalid\n' * 10000)
+    mock_read = mock.Mock(wraps=LazyFile.read)
+    monkeypatch.setattr(LazyFile, 'read',
+                        lambda self, size=-1: mock_read(self, size))
+
+    assert get_version(extension='cwl', workflow_file=str(mock_cwl)) == 'v1.0'
+    assert mock_read.call_count < 5
+
+
+def test_sniff_version():
+    assert sniff_version('wdl', b'# comment\n\nversion 1.0\n') == '1.0'
+    assert sniff_version('wdl', b'task md5 {\n') == 'draft-2'
+    assert sniff_version('wdl', b'# comment\n') is None
+    assert sniff_version('cwl', b'{"cwlVersion": "v1.1"}') == 'v1.1'
+    assert sniff_version('cwl', b'class: Workflow\n') is None
+
+
 def test_get_wf_info_cwl(cwl_descriptor):
     test_info = get_wf_info(workflow_path=cwl_descriptor)
     assert test_info == ('v1.0', 'CWL')
@@ -116,6 +226,33 @@ def test_get_wdl_inputs(wdl_wf_attachment):
     assert test_inputs == {'File': ['ga4ghMd5.inputFile']}
 
 
+def test_get_wdl_inputs_cached(wdl_wf_attachment, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._wdl_cache',
+                        OrderedDict())
+    mock_parse = mock.Mock(wraps=wdl_parser.parse)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.wdl_parser.parse',
+                        mock_parse)
+    test_wdl = wdl_wf_attachment['workflow_attachment'][1]
+
+    for _ in range(3):
+        test_inputs = get_wdl_inputs(test_wdl)
+        test_inputs['File'].append('mock_input')
+    assert get_wdl_inputs(test_wdl) == {'File': ['ga4ghMd5.inputFile']}
+    assert mock_parse.call_count == 1
+
+
+def test_find_asts_deep_tree():
+    test_ast = wdl_parser.Ast('Declaration', {})
+    for _ in range(5000):
+        test_ast = wdl_parser.Ast('Scatter', {'body': wdl_parser.AstList(
+            [wdl_parser.Ast('Declaration', {}), test_ast]
+        )})
+
+    test_nodes = find_asts(test_ast, 'Declaration')
+    assert len(test_nodes) == 5001
+    assert test_nodes[0] is test_ast.attr('body')[0]
+
+
 def test_modify_jsonyaml_paths_cwl(cwl_jsonyaml, cwl_modified_params):
     test_params = modify_jsonyaml_paths(cwl_jsonyaml)
     assert test_params == cwl_modified_params(cwl_jsonyaml)
@@ -142,7 +279,7 @@ def test_get_wf_descriptor_cwl_attach(cwl_descriptor, cwl_wf_attachment):
     test_parts_dict = dict(test_parts)
     assert test_parts_dict['workflow_url'] == cwl_wf_attachment['workflow_url']
     assert test_parts_dict['workflow_attachment'][0] == cwl_wf_attachment['workflow_attachment'][0]
-    assert test_parts_dict['workflow_attachment'][1].read() == cwl_wf_attachment['workflow_attachment'][1]
+    assert test_parts_dict['workflow_attachment'][1].read().decode() == cwl_wf_attachment['workflow_attachment'][1]
 
 
 def test_get_wf_descriptor_wdl_attach(wdl_descriptor, wdl_wf_attachment):
@@ -150,7 +287,52 @@ def test_get_wf_descriptor_wdl_attach(wdl_descriptor, wdl_wf_attachment):
     test_parts_dict = dict(test_parts)
     assert test_parts_dict['workflow_url'] == wdl_wf_attachment['workflow_url']
     assert test_parts_dict['workflow_attachment'][0] == wdl_wf_attachment['workflow_attachment'][0]
-    assert test_parts_dict['workflow_attachment'][1].read() == wdl_wf_attachment['workflow_attachment'][1]
+    assert test_parts_dict['workflow_attachment'][1].read().decode() == wdl_wf_attachment['workflow_attachment'][1]
+
+
+def test_get_packed_cwl_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._packed_cwl',
+                        OrderedDict())
+    mock_pack_cwl = mock.Mock(side_effect=['mock_packed_1', 'mock_packed_2'])
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._pack_cwl',
+                        mock_pack_cwl)
+    mock_tool = tmpdir.join('tool.cwl')
+    mock_tool.write('class: CommandLineTool\nbaseCommand: echo\n')
+    mock_wf = tmpdir.join('main.cwl')
+    mock_wf.write('class: Workflow\n'
+                  'steps:\n'
+                  '  step_1:\n'
+                  '    run: tool.cwl\n')
+
+    assert get_packed_cwl(str(mock_wf)) == 'mock_packed_1'
+    assert get_packed_cwl(str(mock_wf)) == 'mock_packed_1'
+    assert mock_pack_cwl.call_count == 1
+
+    # changing a referenced descriptor invalidates the packed workflow
+    mock_tool.write('class: CommandLineTool\nbaseCommand: cat\n')
+    assert get_packed_cwl(str(mock_wf)) == 'mock_packed_2'
+    assert mock_pack_cwl.call_count == 2
+
+
+def test_get_packed_cwl_concurrent(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._packed_cwl',
+                        OrderedDict())
+    mock_calls = []
+
+    def mock_pack_cwl(workflow_url):
+        mock_calls.append(workflow_url)
+        time.sleep(0.1)
+        return 'mock_packed'
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._pack_cwl',
+                        mock_pack_cwl)
+    mock_wf = tmpdir.join('main.cwl')
+    mock_wf.write('class: Workflow\n')
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        test_packed = list(executor.map(get_packed_cwl, [str(mock_wf)] * 4))
+
+    assert test_packed == ['mock_packed'] * 4
+    assert len(mock_calls) == 1
 
 
 def test_get_wf_params_cwl(cwl_descriptor, cwl_jsonyaml, cwl_params):
@@ -175,7 +357,7 @@ def test_get_wf_attachments(cwl_descriptor, cwl_attachments, cwl_import_attachme
     test_parts = get_wf_attachments(cwl_descriptor, cwl_attachments)
     test_parts_dict = dict(test_parts)
     assert test_parts_dict['workflow_attachment'][0] == cwl_import_attachment[0]
-    assert test_parts_dict['workflow_attachment'][1].read() == cwl_import_attachment[1]
+    assert test_parts_dict['workflow_attachment'][1].read().decode() == cwl_import_attachment[1]
 
 
 def test_expand_globs(cwl_descriptor):
@@ -185,6 +367,34 @@ def test_expand_globs(cwl_descriptor):
     else:
         assert test_set == set(['file://{}'.format(os.path.abspath(cwl_descriptor))])
 
+def test_stage_attachments(tmpdir):
+    mock_wf = tmpdir.mkdir('wf').join('main.cwl')
+    mock_wf.write('cwlVersion: v1.0\n')
+    mock_shards = tmpdir.join('wf').mkdir('shards')
+    for i in range(20):
+        mock_shards.join('shard_{:02d}.txt'.format(i)).write(str(i % 3))
+    # files outside the descriptor's directory are attached by filename
+    for mock_dir, mock_contents in [('a', 'same'), ('b', 'same'),
+                                    ('c', 'other')]:
+        tmpdir.mkdir(mock_dir).join('input.txt').write(mock_contents)
+
+    test_attachments = stage_attachments(
+        'file://' + str(mock_wf),
+        ['file://' + str(mock_shards.join('*.txt')),
+         str(mock_shards.join('shard_00.txt')),
+         'http://mock.org/input.txt',
+         str(tmpdir.join('*', 'input.txt'))]
+    )
+
+    assert test_attachments == sorted(
+        ['file://' + str(mock_shards.join('shard_{:02d}.txt'.format(i)))
+         for i in range(20)]
+        + ['file://' + str(tmpdir.join('a', 'input.txt')),
+           'file://' + str(tmpdir.join('c', 'input.txt')),
+           'http://mock.org/input.txt']
+    )
+
+
 def test_build_wes_request(cwl_descriptor,
                            cwl_jsonyaml,
                            cwl_attachments,
@@ -200,4 +410,136 @@ def test_build_wes_request(cwl_descriptor,
     test_parts = build_wes_request(cwl_descriptor,
                                    cwl_jsonyaml,
                                    cwl_attachments)
-    assert test_parts == []
\ No newline at end of file
+    assert test_parts == []
+
+
+def test_build_wes_request_shared_artifacts(monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._prepared',
+                        OrderedDict())
+    mock_open = mock.Mock(wraps=LazyFile)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.LazyFile', mock_open)
+    data_path = os.path.join(os.path.dirname(__file__), 'testdata')
+    test_descriptor = os.path.join(data_path, 'md5sum.cwl')
+    test_jsonyaml = 'file://' + os.path.join(data_path, 'md5sum.cwl.json')
+    test_attachments = [
+        'file://' + os.path.join(data_path, 'dockstore-tool-md5sum.cwl')
+    ]
+
+    test_requests = [
+        dict(build_wes_request(test_descriptor,
+                               test_jsonyaml,
+                               test_attachments,
+                               attach_descriptor=attach,
+                               attach_imports=True))
+        for attach in [True, False, True]
+    ]
+
+    # the descriptor and attachment are each opened once
+    assert mock_open.call_count == 2
+    assert test_requests[1]['workflow_type_version'] == 'v1.0'
+    assert test_requests[0]['workflow_params'] == \
+        test_requests[1]['workflow_params']
+    assert test_requests[0]['workflow_attachment'][1].read() == \
+        test_requests[2]['workflow_attachment'][1].read()
+    assert test_requests[0]['workflow_attachment'][1] is not \
+        test_requests[2]['workflow_attachment'][1]
+
+    test_prepared = prepare_workflow('file://' + test_descriptor,
+                                     test_jsonyaml,
+                                     test_attachments)
+    assert len(test_prepared._artifacts) == 4
+
+
+def test_build_wes_request_changed_glob_attachment(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._prepared',
+                        OrderedDict())
+    data_path = os.path.join(os.path.dirname(__file__), 'testdata')
+    test_descriptor = os.path.join(data_path, 'md5sum.cwl')
+    test_jsonyaml = 'file://' + os.path.join(data_path, 'md5sum.cwl.json')
+    mock_input = tmpdir.join('input.txt')
+    mock_input.write('v1\n')
+
+    def attached_content():
+        test_parts = dict(build_wes_request(
+            test_descriptor, test_jsonyaml, [str(tmpdir.join('*.txt'))]
+        ))
+        return test_parts['workflow_attachment'][1].read()
+
+    assert attached_content() == b'v1\n'
+    mock_input.write('v2 (edited)\n')
+    assert attached_content() == b'v2 (edited)\n'
+
+
+def test_prepare_workflow_shared_buffer_limit(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._prepared',
+                        OrderedDict())
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._shared_bytes', 0)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.shared_buffer_limit',
+                        6)
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.prepared_cache_size',
+                        1)
+    mock_files = []
+    for name in ['a.txt', 'b.txt']:
+        mock_files.append(str(tmpdir.join(name)))
+        tmpdir.join(name).write('1234')
+
+    test_prepared = prepare_workflow('file://' + mock_files[0], mock_files[0])
+    assert not isinstance(test_prepared.attachment(mock_files[0]), LazyFile)
+    # the second buffer would exceed the limit, so it's streamed
+    assert isinstance(test_prepared.attachment(mock_files[1]), LazyFile)
+
+    # evicted workflows return their buffers to the budget
+    test_new_prepared = prepare_workflow('file://' + mock_files[1],
+                                         mock_files[1])
+    assert test_new_prepared is not test_prepared
+    assert not isinstance(test_new_prepared.attachment(mock_files[1]),
+                          LazyFile)
+
+
+def test_prepare_workflow_streamed_remote_attachment(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._prepared',
+                        OrderedDict())
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.shared_buffer_size', 4)
+    monkeypatch.setattr('ga4ghtest.util.file_readers',
+                        dict(util.file_readers))
+    mock_contents = b'mock binary' * 1000
+    mock_downloads = []
+
+    class MockStream(object):
+        # a remote stream without a known length
+        def __init__(self):
+            self._f = io.BytesIO(mock_contents)
+            self.read = self._f.read
+            self.close = self._f.close
+
+        def seekable(self):
+            return False
+
+    util.register_file_reader(
+        'mockstream',
+        lambda url, byte_range=None: mock_downloads.append(url)
+        or MockStream()
+    )
+    mock_file = str(tmpdir.join('main.cwl'))
+    tmpdir.join('main.cwl').write('cwlVersion: v1.0\n')
+
+    test_prepared = prepare_workflow('file://' + mock_file, mock_file)
+    test_attachment = test_prepared.attachment('mockstream://data/input.bin')
+
+    # the download used to measure the file is streamed, not repeated
+    assert isinstance(test_attachment, LazyFile)
+    assert test_attachment.read() == mock_contents
+    assert mock_downloads == ['mockstream://data/input.bin']
+
+
+def test_prepare_workflow_remote_ttl(monkeypatch):
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes._prepared',
+                        OrderedDict())
+    mock_url = 'https://mock.org/main.cwl'
+
+    test_prepared = prepare_workflow(mock_url, mock_url)
+    assert prepare_workflow(mock_url, mock_url) is test_prepared
+
+    monkeypatch.setattr('ga4ghtest.converters.trs2wes.prepared_remote_ttl',
+                        -1)
+    assert prepare_workflow(mock_url, mock_url) is not test_prepared
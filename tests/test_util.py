@@ -1,9 +1,16 @@
+import io
+import json
 import logging
+import mock
+import multiprocessing
+import os
 import pytest
 import yaml
 import textwrap
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from ga4ghtest import util
+from ga4ghtest.services import sessions
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -19,6 +26,98 @@ def test_open_file_read(tmpdir):
     assert test_contents == mock_contents
 
 
+def test_open_file_read_local(tmpdir, monkeypatch):
+    mock_file = tmpdir.join('mock.txt')
+    mock_file.write_binary(b'0123456789')
+    monkeypatch.setattr('ga4ghtest.util.file_readers', {})
+
+    with util.open_file(str(mock_file), 'r') as f:
+        assert f.read() == b'0123456789'
+    with util.open_file(str(mock_file), 'r', byte_range=(2, 4)) as f:
+        assert f.read() == b'234'
+    with util.open_file(str(mock_file), 'r', byte_range=(8, None)) as f:
+        assert f.read() == b'89'
+
+
+def test_open_file_read_http(monkeypatch):
+    mock_session = mock.Mock()
+    mock_session.get.return_value.raw = io.BytesIO(b'mock text')
+    monkeypatch.setattr('ga4ghtest.util.get_session',
+                        lambda url: mock_session)
+
+    with util.open_file('https://mock.org/mock.txt', 'r',
+                        byte_range=(0, 3)) as f:
+        assert f.read() == b'mock text'
+    mock_session.get.assert_called_once_with(
+        'https://mock.org/mock.txt',
+        headers={'Accept-Encoding': 'identity', 'Range': 'bytes=0-3'},
+        stream=True
+    )
+
+
+def test_open_file_read_registered_scheme(monkeypatch):
+    monkeypatch.setattr('ga4ghtest.util.file_readers',
+                        dict(util.file_readers))
+    util.register_file_reader(
+        'mock', lambda url, byte_range=None: io.BytesIO(url.encode())
+    )
+
+    with util.open_file('mock://data', 'r') as f:
+        assert f.read() == b'mock://data'
+    with pytest.raises(ValueError):
+        with util.open_file('unknown://data', 'r') as f:
+            pass
+
+
+def test_lazy_file(tmpdir):
+    mock_contents = b'\x00\xffmock binary' * 10000
+    mock_file = tmpdir.join('mock.bin')
+    mock_file.write_binary(mock_contents)
+
+    test_file = util.LazyFile('file://{}'.format(str(mock_file)),
+                              chunk_size=1024)
+    assert test_file._f is None
+    assert test_file.name == 'mock.bin'
+    assert len(test_file) == len(mock_contents)
+    assert b''.join(test_file) == mock_contents
+    assert test_file.tell() == len(mock_contents)
+
+    test_file.seek(0)
+    assert test_file.read(4) == mock_contents[:4]
+    test_file.close()
+
+
+def test_lazy_file_registered_scheme(monkeypatch):
+    monkeypatch.setattr('ga4ghtest.util.file_readers',
+                        dict(util.file_readers))
+    mock_contents = b'mock binary' * 1000
+
+    class MockStream(object):
+        # a non-seekable stream without headers, e.g., a pipe
+        def __init__(self):
+            self._f = io.BytesIO(mock_contents)
+            self.read = self._f.read
+            self.close = self._f.close
+
+        def seekable(self):
+            return False
+
+    util.register_file_reader(
+        'mock', lambda url, byte_range=None: io.BytesIO(mock_contents)
+    )
+    util.register_file_reader(
+        'mockstream', lambda url, byte_range=None: MockStream()
+    )
+
+    for mock_url in ['mock://data.bin', 'mockstream://data.bin']:
+        test_file = util.LazyFile(mock_url)
+        assert len(test_file) == len(mock_contents)
+        assert test_file.read() == mock_contents
+        test_file.seek(0)
+        assert test_file.read(4) == mock_contents[:4]
+        test_file.close()
+
+
 def test_open_file_write(tmpdir):
     mock_contents = 'mock text'
     mock_file = tmpdir.join('mock.txt')
@@ -62,6 +161,136 @@ def test_get_yaml(tmpdir):
     assert(test_object == mock_object)
 
 
+def test_get_yaml_env_var(tmpdir, monkeypatch):
+    monkeypatch.setenv('MOCK_TOKEN', 'mock_value')
+    mock_string = """
+    section:
+       key: Bearer ${MOCK_TOKEN}
+       default: ${MOCK_UNSET:mock_default}
+    """
+    mock_file = tmpdir.join('mock.yaml')
+    mock_file.write(textwrap.dedent(mock_string))
+
+    test_object = util.get_yaml('file://{}'.format(str(mock_file)))
+    mock_object = {'section': {'key': 'Bearer mock_value',
+                               'default': 'mock_default'}}
+
+    assert(test_object == mock_object)
+
+
+def test_get_yaml_gcloud_token(tmpdir, monkeypatch):
+    mock_calls = []
+
+    def mock_check_output(command):
+        mock_calls.append(command)
+        return b'mock_token\n'
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        mock_check_output)
+    monkeypatch.setattr('ga4ghtest.util.gcloud_token',
+                        util.AccessTokenProvider(['gcloud']))
+    mock_file = tmpdir.join('mock.yaml')
+    mock_file.write('key: Bearer ${GCLOUD_TOKEN}\n')
+
+    for _ in range(3):
+        test_object = util.get_yaml('file://{}'.format(str(mock_file)))
+
+    assert test_object == {'key': 'Bearer mock_token'}
+    assert mock_calls == [['gcloud']]
+
+
+def test_access_token_provider_expiry(monkeypatch):
+    mock_tokens = iter([b'mock_token_1', b'mock_token_2'])
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        lambda command: next(mock_tokens))
+    test_provider = util.AccessTokenProvider(['gcloud'], lifetime=0)
+
+    assert test_provider.get() == 'mock_token_1'
+    assert test_provider.get() == 'mock_token_2'
+
+
+def test_access_token_provider_background_refresh(monkeypatch):
+    mock_tokens = iter([b'mock_token_1', b'mock_token_2'])
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        lambda command: next(mock_tokens))
+    test_provider = util.AccessTokenProvider(['gcloud'], lifetime=60,
+                                             refresh_margin=59.95)
+
+    assert test_provider.get() == 'mock_token_1'
+    test_provider._timer.join(timeout=5)
+    assert test_provider.get() == 'mock_token_2'
+    test_provider._timer.cancel()
+
+
+def test_access_token_provider_idle(monkeypatch):
+    mock_tokens = iter([b'mock_token_1', b'mock_token_2', b'mock_token_3'])
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        lambda command: next(mock_tokens))
+    test_provider = util.AccessTokenProvider(['gcloud'], lifetime=60,
+                                             refresh_margin=59.95)
+
+    assert test_provider.get() == 'mock_token_1'
+    test_timer = test_provider._timer
+    assert test_timer.daemon
+    test_timer.join(timeout=5)
+    # refreshed once after use, then left idle until the next access
+    test_timer = test_provider._timer
+    test_timer.join(timeout=5)
+    assert test_provider._timer is None
+    assert test_provider._token == 'mock_token_2'
+
+    assert test_provider.get() == 'mock_token_2'
+    assert test_provider._timer is not None
+    test_provider.close()
+    assert test_provider._timer is None
+
+
+def test_access_token_provider_reported_expiry(monkeypatch):
+    mock_expiry = datetime.utcnow() + timedelta(seconds=30)
+    mock_output = json.dumps({'credential': {
+        'access_token': 'mock_token',
+        'token_expiry': mock_expiry.strftime('%Y-%m-%dT%H:%M:%SZ')
+    }}).encode()
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        lambda command: mock_output)
+    test_provider = util.AccessTokenProvider(
+        ['gcloud'], lifetime=3600, refresh_margin=0,
+        parse=util._parse_gcloud_credential
+    )
+
+    assert test_provider.get() == 'mock_token'
+    assert 0 < test_provider._expires_at - time.monotonic() <= 30
+
+
+def test_access_token_provider_auth_failure(monkeypatch):
+    mock_calls = []
+
+    def mock_check_output(command):
+        mock_calls.append(command)
+        return 'mock_token_{}'.format(len(mock_calls)).encode()
+    monkeypatch.setattr('ga4ghtest.util.subprocess32.check_output',
+                        mock_check_output)
+    test_provider = util.AccessTokenProvider(['gcloud'],
+                                             force_command=['gcloud', '-f'])
+    monkeypatch.setattr('ga4ghtest.util.gcloud_token', test_provider)
+    assert test_provider.get() == 'mock_token_1'
+
+    # a 401 response on a shared session forces a new token, once
+    mock_response = mock.Mock(status_code=401)
+    for _ in range(3):
+        sessions._check_auth(mock_response)
+        assert test_provider.get() == 'mock_token_2'
+
+    assert mock_calls == [['gcloud'], ['gcloud', '-f']]
+
+
+def test_get_yaml_safe(tmpdir):
+    mock_file = tmpdir.join('mock.yaml')
+    mock_file.write('key: !!python/object/apply:os.getcwd []\n')
+
+    with pytest.raises(yaml.constructor.ConstructorError):
+        util.get_yaml('file://{}'.format(str(mock_file)))
+
+
 def test_save_yaml(tmpdir):
     mock_object = {'section': {'key': {}}}
 
@@ -107,6 +336,118 @@ def test_save_json(tmpdir):
     assert(mock_file.read() == textwrap.dedent(mock_string))
 
 
+def test_save_json_atomic(tmpdir):
+    mock_file = tmpdir.join('mock.json')
+    mock_file.write('{}')
+    os.chmod(str(mock_file), 0o640)
+
+    with mock.patch('json.dump', side_effect=TypeError):
+        with pytest.raises(TypeError):
+            util.save_json(str(mock_file), {'section': {}})
+    assert mock_file.read() == '{}'
+
+    with util.fsync_batch():
+        util.save_json(str(mock_file), {'section': {}})
+        util.save_json(str(mock_file), {'section': {'key': {}}})
+
+    assert util.get_json(str(mock_file)) == {'section': {'key': {}}}
+    assert os.stat(str(mock_file)).st_mode & 0o777 == 0o640
+    assert sorted(os.listdir(str(tmpdir))) == ['mock.json', 'mock.json.lock']
+
+
+def test_save_json_new_file_mode(tmpdir):
+    mock_file = tmpdir.join('mock.json')
+    umask = os.umask(0o027)
+    try:
+        with mock.patch('os.umask') as mock_umask:
+            util.save_json(str(mock_file), {})
+    finally:
+        os.umask(umask)
+
+    mock_umask.assert_not_called()
+    assert os.stat(str(mock_file)).st_mode & 0o777 == 0o640
+
+
+def test_fsync_batch_paths(tmpdir):
+    mock_log = str(tmpdir.join('log.json'))
+    mock_queue = str(tmpdir.join('queue.json'))
+
+    with mock.patch('ga4ghtest.util._fsync_path') as mock_fsync_path:
+        with util.fsync_batch(mock_log):
+            util.save_json(mock_log, {})
+            util.save_json(mock_queue, {})
+            util.save_json(mock_log, {'key': {}})
+            assert mock_fsync_path.call_args_list == [
+                mock.call(str(tmpdir))
+            ]
+    assert mock.call(mock_log) in mock_fsync_path.call_args_list
+    assert util.get_json(mock_log) == {'key': {}}
+
+
+def _increment_counter(path, count):
+    for _ in range(count):
+        with util.lock_file(path):
+            counter = util.get_json(path)
+            counter['count'] += 1
+            util.save_json(path, counter)
+
+
+def test_lock_file(tmpdir):
+    mock_file = tmpdir.join('mock.json')
+    util.save_json(str(mock_file), {'count': 0})
+
+    workers = [multiprocessing.Process(target=_increment_counter,
+                                       args=(str(mock_file), 20))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert util.get_json(str(mock_file)) == {'count': 80}
+
+
+def test_lock_file_remote(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+
+    with util.lock_file('https://example.org/mock.json'):
+        pass
+
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_freeze():
+    mock_object = {'section': {'key': ['value']}}
+
+    test_object = util.freeze(mock_object)
+
+    assert test_object == mock_object
+    with pytest.raises(TypeError):
+        test_object['section']['key'].append('value')
+    with pytest.raises(TypeError):
+        test_object['section'] = {}
+
+
+def test_thaw():
+    mock_object = {'section': {'key': ['value']}}
+
+    test_object = util.thaw(util.freeze(mock_object))
+    test_object['section']['key'].append('value')
+
+    assert type(test_object['section']) is dict
+    assert test_object['section']['key'] == ['value', 'value']
+
+
+def test_save_yaml_frozen(tmpdir):
+    mock_object = util.freeze({'section': {'key': ['value']}})
+
+    mock_file = tmpdir.join('mock.yaml')
+
+    util.save_yaml(str(mock_file), mock_object)
+
+    assert mock_file.read() == "section:\n  key:\n  - value\n"
+
+
 def test_ctime2datetime():
     mock_string = 'Sun Jan 01 00:00:00 2000'
 
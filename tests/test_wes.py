@@ -1,6 +1,8 @@
 import mock
+import os
 import pytest
-import inspect
+import requests
+import email.parser
 
 from bravado.requests_client import RequestsClient
 from bravado.client import SwaggerClient, ResourceDecorator
@@ -11,7 +13,11 @@ from ga4ghtest.services.wes.api import _get_wes_opts
 from ga4ghtest.services.wes.api import _init_http_client
 from ga4ghtest.services.wes.api import WESAdapter
 from ga4ghtest.services.wes.api import load_wes_client
+from ga4ghtest.services.wes.api import clear_wes_clients
+from ga4ghtest.services.wes.api import _load_wes_spec
+from ga4ghtest.services.wes.api import _save_wes_spec
 from ga4ghtest.services.wes.controller import WESService
+from ga4ghtest.util import LazyFile, MultipartStream
 
 
 def test__get_wes_opts(mock_wes_config, monkeypatch):
@@ -59,81 +65,142 @@ class TestWESAdapter:
         assert hasattr(test_wes_adapter, '_wes_client')
         assert isinstance(test_wes_adapter._wes_client, WESClient)
 
-    def test_GetServiceInfo(self, mock_client_lib):
-        mock_response = {}
-        mock_client_lib.get_service_info.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in
-                     inspect.getargspec(WESClient.get_service_info)[0][1:]}
-        test_response = wes_adapter.GetServiceInfo()
-
-        mock_client_lib.get_service_info.assert_called_once_with(**test_args)
-        assert test_response == mock_response
-
-    def test_ListRuns(self, mock_client_lib):
-        mock_response = {}
-        mock_client_lib.list_runs.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in 
-                     inspect.getargspec(WESClient.list_runs)[0][1:]}
-        test_response = wes_adapter.ListRuns()
-
-        mock_client_lib.list_runs.assert_called_once_with(**test_args)
-        assert test_response == mock_response
-
-    def test_RunWorkflow(self, mock_client_lib):
-        mock_request = {'workflow_url': '',
-                        'workflow_params': '',
-                        'attachment': ''}
-        mock_response = {}
-        mock_client_lib.run.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in 
-                     inspect.getargspec(WESClient.run)[0][1:]}
-        test_args['parts'] = None
-        test_response = wes_adapter.RunWorkflow(mock_request)
-
-        mock_client_lib.run.assert_called_once_with(**test_args)
-        assert test_response == mock_response
-
-    def test_CancelRun(self, mock_client_lib):
-        mock_response = {}
-        mock_client_lib.cancel.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in
-                     inspect.getargspec(WESClient.cancel)[0][1:]}
-        test_response = wes_adapter.CancelRun(run_id='')
-
-        mock_client_lib.cancel.assert_called_once_with(**test_args)
-        assert test_response == mock_response
-
-    def test_GetRunStatus(self, mock_client_lib):
-        mock_response = {}
-        mock_client_lib.get_run_status.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in 
-                     inspect.getargspec(WESClient.get_run_status)[0][1:]}
-        test_response = wes_adapter.GetRunStatus(run_id='')
-
-        mock_client_lib.get_run_status.assert_called_once_with(**test_args)
-        assert test_response == mock_response
-
-    def test_GetRunLog(self, mock_client_lib):
-        mock_response = {}
-        mock_client_lib.get_run_log.return_value = mock_response
-
-        wes_adapter = WESAdapter(wes_client=mock_client_lib)
-        test_args = {arg: '' for arg in 
-                     inspect.getargspec(WESClient.get_run_log)[0][1:]}
-        test_response = wes_adapter.GetRunLog(run_id='')
-
-        mock_client_lib.get_run_log.assert_called_once_with(**test_args)
-        assert test_response == mock_response
+    def _mock_session(self, monkeypatch, status_code=200, text='{}'):
+        mock_session = mock.Mock(name='mock Session')
+        mock_session.request.return_value = mock.Mock(
+            status_code=status_code, text=text
+        )
+        monkeypatch.setattr('ga4ghtest.services.wes.api.get_session',
+                            lambda url: mock_session)
+        return mock_session
+
+    @pytest.mark.parametrize('method, args, http_method, path', [
+        ('GetServiceInfo', {}, 'GET', 'service-info'),
+        ('ListRuns', {}, 'GET', 'runs'),
+        ('CancelRun', {'run_id': 'mock_run'}, 'POST', 'runs/mock_run/cancel'),
+        ('GetRunStatus', {'run_id': 'mock_run'}, 'GET',
+         'runs/mock_run/status'),
+        ('GetRunLog', {'run_id': 'mock_run'}, 'GET', 'runs/mock_run')
+    ])
+    def test_request(self, mock_wes_config, monkeypatch,
+                     method, args, http_method, path):
+        mock_session = self._mock_session(monkeypatch,
+                                          text='{"run_id": "mock_run"}')
+        wes_adapter = WESAdapter(WESClient(mock_wes_config['mock_wes']))
+
+        test_response = getattr(wes_adapter, method)(**args)
+
+        mock_session.request.assert_called_once_with(
+            http_method,
+            'https://0.0.0.0:8080/ga4gh/wes/v1/{}'.format(path),
+            headers={'Authorization': 'Bearer auth_token'}
+        )
+        assert test_response == {'run_id': 'mock_run'}
+
+    def test_RunWorkflow(self, mock_wes_config, tmpdir, monkeypatch):
+        mock_session = self._mock_session(monkeypatch,
+                                          text='{"run_id": "mock_run"}')
+        mock_contents = b'\x00\xffmock binary' * 10000
+        mock_file = tmpdir.join('input.bin')
+        mock_file.write_binary(mock_contents)
+        mock_parts = [('workflow_params', '{}'),
+                      ('workflow_attachment',
+                       ('data/input.bin', LazyFile(str(mock_file))))]
+        wes_adapter = WESAdapter(WESClient(mock_wes_config['mock_wes']))
+
+        test_response = wes_adapter.RunWorkflow({}, parts=mock_parts)
+
+        assert test_response == {'run_id': 'mock_run'}
+        args, kwargs = mock_session.request.call_args
+        assert args == ('POST', 'https://0.0.0.0:8080/ga4gh/wes/v1/runs')
+        body = kwargs['data']
+        assert isinstance(body, MultipartStream)
+        test_chunks = list(body)
+        assert max(len(chunk) for chunk in test_chunks) <= body.chunk_size
+        test_body = b''.join(test_chunks)
+        assert len(test_body) == len(body)
+
+        test_message = email.parser.BytesParser().parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(
+                kwargs['headers']['Content-Type']
+            ).encode() + test_body
+        )
+        test_parts = test_message.get_payload()
+        assert [part.get_param('name', header='content-disposition')
+                for part in test_parts] == ['workflow_params',
+                                            'workflow_attachment']
+        assert test_parts[0].get_payload() == '{}'
+        assert test_parts[1].get_filename() == 'data/input.bin'
+        assert test_parts[1].get_payload(decode=True) == mock_contents
+
+    def test_RunWorkflow_local_descriptor(self, mock_wes_config, tmpdir,
+                                          monkeypatch):
+        mock_session = self._mock_session(monkeypatch,
+                                          text='{"run_id": "mock_run"}')
+        mock_descriptor = tmpdir.join('mock_wf.cwl')
+        mock_descriptor.write('cwlVersion: v1.0\nclass: Workflow\n')
+        mock_params = tmpdir.join('mock_wf.json')
+        mock_params.write('{"input": "mock"}')
+        wes_adapter = WESAdapter(WESClient(mock_wes_config['mock_wes']))
+
+        wes_adapter.RunWorkflow({'workflow_url': str(mock_descriptor),
+                                 'workflow_params': str(mock_params),
+                                 'attachment': None})
+
+        args, kwargs = mock_session.request.call_args
+        test_message = email.parser.BytesParser().parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(
+                kwargs['headers']['Content-Type']
+            ).encode() + kwargs['data'].read()
+        )
+        test_parts = {
+            part.get_param('name', header='content-disposition'): part
+            for part in test_message.get_payload()
+        }
+        assert test_parts['workflow_url'].get_payload() == 'mock_wf.cwl'
+        assert test_parts['workflow_attachment'].get_filename() == \
+            'mock_wf.cwl'
+        assert test_parts['workflow_attachment'].get_payload(decode=True) \
+            == b'cwlVersion: v1.0\nclass: Workflow\n'
+
+    def test_RunWorkflow_many_attachments(self, mock_wes_config, tmpdir,
+                                          monkeypatch):
+        mock_session = self._mock_session(monkeypatch,
+                                          text='{"run_id": "mock_run"}')
+        mock_parts = []
+        for i in range(300):
+            mock_file = tmpdir.join('input{}.txt'.format(i))
+            mock_file.write('mock input')
+            mock_parts.append(('workflow_attachment',
+                               (mock_file.basename,
+                                LazyFile(str(mock_file)))))
+        open_fds = []
+
+        def mock_request(method, url, data=None, **kwargs):
+            open_fds.append(len(os.listdir('/proc/self/fd')))
+            reading_fds = [len(os.listdir('/proc/self/fd'))
+                           for _ in iter(lambda: data.read(64), b'')]
+            open_fds.append(max(reading_fds))
+            open_fds.append(len(os.listdir('/proc/self/fd')))
+            return mock.Mock(status_code=200, text='{"run_id": "mock_run"}')
+
+        mock_session.request.side_effect = mock_request
+        wes_adapter = WESAdapter(WESClient(mock_wes_config['mock_wes']))
+        base_fds = len(os.listdir('/proc/self/fd'))
+
+        wes_adapter.RunWorkflow({}, parts=mock_parts)
+
+        assert open_fds == [base_fds, base_fds + 1, base_fds]
+        assert all(f._f is None for _, (_, f) in mock_parts)
+
+    def test_error_response(self, mock_wes_config, monkeypatch):
+        self._mock_session(monkeypatch, status_code=503,
+                           text='{"msg": "unavailable"}')
+        wes_adapter = WESAdapter(WESClient(mock_wes_config['mock_wes']))
+
+        with pytest.raises(requests.HTTPError) as excinfo:
+            wes_adapter.GetRunStatus(run_id='mock_run')
+        assert excinfo.value.response.status_code == 503
 
 
 def test_load_wes_client_from_lib(mock_wes_config, monkeypatch):
@@ -155,6 +222,67 @@ def test_load_wes_client_from_lib(mock_wes_config, monkeypatch):
     assert all([hasattr(test_wes_client, method) for method in spec_methods])
 
 
+def test_load_wes_client_cached(mock_wes_config, monkeypatch):
+    mock_opts = dict(mock_wes_config['mock_wes'])
+    monkeypatch.setattr('ga4ghtest.services.wes.api._get_wes_opts',
+                        lambda x: dict(mock_opts))
+    clear_wes_clients()
+
+    test_wes_client = load_wes_client(service_id='mock_wes',
+                                      client_library='workflow-service')
+    assert load_wes_client(service_id='mock_wes',
+                           client_library='workflow-service') \
+        is test_wes_client
+
+    mock_opts['host'] = '0.0.0.0:8081'
+    test_new_client = load_wes_client(service_id='mock_wes',
+                                      client_library='workflow-service')
+    assert test_new_client is not test_wes_client
+    assert test_new_client._wes_client.host == '0.0.0.0:8081'
+    clear_wes_clients()
+
+
+def test__load_wes_spec_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.services.wes.api._wes_specs', {})
+    monkeypatch.setattr('ga4ghtest.services.wes.api.spec_cache_dir',
+                        str(tmpdir.join('cache')))
+    spec_path = str(tmpdir.join('spec.swagger.yaml'))
+    with open(spec_path, 'w') as f:
+        f.write("swagger: '2.0'\n"
+                "info: {title: test, version: '1.0'}\n"
+                "paths:\n"
+                "  /service-info:\n"
+                "    get:\n"
+                "      operationId: GetServiceInfo\n"
+                "      responses: {200: {description: ok}}\n")
+
+    test_spec, test_digest, test_validated = _load_wes_spec(spec_path)
+    assert not test_validated
+    assert '200' in test_spec['paths']['/service-info']['get']['responses']
+
+    test_cache_path = _save_wes_spec(spec_path, test_digest, test_spec)
+    assert test_cache_path.startswith(str(tmpdir.join('cache')))
+    assert test_cache_path.endswith('.json')
+    assert os.stat(str(tmpdir.join('cache'))).st_mode & 0o777 == 0o700
+
+    monkeypatch.setattr('ga4ghtest.services.wes.api._wes_specs', {})
+    test_cached_spec, _, test_validated = _load_wes_spec(spec_path)
+    assert test_validated
+    assert test_cached_spec == test_spec
+
+    # a cache directory that other users can write to is never read
+    monkeypatch.setattr('ga4ghtest.services.wes.api._wes_specs', {})
+    os.chmod(str(tmpdir.join('cache')), 0o777)
+    _, _, test_validated = _load_wes_spec(spec_path)
+    assert not test_validated
+
+    with open(spec_path, 'a') as f:
+        f.write("basePath: /ga4gh/wes/v1\n")
+    _, test_new_digest, test_validated = _load_wes_spec(spec_path)
+    assert test_new_digest != test_digest
+    assert not test_validated
+
+
 class TestWESService:
     """
     Tests methods for the :class:`WES` class, which serve as the main
@@ -1,16 +1,24 @@
 import mock
 import pytest
+import time
 import datetime as dt
 
+from requests.exceptions import ConnectionError
+
 from bravado.requests_client import RequestsClient
 from bravado.client import SwaggerClient, ResourceDecorator
 from bravado.testing.response_mocks import BravadoResponseMock
+from wes_client.util import WESClient
 
+from ga4ghtest.services.wes.api import WESAdapter
 from ga4ghtest.services.wes.controller import WESService
 from ga4ghtest.core.wes_orchestrator import run_job
 from ga4ghtest.core.wes_orchestrator import run_submission
 from ga4ghtest.core.wes_orchestrator import run_queue
 from ga4ghtest.core.wes_orchestrator import monitor_queue
+from ga4ghtest.core.wes_orchestrator import StatusFollowup
+from ga4ghtest.core.wes_orchestrator import EndpointSlot
+from ga4ghtest.core.wes_orchestrator import _submit_run
 # from ga4ghtest.core.wes_orchestrator import monitor
 
 
@@ -29,8 +37,11 @@ def test_run_job(mock_queue_config,
                         lambda **kwargs: None)
     monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.WESService',
                         lambda wes_id: mock_wes)
-    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submission', 
-                        lambda w,x,y,z: None)
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submissions',
+                        lambda updates: None)
+    mock_followup = mock.Mock(name='mock StatusFollowup')
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.status_followup',
+                        mock_followup)
 
     mock_request = {'workflow_url': None,
                     'workflow_params': mock_submission['mock_sub']['data'],
@@ -44,7 +55,11 @@ def test_run_job(mock_queue_config,
                            wf_jsonyaml=mock_submission['mock_sub']['data'])
 
     mock_wes.run_workflow.assert_called_once_with(mock_request, parts=None)
+    mock_wes.get_run_status.assert_not_called()
+    mock_followup.schedule.assert_called_once_with('mock_queue_1', None,
+                                                   'mock_wes', 'mock_run')
     assert 'start_time' in test_run_log
+    assert test_run_log['status'] == 'UNKNOWN'
 
 
 def test_run_submission(mock_submission, 
@@ -53,16 +68,20 @@ def test_run_submission(mock_submission,
                         monkeypatch):
     monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.get_submission_bundle', 
                         lambda x,y: mock_submission['mock_sub'])
-    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submission', 
-                        lambda w,x,y,z: None)
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submissions',
+                        lambda updates: None)
 
     monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.run_job', 
                         lambda **kwargs: mock_run_log)
+    mock_followup = mock.Mock(name='mock StatusFollowup')
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.status_followup',
+                        mock_followup)
 
     test_run_log = run_submission(queue_id='mock_queue',
                                   submission_id='mock_sub')
 
     assert test_run_log == mock_run_log
+    mock_followup.schedule.assert_not_called()
 
 
 def test_run_queue(mock_queue_config, 
@@ -89,6 +108,87 @@ def test_run_queue(mock_queue_config,
     assert test_queue_log == mock_queue_log
 
 
+def test_run_queue_parallel(mock_submission, monkeypatch):
+    mock_sub_ids = ['mock_sub_{}'.format(i) for i in range(20)]
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.get_submissions',
+                        lambda x,status: mock_sub_ids)
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.get_submission_bundle',
+                        lambda x,y: mock_submission['mock_sub'])
+
+    def mock_run_submission(**kwargs):
+        if kwargs['submission_id'] == 'mock_sub_0':
+            raise ValueError()
+        return {'run_id': kwargs['submission_id']}
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.run_submission',
+                        mock_run_submission)
+
+    test_queue_log = run_queue(queue_id='mock_queue_1', max_workers=4)
+
+    assert sorted(test_queue_log) == sorted(mock_sub_ids[1:])
+    assert all(test_queue_log[sub_id] == {'run_id': sub_id,
+                                          'wes_id': 'mock_wes'}
+               for sub_id in test_queue_log)
+
+
+def test_submit_run_retries(mock_wes, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.retry_delay', 0)
+    mock_server_error = Exception('mock server error')
+    mock_server_error.status_code = 503
+    mock_wes.id = 'mock_wes'
+    mock_wes.run_workflow.side_effect = [ConnectionError(),
+                                         mock_server_error,
+                                         {'run_id': 'mock_run'}]
+
+    test_run_log = _submit_run(mock_wes, {})
+
+    assert test_run_log == {'run_id': 'mock_run'}
+    assert mock_wes.run_workflow.call_count == 3
+
+
+def test_submit_run_retries_wes_adapter(mock_wes_config, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.retry_delay', 0)
+    mock_session = mock.Mock(name='mock Session')
+    mock_session.request.side_effect = [
+        mock.Mock(status_code=503, text='{"msg": "unavailable"}'),
+        mock.Mock(status_code=200, text='{"run_id": "mock_run"}')
+    ]
+    monkeypatch.setattr('ga4ghtest.services.wes.api.get_session',
+                        lambda url: mock_session)
+    mock_wes = WESService(
+        'mock_wes',
+        api_client=WESAdapter(WESClient(mock_wes_config['mock_wes']))
+    )
+
+    test_run_log = _submit_run(mock_wes, {},
+                               parts=[('workflow_params', '{}')])
+
+    assert test_run_log == {'run_id': 'mock_run'}
+    assert mock_session.request.call_count == 2
+
+
+def test_submit_run_no_retry(mock_wes, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.retry_delay', 0)
+    mock_client_error = Exception('mock client error')
+    mock_client_error.status_code = 400
+    mock_wes.id = 'mock_wes'
+    mock_wes.run_workflow.side_effect = mock_client_error
+
+    with pytest.raises(Exception):
+        _submit_run(mock_wes, {})
+    assert mock_wes.run_workflow.call_count == 1
+
+
+def test_endpoint_slot_rate():
+    test_slot = EndpointSlot(limit=2, rate=50)
+
+    start_time = time.monotonic()
+    for _ in range(6):
+        with test_slot:
+            pass
+
+    assert time.monotonic() - start_time >= 0.09
+
+
 def test_monitor_queue(mock_submission, 
                        mock_queue_log, 
                        mock_wes, 
@@ -103,8 +203,9 @@ def test_monitor_queue(mock_submission,
                         lambda x: 0)
     monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.ctime2datetime', 
                         lambda x: dt.datetime.now())
-    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submission', 
-                        lambda w,x,y,z: None)
+    mock_updates = []
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submissions',
+                        lambda updates: mock_updates.extend(updates))
 
     mock_wes.get_run_status.return_value = {'run_id': 'mock_run', 
                                             'state': 'RUNNING'}
@@ -113,7 +214,89 @@ def test_monitor_queue(mock_submission,
 
     test_queue_log = monitor_queue('mock_queue_1')
     assert test_queue_log == mock_queue_log
+    assert len(mock_updates) == 1
+    assert mock_updates[0][:2] == ('mock_queue_1', 'mock_sub')
+
+
+def test_monitor_queue_shared_client(mock_submission,
+                                     mock_wes,
+                                     monkeypatch):
+    mock_sub_ids = ['mock_sub_{}'.format(i) for i in range(10)]
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.get_submissions',
+                        lambda **kwargs: mock_sub_ids)
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.get_submission_bundle',
+                        lambda x,y: dict(mock_submission['mock_sub'],
+                                         run_log=dict(mock_submission['mock_sub']['run_log'])))
+    mock_wes_ids = []
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.WESService',
+                        lambda wes_id: mock_wes_ids.append(wes_id) or mock_wes)
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.update_submissions',
+                        lambda updates: None)
+    mock_wes.get_run_status.return_value = {'run_id': 'mock_run',
+                                            'state': 'EXECUTOR_ERROR'}
+
+    test_queue_log = monitor_queue('mock_queue_1', max_workers=4)
+
+    assert mock_wes_ids == ['mock_wes']
+    assert mock_wes.get_run_status.call_count == 10
+    assert all(run_log['status'] == 'EXECUTOR_ERROR'
+               for run_log in test_queue_log.values())
+
+
+def test_status_followup(mock_submission,
+                         mock_wes,
+                         monkeypatch):
+    mock_bundle = mock_submission['mock_sub']
+    mock_bundle['run_log']['status'] = 'UNKNOWN'
+    mock_updates = []
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.modify_submission',
+                        lambda x,y,func: mock_updates.append(
+                            (x, y, func(mock_bundle))) or mock_updates[-1][2])
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.WESService',
+                        lambda wes_id: mock_wes)
+    mock_wes.get_run_status.side_effect = [
+        {'run_id': 'mock_run', 'state': 'UNKNOWN'},
+        ConnectionError(),
+        {'run_id': 'mock_run', 'state': 'RUNNING'}
+    ]
+
+    test_followup = StatusFollowup(initial_delay=0.01, max_delay=0.05)
+    test_followup.schedule('mock_queue_1', 'mock_sub', 'mock_wes', 'mock_run')
 
+    assert test_followup.join(timeout=5)
+    assert mock_wes.get_run_status.call_count == 3
+    assert len(mock_updates) == 1
+    assert mock_updates[0][2]['run_log']['status'] == 'RUNNING'
 
 
+def test_status_followup_skips_updated_run(mock_submission,
+                                           mock_wes,
+                                           monkeypatch):
+    mock_bundle = mock_submission['mock_sub']
+    mock_bundle['run_log']['status'] = 'COMPLETE'
+    mock_updates = []
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.modify_submission',
+                        lambda x,y,func: mock_updates.append(func(mock_bundle)))
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.WESService',
+                        lambda wes_id: mock_wes)
+    mock_wes.get_run_status.return_value = {'run_id': 'mock_run',
+                                            'state': 'RUNNING'}
+
+    test_followup = StatusFollowup(initial_delay=0.01)
+    test_followup.schedule('mock_queue_1', 'mock_sub', 'mock_wes', 'mock_run')
+
+    assert test_followup.join(timeout=5)
+    assert mock_updates == [None]
+    assert mock_bundle['run_log']['status'] == 'COMPLETE'
+
+
+def test_status_followup_executor_shutdown(mock_wes, monkeypatch):
+    monkeypatch.setattr('ga4ghtest.core.wes_orchestrator.WESService',
+                        lambda wes_id: mock_wes)
+
+    test_followup = StatusFollowup(initial_delay=0.05)
+    test_followup.schedule('mock_queue_1', 'mock_sub', 'mock_wes', 'mock_run')
+    test_followup._executor.shutdown()
 
+    assert test_followup.join(timeout=5)
+    mock_wes.get_run_status.assert_not_called()